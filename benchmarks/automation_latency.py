@@ -0,0 +1,90 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# UI automation latency benchmark. Runs the RapidFire UI steps of a plate run and of file
+# splitting against an in-memory RapidFire UI (FakeBackend) in which every visited element costs
+# a fixed latency, standing in for UI Automation tree walks. Compares resolving every control
+# anew on every call (reconnecting to the application each time) with the cached automation layer.
+#
+# Example: python benchmarks/automation_latency.py --cycles 5 --latency_ms 2 --filler 200
+################################################################################################
+import time
+import argparse
+import autonoms.agilent_methods.utils_rapidFire as rfu
+from autonoms.agilent_methods.utils_automation import FakeApp, FakeElement, FakeBackend, configure_automation, get_window
+################################################################################################
+
+def build_fake_rapidfire(n_filler = 200):
+    """Builds an in-memory RapidFire UI with the controls used by utils_rapidFire
+
+    :param n_filler: Number of unrelated elements placed before the controls in each window, defaults to 200
+    :type n_filler: int, optional
+    :return: The RapidFire UI application
+    :rtype: `FakeApp`
+    """
+    filler = lambda : [FakeElement(title = f"Pane{i}", control_type = "Pane") for i in range(n_filler)]
+    file_menu = FakeElement(title = "File", control_type = "MenuItem", children = [
+        FakeElement(title = "Load RF Method", control_type = "MenuItem"),
+        FakeElement(title = "Load RF Batch...", control_type = "MenuItem"),
+        FakeElement(title = "Convert MS Data...", control_type = "MenuItem")])
+    tools_menu = FakeElement(title = "System Tools", control_type = "MenuItem", children = [FakeElement(title = "View Log", control_type = "MenuItem")])
+    main_window = FakeElement(title = "RapidFire : Sequences", children = filler() + [
+        file_menu, tools_menu,
+        FakeElement(title = "File name:", class_name = "Edit"),
+        FakeElement(title = "Open", class_name = "Button"),
+        FakeElement(auto_id = "vacTxt", value = "-70"),
+        FakeElement(auto_id = "admeModeBtn"), FakeElement(auto_id = "htsModeBtn"),
+        FakeElement(auto_id = "runBtn"), FakeElement(auto_id = "stopBtn")])
+    splitter_window = FakeElement(title = "Convert MS Data", children = filler() + [
+        FakeElement(auto_id = x) for x in ["autoConvertCheckBox", "dataPathTextBox", "exportPathTextBox", "multipleInjCheckBox",
+                                           "exportButton", "exportProgressLabel"]])
+    log_window = FakeElement(title = "RapidFire Log")
+    return(FakeApp("RapidFire : Sequences", windows = [main_window, splitter_window, log_window]))
+
+def run_cycle(backend, cached):
+    """Runs the UI steps of one plate run and file split
+
+    :param backend: Automation backend
+    :type backend: `FakeBackend`
+    :param cached: Keep application connections and resolved controls between steps
+    :type cached: bool
+    """
+    def window():
+        if not cached:
+            # Reconnect and drop all resolved controls, as every remote call did before the automation layer
+            configure_automation(backend)
+        return(rfu.initialize_app()[1])
+    def splitter_window():
+        if not cached:
+            configure_automation(backend)
+        return(get_window(rfu.RF_APP_TITLE_RE, text = "Convert MS Data"))
+    rfu.set_splitter_autoconvert(splitter_window(), False)
+    rfu.set_run_mode(window(), "Sequences")
+    rfu.load_rf_method(window(), "M:\\methods\\method.rfcfg")
+    rfu.load_rf_batch(window(), "M:\\batches\\batch.rfbat")
+    rfu.check_vac_pressure(window())
+    rfu.run_split(splitter_window(), "M:\\data\\run")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark RapidFire UI automation latency against an in-memory UI")
+    parser.add_argument('--cycles', type = int, default = 5)
+    parser.add_argument('--latency_ms', type = float, default = 2, help = "Latency per visited UI element")
+    parser.add_argument('--filler', type = int, default = 200, help = "Unrelated elements per window")
+    args = parser.parse_args()
+
+    results = {}
+    for cached in [False, True]:
+        backend = FakeBackend([build_fake_rapidfire(args.filler)], latency_seconds = args.latency_ms / 1000)
+        configure_automation(backend)
+        start = time.perf_counter()
+        for _ in range(args.cycles):
+            run_cycle(backend, cached)
+        elapsed = (time.perf_counter() - start) / args.cycles
+        label = "cached" if cached else "uncached"
+        results[label] = elapsed
+        print(f"{label:<9} {elapsed * 1000:9.1f} ms per cycle, {backend.stats['visited'] / args.cycles:8.0f} elements visited, "
+              f"{backend.stats['connects'] / args.cycles:5.1f} connects")
+    print(f"speedup: {results['uncached'] / results['cached']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Import-time budget check for the command-line and rpyc server entry points. Each target is
+# imported in a fresh interpreter and must stay within its time budget without pulling in any
+# of the heavy dependencies (which should only be imported by the code paths that need them).
+# Exits with a non-zero status if any budget is exceeded.
+#
+# Example: python benchmarks/import_time.py --repeats 5
+################################################################################################
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+################################################################################################
+
+# Module : import time budget in seconds (on top of bare interpreter startup)
+BUDGETS = {
+    "autonoms.cli" : 0.25,
+    "autonoms.agilent_methods.rf_rpyc_server" : 0.5,
+    "autonoms.agilent_methods.CCSCal" : 0.25,
+    "autonoms.agilent_methods.utils_plates" : 0.25,
+    "autonoms.agilent_methods.utils_rapidFire" : 0.25,
+}
+
+# Dependencies which must not be imported by the modules above
+HEAVY_MODULES = ["pandas", "numpy", "scipy", "deimos", "prefect", "pywinauto", "openpyxl"]
+
+def time_command(code, repeats):
+    """Runs python code in fresh interpreters and returns the fastest wall time
+
+    :param code: Python code to run
+    :type code: str
+    :param repeats: Number of runs
+    :type repeats: int
+    :return: Tuple of fastest wall time in seconds and the stdout of the last run
+    :rtype: tuple
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], stdout = subprocess.PIPE, check = True).stdout.decode()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return(best, out)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Check import times of the AutonoMS entry points")
+    parser.add_argument('--repeats', type = int, default = 5)
+    parser.add_argument('--scale', type = float, default = 1.0, help = "Multiply all budgets, e.g. for slow instrument PCs")
+    args = parser.parse_args()
+
+    baseline, _ = time_command("pass", args.repeats)
+    failures = []
+    for module, budget in BUDGETS.items():
+        code = f"import sys, json, {module}; print(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))"
+        elapsed, out = time_command(code, args.repeats)
+        import_seconds = max(elapsed - baseline, 0)
+        heavy = json.loads(out.strip().splitlines()[-1])
+        ok = import_seconds <= budget * args.scale and not heavy
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<45} {import_seconds * 1000:7.1f} ms (budget {budget * args.scale * 1000:.0f} ms)" +
+              (f", imports {', '.join(heavy)}" if heavy else ""))
+        if not ok:
+            failures.append(module)
+    help_seconds, _ = time_command("from autonoms.cli import get_parser; get_parser().format_help()", args.repeats)
+    print(f"autonoms-run --help: {max(help_seconds - baseline, 0) * 1000:.1f} ms")
+    if failures:
+        sys.exit(f"Error - import budget exceeded for {', '.join(failures)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Tune mzML reading benchmark. Writes a synthetic IM-MS tune .mzML file (one MS1 spectrum per
+# drift time bin, zlib compressed 64-bit m/z and 32-bit intensity arrays, with tune ion peaks)
+# and compares the time and peak memory of reading the tune ion m/z windows with the streaming
+# reader of mzml_stream against loading every MS1 point into a frame first (as deimos.load did)
+# and slicing it, checking that both keep the same points.
+#
+# Example: python benchmarks/mzml_read.py -w mzml_work --spectra 4000 --points 2000
+################################################################################################
+import os
+import time
+import zlib
+import base64
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+import autonoms.agilent_methods.mzml_stream as ms
+################################################################################################
+
+TUNE_MZ = [118.086255, 322.048121, 622.028960, 922.009798, 1221.990637, 1521.971475]
+
+def encode_array(values, dtype):
+    return(base64.b64encode(zlib.compress(np.asarray(values, dtype = dtype).tobytes())).decode("ascii"))
+
+def binary_data_array(values, dtype_accession, dtype, array_accession, array_name):
+    encoded = encode_array(values, dtype)
+    return(f'''<binaryDataArray encodedLength="{len(encoded)}">
+<cvParam cvRef="MS" accession="{dtype_accession}" name="{'32' if dtype == '<f4' else '64'}-bit float" value=""/>
+<cvParam cvRef="MS" accession="{ms.ZLIB_COMPRESSION}" name="zlib compression" value=""/>
+<cvParam cvRef="MS" accession="{array_accession}" name="{array_name}" value=""/>
+<binary>{encoded}</binary>
+</binaryDataArray>''')
+
+def write_synthetic_mzml(out_file, n_spectra, n_points, seed = 0):
+    """Writes a synthetic positive mode IM-MS .mzML file
+
+    :param out_file: Path to output .mzML file
+    :type out_file: str
+    :param n_spectra: Number of MS1 spectra (drift time bins)
+    :type n_spectra: int
+    :param n_points: Number of points per spectrum
+    :type n_points: int
+    :param seed: Random seed, defaults to 0
+    :type seed: int, optional
+    """
+    rng = np.random.default_rng(seed)
+    with open(out_file, 'w') as f:
+        print('<?xml version="1.0" encoding="utf-8"?>', file = f)
+        print('<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">', file = f)
+        print('<run id="tune"><spectrumList count="{}">'.format(n_spectra), file = f)
+        for i in range(n_spectra):
+            drift_time = 10 + 40 * i / n_spectra
+            mz = np.sort(np.concatenate([rng.uniform(100, 1700, n_points - 6 * 20),
+                                         np.array([x + rng.normal(0, x * 2e-6, 20) for x in TUNE_MZ]).ravel()]))
+            intensity = rng.exponential(50, len(mz)).astype(np.float32)
+            print(f'''<spectrum index="{i}" id="frame=1 scan={i + 1}" defaultArrayLength="{len(mz)}">
+<cvParam cvRef="MS" accession="{ms.MS_LEVEL}" name="ms level" value="1"/>
+<cvParam cvRef="MS" accession="{ms.POSITIVE_SCAN}" name="positive scan" value=""/>
+<scanList count="1"><scan>
+<cvParam cvRef="MS" accession="{ms.SCAN_START_TIME}" name="scan start time" value="0.05" unitAccession="UO:0000031"/>
+<cvParam cvRef="MS" accession="{ms.DRIFT_TIME}" name="ion mobility drift time" value="{drift_time:.4f}" unitAccession="UO:0000028"/>
+</scan></scanList>
+<binaryDataArrayList count="2">
+{binary_data_array(mz, ms.FLOAT_64, '<f8', ms.MZ_ARRAY, 'm/z array')}
+{binary_data_array(intensity, ms.FLOAT_32, '<f4', ms.INTENSITY_ARRAY, 'intensity array')}
+</binaryDataArrayList>
+</spectrum>''', file = f)
+        print('</spectrumList></run></mzML>', file = f)
+
+def full_load_windows(mzml_file, windows):
+    # Loads every MS1 point into a frame (float64 columns plus polarity columns, as deimos.load did) and then slices the windows
+    columns = {"mz" : [], "intensity" : [], "drift_time" : [], "retention_time" : [], "Positive Scan" : [], "Negative Scan" : []}
+    for spectrum, ns, param_groups in ms.iter_spectra(mzml_file):
+        params = ms.cv_params(spectrum, ns, param_groups)
+        for scan in spectrum.iter(f"{ns}scan"):
+            params.update(ms.cv_params(scan, ns, param_groups))
+        arrays = dict(ms.decode_binary_array(x, ns, param_groups) for x in spectrum.iter(f"{ns}binaryDataArray"))
+        n = len(arrays[ms.MZ_ARRAY])
+        columns["mz"].append(arrays[ms.MZ_ARRAY].astype(np.float64))
+        columns["intensity"].append(arrays[ms.INTENSITY_ARRAY].astype(np.float64))
+        columns["drift_time"].append(np.full(n, float(params[ms.DRIFT_TIME])))
+        columns["retention_time"].append(np.full(n, float(params[ms.SCAN_START_TIME])))
+        columns["Positive Scan"].append(np.full(n, float(ms.POSITIVE_SCAN in params)))
+        columns["Negative Scan"].append(np.full(n, float(ms.NEGATIVE_SCAN in params)))
+    df = pd.DataFrame({k : np.concatenate(v) for k, v in columns.items()})
+    keep = np.zeros(len(df), dtype = bool)
+    for low, high in windows:
+        keep |= (df["mz"].values >= low) & (df["mz"].values <= high)
+    return(df[keep].reset_index(drop = True))
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    peak_mb = tracemalloc.get_traced_memory()[1] / (1 << 20)
+    tracemalloc.stop()
+    return(result, seconds, peak_mb)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark reading tune ion windows from an IM-MS .mzML file")
+    parser.add_argument('-w', '--work_dir', required = True)
+    parser.add_argument('--spectra', type = int, default = 4000)
+    parser.add_argument('--points', type = int, default = 2000)
+    parser.add_argument('--mz_tol_ppm', type = float, default = 10)
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok = True)
+    mzml_file = os.path.join(args.work_dir, "tune.mzML")
+    write_synthetic_mzml(mzml_file, args.spectra, args.points)
+    print(f"{args.spectra} spectra x {args.points} points, .mzML {os.path.getsize(mzml_file) / (1 << 20):.1f} MB")
+    windows = ms.ppm_windows(TUNE_MZ, args.mz_tol_ppm)
+    full, full_seconds, full_mb = measure(full_load_windows, mzml_file, windows)
+    print(f"{'full load':<10} {full_seconds:8.2f} s, peak memory {full_mb:8.1f} MB")
+    streamed, streamed_seconds, streamed_mb = measure(ms.read_mzml_windows, mzml_file, windows)
+    print(f"{'streaming':<10} {streamed_seconds:8.2f} s, peak memory {streamed_mb:8.1f} MB, kept {streamed.n_kept} of {streamed.n_points} points")
+    columns = ["mz", "intensity", "drift_time", "retention_time"]
+    if not np.array_equal(full[columns].values.astype(np.float32), streamed.points[columns].values):
+        raise RuntimeError("streaming and full load keep different points")
+    print(f"peak memory reduced {full_mb / streamed_mb:.1f}x, kept points identical")
+
+if __name__ == "__main__":
+    main()
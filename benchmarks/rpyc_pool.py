@@ -0,0 +1,110 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# rpyc connection benchmark and check. Serves RapidFireService locally (rf_rpyc_server.get_server
+# on localhost) and times calls made with a new connection per call against calls through the
+# connection pool of utils_rpyc. Also checks that pooled calls return the same results, that
+# concurrent callers share a bounded number of connections, that a dropped connection is replaced,
+# and that calls run on the job queue of the service (non-status functions) go through the pool.
+#
+# Example: python benchmarks/rpyc_pool.py --calls 200 --threads 8
+################################################################################################
+import os
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import rpyc
+from autonoms.utils_rpyc import ConnectionPool
+from autonoms.agilent_methods.rf_rpyc_server import get_server
+from autonoms.utils_wait import wait_or_exit
+################################################################################################
+
+LOG_LINE = "01/02/2024 10:15:30 AM: Injection started for well A1"
+
+def start_local_server(port):
+    """Starts a RapidFireService on localhost in a background thread and waits until it accepts connections
+
+    :param port: Port to serve on
+    :type port: int
+    :return: The running server
+    :rtype: `rpyc.utils.server.ThreadedServer`
+    """
+    server = get_server(port = port)
+    threading.Thread(target = server.start, daemon = True).start()
+    def accepting():
+        try:
+            rpyc.connect("localhost", port).close()
+            return(True)
+        except OSError:
+            return(False)
+    wait_or_exit(accepting, 10, description = f"local rpyc server on port {port}")
+    return(server)
+
+def parsed_line(connection_root):
+    timestamp, message = connection_root.call_function("parse_batch_log_line", LOG_LINE)
+    return((str(timestamp), str(message)))
+
+def time_calls(function, n_calls):
+    start = time.perf_counter()
+    results = [function() for _ in range(n_calls)]
+    return(results, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark and check the rpyc connection pool against a local RapidFireService")
+    parser.add_argument('--port', type = int, default = 18871)
+    parser.add_argument('--calls', type = int, default = 200)
+    parser.add_argument('--threads', type = int, default = 8)
+    args = parser.parse_args()
+
+    server = start_local_server(args.port)
+    pool = ConnectionPool(max_idle = args.threads, keepalive_seconds = 0)
+    try:
+        def call_new_connection():
+            connection = rpyc.connect("localhost", args.port)
+            try:
+                return(parsed_line(connection.root))
+            finally:
+                connection.close()
+        def call_pooled():
+            with pool.connection("localhost", args.port) as connection:
+                return(parsed_line(connection.root))
+        direct_results, direct_seconds = time_calls(call_new_connection, args.calls)
+        print(f"{'new connection':<16} {direct_seconds:8.2f} s, {1000 * direct_seconds / args.calls:6.2f} ms per call")
+        pooled_results, pooled_seconds = time_calls(call_pooled, args.calls)
+        print(f"{'pooled':<16} {pooled_seconds:8.2f} s, {1000 * pooled_seconds / args.calls:6.2f} ms per call, {pool.stats['connects']} connections opened")
+        if pooled_results != direct_results:
+            raise RuntimeError("pooled calls returned different results than calls on new connections")
+
+        with ThreadPoolExecutor(max_workers = args.threads) as executor:
+            concurrent_results = list(executor.map(lambda _ : call_pooled(), range(args.calls)))
+        if concurrent_results != direct_results[ : 1] * args.calls:
+            raise RuntimeError("concurrent pooled calls returned different results")
+        if pool.stats["connects"] > args.threads:
+            raise RuntimeError(f"{args.threads} concurrent callers opened {pool.stats['connects']} connections")
+        print(f"{args.threads} concurrent callers used {pool.stats['connects']} connections")
+
+        # Drop the idle connections as if the network had closed them, the next call has to reconnect
+        for entries in pool.idle.values():
+            for connection, _ in entries:
+                connection.close()
+        if call_pooled() != direct_results[0] or pool.stats["reconnects"] == 0:
+            raise RuntimeError("a dropped connection was not replaced")
+        print(f"dropped connections replaced ({pool.stats['reconnects']} reconnects)")
+
+        # Functions other than status functions run on the job queue of the service
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rfbat_file = os.path.join(temp_dir, "batch.rfbat")
+            with open(rfbat_file, 'w') as f:
+                f.write("<RFBatch><Plates><BatchPlate/><BatchPlate/></Plates></RFBatch>")
+            n_plates = pool.call("localhost", args.port, "count_rfbat_plates", (rfbat_file, ))
+        if n_plates != 2:
+            raise RuntimeError(f"job queue call returned {n_plates} plates instead of 2")
+        print(f"job queue call through the pool returned {n_plates} plates, pooled calls {direct_seconds / pooled_seconds:.1f}x faster")
+    finally:
+        pool.close()
+        server.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# End-to-end throughput benchmark. Runs main_flow against the simulated RapidFire and 6560
+# (see autonoms.agilent_methods.instrument_simulation) on synthetic experiments, with stub
+# executables standing in for the instrument PC tools (see stub_tool.py), and reports per-stage
+# and end-to-end wall time, CPU utilization, and peak disk use.
+#
+# Example: python benchmarks/run_benchmark.py -w bench_work --plates 1 10 50 --modes sequential pipeline
+################################################################################################
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import pandas as pd
+from stub_tool import load_profile, simulate_work, PROFILE_ENV_VAR
+import autonoms.workflow_control as wc
+from autonoms.cli import get_args as get_flow_args
+################################################################################################
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_XLSX = os.path.join(REPO_DIR, "experiment_templates", "experimentTemplate_short.xlsx")
+STUB_TOOLS = ["mh_splitter", "pnnl_preprocessor", "msconvert", "skyline", "start_mh_rf"]
+MODE_FLAGS = {"sequential" : [], "pipeline" : ["-p"], "stream" : ["-s"]}
+STAGES = ["acquired", "split", "demuxed", "calibrated", "analyzed"]
+
+################################################################################################
+# Synthetic experiment setup
+################################################################################################
+def write_stub_executables(bin_dir):
+    """Writes one executable wrapper around stub_tool.py for every stubbed tool
+
+    :param bin_dir: Output directory
+    :type bin_dir: str
+    :return: Dictionary of tool : executable path pairs
+    :rtype: dict
+    """
+    os.makedirs(bin_dir, exist_ok = True)
+    stub_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_tool.py")
+    exes = {}
+    for tool in STUB_TOOLS:
+        if os.name == "nt":
+            exe = os.path.join(bin_dir, f"{tool}.bat")
+            with open(exe, 'w') as f:
+                print(f'@"{sys.executable}" "{stub_script}" {tool} %*', file = f)
+        else:
+            exe = os.path.join(bin_dir, tool)
+            with open(exe, 'w') as f:
+                print(f'#!/bin/sh\nexec "{sys.executable}" "{stub_script}" {tool} "$@"', file = f)
+            os.chmod(exe, 0o755)
+        exes[tool] = exe
+    return(exes)
+
+def plate_wells(n_wells):
+    """Gets the first n_wells wells of a 384 well plate (skipping row A), in injection order
+
+    :param n_wells: Number of wells
+    :type n_wells: int
+    :return: List of well names
+    :rtype: list
+    """
+    wells = [f"{row}{col}" for row in "BCDEFGHIJKLMNOP" for col in range(1, 25)]
+    if n_wells > len(wells):
+        sys.exit(f"Error - at most {len(wells)} wells per plate are supported")
+    return(wells[ : n_wells])
+
+def write_experiment(out_xlsx, n_plates, wells_per_plate, tune_every):
+    """Writes a synthetic experiment definition file based on the short experiment template
+
+    :param out_xlsx: Path to output .xlsx file
+    :type out_xlsx: str
+    :param n_plates: Number of plates (sequences)
+    :type n_plates: int
+    :param wells_per_plate: Number of injections per plate
+    :type wells_per_plate: int
+    :param tune_every: A TUNE injection is placed before every tune_every-th injection
+    :type tune_every: int
+    """
+    sheets = pd.read_excel(TEMPLATE_XLSX, sheet_name = None)
+    template_row = sheets["samples"].iloc[0]
+    rows = []
+    for i_plate in range(n_plates):
+        for i_well, well in enumerate(plate_wells(wells_per_plate)):
+            sample_type = "TUNE" if i_well % tune_every == 0 else "SAMPLE"
+            rows.append({"Well" : well, "Description" : "Tune Mix" if sample_type == "TUNE" else "Sample", "Sequence" : f"Plate{i_plate + 1:03d}",
+                         "Sample_Number" : i_well + 1, "Replicate_Number" : 1, "Sample_Type" : sample_type, "6560_Method" : template_row["6560_Method"],
+                         "Plate_Type" : template_row["Plate_Type"], "Column_Type" : template_row["Column_Type"], "Notes" : ""})
+    sheets["samples"] = pd.DataFrame(rows)
+    analysis_files = {"tuneIons_file" : os.path.join(REPO_DIR, "transition_lists", "agilentTuneRestrictedDeimos_transitionList.csv"),
+                      "sky_imsdb_file" : os.path.join(REPO_DIR, "skyline_documents", "ymdb.imsdb"),
+                      "sky_document_file" : os.path.join(REPO_DIR, "skyline_documents", "ymdb_IMres30.sky"),
+                      "transition_list_file" : os.path.join(REPO_DIR, "transition_lists", "ymdb_transition_list.csv"),
+                      "sky_report_file" : os.path.join(REPO_DIR, "report_templates", "MoleculeReportShort.skyr")}
+    df_analysis = sheets["data_analysis"]
+    df_analysis["Value"] = df_analysis["Parameter"].map(analysis_files).fillna(df_analysis["Value"])
+    with pd.ExcelWriter(out_xlsx) as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name = sheet_name, index = False)
+
+def write_config(out_toml, exes, rf_data_dir, extra_configs):
+    """Writes an AutonoMS configuration file pointing to the stub executables
+
+    :param out_toml: Path to output .toml file
+    :type out_toml: str
+    :param exes: Dictionary of tool : stub executable path pairs
+    :type exes: dict
+    :param rf_data_dir: RapidFire data directory written to by the simulated RapidFire
+    :type rf_data_dir: str
+    :param extra_configs: Additional configuration entries (overriding the defaults)
+    :type extra_configs: dict
+    """
+    configs = {"pnnl_path" : exes["pnnl_preprocessor"], "start_mh_rf_path" : exes["start_mh_rf"], "rapid_fire_data_dir" : rf_data_dir,
+               "mh_splitter_exe" : exes["mh_splitter"], "msconvert_exe" : exes["msconvert"], "skyline_exe" : exes["skyline"],
+               "instrument_timeout_seconds" : 50000, "data_analysis_timeout_seconds" : 50000, "prep_timeout_seconds" : 10000,
+               "instrument_run_concurrent_tasks" : 1, "preprocessing_concurrent_tasks" : 4, "data_analysis_concurrent_tasks" : 4}
+    configs.update(extra_configs)
+    with open(out_toml, 'w') as f:
+        for k, v in configs.items():
+            print(f"{k} = {json.dumps(v)}", file = f)
+
+def stub_ccs_cal(mzml_file, tuneIons_file):
+    """Stand-in for autonoms.agilent_methods.CCSCal.ccs_cal, spends the "ccs_cal" profile time and returns a fixed calibration
+    """
+    simulate_work(load_profile()["ccs_cal"])
+    return('<?xml version="1.0" encoding="utf-8"?>\n<OverrideImsCal><SingleFieldCcsCoefficients>'
+           '<TFix>0.0</TFix><Beta>0.13</Beta></SingleFieldCcsCoefficients></OverrideImsCal>')
+
+################################################################################################
+# Measurement
+################################################################################################
+class DiskSampler:
+    """Samples the total size of the files under a set of directories in a background thread and keeps the peak
+
+    :param paths: Directories to measure
+    :type paths: list
+    :param interval_seconds: Seconds between samples, defaults to 0.5
+    :type interval_seconds: float, optional
+    """
+    def __init__(self, paths, interval_seconds = 0.5):
+        self.paths = paths
+        self.interval_seconds = interval_seconds
+        self.peak_bytes = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target = self._run, daemon = True, name = "disk_sampler")
+
+    def tree_size(self, path):
+        total = 0
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return(0)
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks = False):
+                    total += self.tree_size(entry.path)
+                else:
+                    st = entry.stat(follow_symlinks = False)
+                    total += st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+            except OSError:
+                pass
+        return(total)
+
+    def sample(self):
+        self.peak_bytes = max(self.peak_bytes, sum(self.tree_size(x) for x in self.paths))
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            self.sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return(self)
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+def stage_times(manifest_file, run_start):
+    """Computes the time spent in every stage from the run manifest stage history
+
+    :param manifest_file: Path to run_manifest.json
+    :type manifest_file: str
+    :param run_start: Epoch time at which the run was started
+    :type run_start: float
+    :return: Dictionary of stage : {"mean_seconds", "max_seconds"} pairs, a stage's time is measured from the previous stage recorded for the same sequence
+    :rtype: dict
+    """
+    with open(manifest_file, 'r') as f:
+        manifest_d = json.load(f)
+    durations = {x : [] for x in STAGES}
+    for sequence_d in manifest_d["sequences"].values():
+        last_t = run_start
+        for stage, t in sequence_d["history"]:
+            if stage in durations:
+                durations[stage].append(t - last_t)
+            last_t = t
+    return({k : {"mean_seconds" : sum(v) / len(v), "max_seconds" : max(v)} for k, v in durations.items() if v})
+
+def run_experiment(run_dir, exes, n_plates, mode, args):
+    """Runs main_flow on one synthetic experiment and measures it
+
+    :param run_dir: Directory for the run (replaced if it exists)
+    :type run_dir: str
+    :param exes: Dictionary of tool : stub executable path pairs
+    :type exes: dict
+    :param n_plates: Number of plates
+    :type n_plates: int
+    :param mode: One of MODE_FLAGS
+    :type mode: str
+    :param args: Benchmark arguments
+    :type args: Namespace
+    :return: Benchmark result
+    :rtype: dict
+    """
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    experiment_file = os.path.join(run_dir, "experiment.xlsx")
+    config_file = os.path.join(run_dir, "config.toml")
+    output_dir = os.path.join(run_dir, "output")
+    rf_data_dir = os.path.join(run_dir, "rf_data")
+    os.makedirs(rf_data_dir)
+    write_experiment(experiment_file, n_plates, args.wells, args.tune_every)
+    extra_configs = {"simulation_speedup" : args.speedup, "simulation_scan_mb_per_injection" : args.scan_mb}
+    extra_configs.update(json.loads(args.configs) if args.configs else {})
+    if args.cache:
+        extra_configs.setdefault("cache_dir", os.path.join(run_dir, "cache"))
+    write_config(config_file, exes, rf_data_dir, extra_configs)
+    flow_args = get_flow_args(["-i", experiment_file, "-c", config_file, "-o", output_dir, "-n", "--simulate"] + MODE_FLAGS[mode])
+
+    print(f"Running benchmark: {n_plates} plates x {args.wells} wells, {mode} mode")
+    times_start = os.times()
+    run_start = time.time()
+    with DiskSampler([output_dir, rf_data_dir, os.path.join(run_dir, "cache")], interval_seconds = args.disk_interval) as disk_sampler:
+        wall_start = time.perf_counter()
+        wc.main_flow(flow_args)
+        wall_seconds = time.perf_counter() - wall_start
+    times_end = os.times()
+    cpu_seconds = sum(times_end[i] - times_start[i] for i in range(4))
+    with open(os.path.join(output_dir, "executor_stats.json"), 'r') as f:
+        tool_stats = json.load(f)["tools"]
+    result = {"plates" : n_plates, "wells_per_plate" : args.wells, "mode" : mode, "wall_seconds" : wall_seconds,
+              "cpu_seconds" : cpu_seconds, "cpu_utilization" : cpu_seconds / (wall_seconds * (os.cpu_count() or 1)),
+              "peak_disk_bytes" : disk_sampler.peak_bytes, "stages" : stage_times(os.path.join(output_dir, "run_manifest.json"), run_start),
+              "tools" : tool_stats}
+    if not args.keep:
+        shutil.rmtree(run_dir)
+    return(result)
+
+def print_result(result, baseline = None):
+    """Prints a benchmark result, compared to a baseline result if provided
+    """
+    change = ""
+    if baseline:
+        change = f" ({100 * (result['wall_seconds'] / baseline['wall_seconds'] - 1):+.1f}% vs baseline)"
+    print(f"\n{result['plates']} plates x {result['wells_per_plate']} wells, {result['mode']} mode")
+    print(f"\tend-to-end wall time : {result['wall_seconds']:.1f} s{change}")
+    print(f"\tCPU time : {result['cpu_seconds']:.1f} s ({100 * result['cpu_utilization']:.1f}% of {os.cpu_count()} CPUs)")
+    print(f"\tpeak disk use : {result['peak_disk_bytes'] / 1024 ** 3:.2f} GB")
+    for stage, stage_d in result["stages"].items():
+        print(f"\tstage {stage:<10} : mean {stage_d['mean_seconds']:.1f} s, max {stage_d['max_seconds']:.1f} s")
+    for tool, tool_d in result["tools"].items():
+        print(f"\ttool {tool:<17} : {tool_d['jobs']} jobs, run {tool_d['total_run_seconds']:.1f} s, queued {tool_d['total_wait_seconds']:.1f} s")
+
+################################################################################################
+def get_args():
+    """Helper function for initializing arguments on command line invocation
+    :return: Parameter arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser(description = "AutonoMS end-to-end throughput benchmark with simulated instruments and stub instrument tools")
+    parser.add_argument('-w', '--work_dir', required = True, help = "Directory for benchmark runs")
+    parser.add_argument('--plates', type = int, nargs = "+", default = [1, 5], help = "Experiment sizes (number of plates) to run, 1-50")
+    parser.add_argument('--modes', nargs = "+", default = ["sequential"], choices = list(MODE_FLAGS.keys()))
+    parser.add_argument('--wells', type = int, default = 24, help = "Injections per plate")
+    parser.add_argument('--tune_every', type = int, default = 8, help = "Place a TUNE injection before every N-th injection")
+    parser.add_argument('--speedup', type = float, default = 60, help = "Instrument seconds per wall-clock second of the simulated instruments")
+    parser.add_argument('--scan_mb', type = float, default = 4, help = "MB of scan data the simulated RapidFire writes per injection")
+    parser.add_argument('--profile', help = "Stub tool profile .json file overriding the stub_tool.py defaults")
+    parser.add_argument('--configs', help = "JSON dictionary of additional AutonoMS configuration entries, e.g. '{\"skyline_shards\" : 4}'")
+    parser.add_argument('--cache', action = "store_true", help = "Enable the artifact cache")
+    parser.add_argument('--disk_interval', type = float, default = 0.5, help = "Seconds between disk use samples")
+    parser.add_argument('--results_file', help = "Output .json file for results, defaults to benchmark_results.json in the work directory")
+    parser.add_argument('--baseline', help = "Results .json file of a previous benchmark to compare wall times against")
+    parser.add_argument('--keep', action = "store_true", help = "Keep run directories")
+    args = parser.parse_args()
+    if not all(1 <= x <= 50 for x in args.plates):
+        parser.error("--plates must be between 1 and 50")
+    args.work_dir = os.path.abspath(args.work_dir)
+    return(args)
+
+def main():
+    args = get_args()
+    os.makedirs(args.work_dir, exist_ok = True)
+    profile_file = os.path.join(args.work_dir, "stub_profile.json")
+    with open(profile_file, 'w') as f:
+        json.dump(load_profile(args.profile), f, indent = 2)
+    os.environ[PROFILE_ENV_VAR] = profile_file
+    exes = write_stub_executables(os.path.join(args.work_dir, "bin"))
+    wc.ccs_cal = stub_ccs_cal
+    baselines = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baselines = {(x["plates"], x["mode"]) : x for x in json.load(f)}
+    results = []
+    for mode in args.modes:
+        for n_plates in args.plates:
+            result = run_experiment(os.path.join(args.work_dir, f"{mode}_{n_plates}plates"), exes, n_plates, mode, args)
+            results.append(result)
+            print_result(result, baselines.get((n_plates, mode)))
+    results_file = args.results_file or os.path.join(args.work_dir, "benchmark_results.json")
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print(f"\nBenchmark results written to {results_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# RapidFire output parser benchmark. Writes a synthetic multi-plate RFDatabase.xml and
+# RFFileSplitter.log and times getting the sequence .d file and splits of every plate (as the
+# workflow does once per sequence) with the streaming parsers of splitterExtract against the
+# previous implementation (a full ElementTree parse with XPath lookups per injection and a
+# multiline regex over the whole splitter log), checking that both agree. Peak memory is measured
+# separately for the first plate. With --unlabeled the splitter log time ranges are written without
+# their labels, so the positional fallback of splitterExtract.iter_splitter_log is compared.
+#
+# Example: python benchmarks/splitter_parse.py -w parse_work --injections 10000
+################################################################################################
+import os
+import re
+import time
+import argparse
+import tracemalloc
+import xml.etree.ElementTree as ET
+import autonoms.agilent_methods.splitterExtract as se
+from autonoms.agilent_methods.instrument_simulation import SimulatedPlate, write_rf_database
+################################################################################################
+
+WELLS = [f"{row}{col}" for row in "ABCDEFGHIJKLMNOP" for col in range(1, 25)]
+
+def write_synthetic_run(out_dir, n_injections, wells_per_plate = 384, injection_minutes = 0.12, labeled = True):
+    """Writes a RFDatabase.xml and RFFileSplitter.log for a multi-plate batch
+
+    :param out_dir: Output directory
+    :type out_dir: str
+    :param n_injections: Total number of injections
+    :type n_injections: int
+    :param wells_per_plate: Injections per plate, defaults to 384
+    :type wells_per_plate: int, optional
+    :param injection_minutes: Minutes per injection, defaults to 0.12
+    :type injection_minutes: float, optional
+    :param labeled: If False, the time range lines of the splitter log are written without their "Original time range" and "Effective time range" 
+        labels and a "Writing" line of a non-injection file is added to every plate, so only the positional fields can be read, defaults to True
+    :type labeled: bool, optional
+    :return: Paths to the RFDatabase.xml and RFFileSplitter.log files and list of plate barcodes
+    :rtype: tuple
+    """
+    os.makedirs(out_dir, exist_ok = True)
+    plates = []
+    for i_plate in range(0, n_injections, wells_per_plate):
+        plates.append(SimulatedPlate(f"Plate{len(plates) + 1:03d}", WELLS[ : min(wells_per_plate, n_injections - i_plate)], 0))
+    rfdb_file = os.path.join(out_dir, "RFDatabase.xml")
+    write_rf_database(rfdb_file, plates)
+    splitter_file = os.path.join(out_dir, "RFFileSplitter.log")
+    i_injection = 0
+    with open(splitter_file, 'w') as f:
+        for plate in plates:
+            if not labeled:
+                print(f"Writing {os.path.join(out_dir, f'{plate.barcode}.summary.txt')}", file = f)
+            for i_well, well in enumerate(plate.wells):
+                i_injection += 1
+                start, end = i_well * injection_minutes, (i_well + 1) * injection_minutes
+                print(f"Writing {os.path.join(out_dir, f'Inj{i_injection:05d}-{plate.barcode}-{well}.d')}", file = f)
+                print(f"{'Original time range' if labeled else 'Range'}: {start:.4f}-{end:.4f}", file = f)
+                print(f"Peak start: {end:.4f}", file = f)
+                print(f"Peak end: {end + injection_minutes:.4f}", file = f)
+                print(f"{'Effective time range' if labeled else 'Range used'}: {end:.4f}-{end + injection_minutes:.4f}", file = f)
+                print(f"Frames written: 1", file = f)
+                print(f"Time taken: 0.5 s", file = f)
+    return(rfdb_file, splitter_file, [x.barcode for x in plates])
+
+def legacy_get_sequence_d_file(RFDB, barcode):
+    # splitterExtract.get_sequence_d_file before the streaming parsers, for comparison
+    root = ET.parse(RFDB).getroot()
+    samples = [x for x in root.iterfind("Plates/Plate/Injections/SampleInfo") if x.find("./Field/Name[.='Barcode']/../Value").text == barcode]
+    sequences = set(x.find(".//Name[.='Sequence']/../Value").text for x in samples)
+    return(f"sequence{sequences.pop()}.d")
+
+def legacy_get_splits(splitterLog, RFDB, dFile, barcode = None):
+    # splitterExtract.get_splits before the streaming parsers, for comparison
+    sequence = os.path.basename(dFile.lower()).replace(".demp.d", "").replace('.d', '').replace('sequence', '')
+    root = ET.parse(RFDB).getroot()
+    samples = [x for x in root.iterfind("Plates/Plate/Injections/SampleInfo") if x.find(".//Name[.='Sequence']/../Value").text == sequence]
+    if barcode is not None:
+        samples = [x for x in samples if x.find("./Field/Name[.='Barcode']/../Value").text == barcode]
+    barcode = [s.find("./Field/Name[.='Barcode']/../Value").text for s in samples][0]
+    with open(splitterLog, 'r') as f:
+        logLines = f.read()
+    splitterLines = re.findall(rf"Writing .*-{barcode}-.*\.d.*\n.*\n.*\n.*\n.*\n.*\nTime.*", logLines)
+    effectiveTimes = [tuple(float(y) for y in x.split('\n')[4].split(': ')[-1].split('-')) for x in splitterLines]
+    effectiveTimesStart = [x[0] for x in effectiveTimes]
+    diffs = [effectiveTimesStart[i] - effectiveTimesStart[i - 1] for i in range(1, len(effectiveTimesStart))] if len(effectiveTimes) > 1 else [0]
+    diffs = diffs + [diffs[-1]] if len(effectiveTimes) > 1 else diffs
+    outSufs = [re.findall(rf"Inj.*\.d", x)[0].replace('.d', '') for x in splitterLines]
+    return([(os.path.basename(dFile), f"{outSufs[i]}.d", max(s - diffs[i], 0.1), e - diffs[i]) for i, (s, e) in enumerate(effectiveTimes)])
+
+def plate_splits(functions, rfdb_file, splitter_file, barcodes, data_dir):
+    """Gets the sequence .d file and splits of plates, as the workflow does once per sequence
+
+    :param functions: Tuple of (get_sequence_d_file, get_splits) functions to use
+    :type functions: tuple
+    :return: Dictionary of barcode : splits pairs
+    :rtype: dict
+    """
+    get_sequence_d_file_function, get_splits_function = functions
+    splits = {}
+    for barcode in barcodes:
+        d_file = os.path.join(data_dir, get_sequence_d_file_function(rfdb_file, barcode))
+        splits[barcode] = get_splits_function(splitter_file, rfdb_file, d_file, barcode = barcode)
+    return(splits)
+
+def clear_parse_caches():
+    se._read_rfdb_sequences.cache_clear()
+    se._read_splitter_log.cache_clear()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark parsing RFDatabase.xml and RFFileSplitter.log")
+    parser.add_argument('-w', '--work_dir', required = True)
+    parser.add_argument('--injections', type = int, default = 10000)
+    parser.add_argument('--wells_per_plate', type = int, default = 384)
+    parser.add_argument('--unlabeled', action = 'store_true', help = "Write the splitter log without time range labels, checking the positional fallback")
+    args = parser.parse_args()
+
+    rfdb_file, splitter_file, barcodes = write_synthetic_run(args.work_dir, args.injections, wells_per_plate = args.wells_per_plate, labeled = not args.unlabeled)
+    print(f"{args.injections} injections on {len(barcodes)} plates, RFDatabase.xml {os.path.getsize(rfdb_file) / (1 << 20):.1f} MB, "
+          f"RFFileSplitter.log {os.path.getsize(splitter_file) / (1 << 20):.1f} MB")
+    clear_parse_caches()
+    start = time.perf_counter()
+    n_records = sum(1 for _ in se.read_injections(splitter_file, rfdb_file))
+    print(f"single pass over both files: {n_records} injection records in {time.perf_counter() - start:.2f} s")
+    results = {}
+    for label, functions in [("legacy", (legacy_get_sequence_d_file, legacy_get_splits)), ("streaming", (se.get_sequence_d_file, se.get_splits))]:
+        clear_parse_caches()
+        tracemalloc.start()
+        plate_splits(functions, rfdb_file, splitter_file, barcodes[ : 1], args.work_dir)
+        peak_mb = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        tracemalloc.stop()
+        clear_parse_caches()
+        start = time.perf_counter()
+        splits = plate_splits(functions, rfdb_file, splitter_file, barcodes, args.work_dir)
+        seconds = time.perf_counter() - start
+        results[label] = (seconds, splits)
+        print(f"{label:<10} all plates: {seconds:8.2f} s, peak memory for one plate {peak_mb:8.1f} MB")
+    if results["legacy"][1] != results["streaming"][1]:
+        raise RuntimeError("streaming and legacy splits differ")
+    print(f"speedup: {results['legacy'][0] / results['streaming'][0]:.1f}x, splits identical")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Streaming split check. Runs a multi-plate batch on the simulated RapidFire, streams the
+# injection windows of every plate with utils_rapidFire.stream_injection_windows while the batch
+# runs, then runs the simulated file splitter on the finished run and checks that the streamed
+# windows match the post-run splits of splitterExtract.get_splits (same sequence .d file, output
+# names, and split times) for every plate.
+#
+# Example: python benchmarks/stream_splits.py -w stream_work --plates 2 --wells 24 --speedup 600
+################################################################################################
+import os
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from autonoms.agilent_methods.instrument_simulation import SimulationClock, SimulatedRapidFire
+from autonoms.agilent_methods.splitterExtract import get_splits, get_sequence_d_file
+import autonoms.agilent_methods.utils_rapidFire as rfu
+################################################################################################
+
+def write_rfbat(out_file, barcodes, wells, cycle_ms):
+    """Writes a multi-plate .rfbat file whose plates all inject the same wells with the given method cycle
+
+    :param out_file: Path to output .rfbat file
+    :type out_file: str
+    :param barcodes: Plate barcodes, in run order
+    :type barcodes: list
+    :param wells: Wells injected on every plate
+    :type wells: list
+    :param cycle_ms: CycleDurations of the plate method, in milliseconds
+    :type cycle_ms: list
+    """
+    rfbatch = ET.Element("RFBatch")
+    plates = ET.SubElement(rfbatch, "Plates")
+    for barcode in barcodes:
+        batch_plate = ET.SubElement(plates, "BatchPlate")
+        ET.SubElement(batch_plate, "uniqueName").text = barcode
+        sequence = ET.SubElement(ET.SubElement(batch_plate, "Sequences"), "Sequence")
+        for well in wells:
+            ET.SubElement(sequence, "SEQUENCE").text = well
+        durations = ET.SubElement(ET.SubElement(sequence, "CFGFILE"), "CycleDurations")
+        for ms in cycle_ms:
+            ET.SubElement(durations, "int").text = str(ms)
+    ET.ElementTree(rfbatch).write(out_file)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Check that streamed injection windows match the post-run splits of a simulated batch")
+    parser.add_argument('-w', '--work_dir', required = True)
+    parser.add_argument('--plates', type = int, default = 2)
+    parser.add_argument('--wells', type = int, default = 24)
+    parser.add_argument('--speedup', type = float, default = 600)
+    parser.add_argument('--tolerance_minutes', type = float, default = 1e-3)
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok = True)
+    barcodes = [f"plate{chr(ord('A') + i)}" for i in range(args.plates)]
+    wells = [f"{chr(ord('A') + i // 24)}{i % 24 + 1}" for i in range(args.wells)]
+    rfbat_file = os.path.join(args.work_dir, "batch.rfbat")
+    write_rfbat(rfbat_file, barcodes, wells, [600, 2500, 8000, 1000])
+    rapid_fire = SimulatedRapidFire(SimulationClock(speedup = args.speedup))
+    rapid_fire.load_batch(rfbat_file)
+    data_dir = rapid_fire.start_run(os.path.join(args.work_dir, "rf_data"))
+
+    streamed = {}
+    def stream(barcode):
+        streamed[barcode] = list(rfu.stream_injection_windows(data_dir, barcode, 3600, poll_seconds = 0.05))
+    threads = [threading.Thread(target = stream, args = (x, )) for x in barcodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rapid_fire.run_thread.join()
+    rapid_fire.file_split(data_dir)
+
+    splitter_file = os.path.join(data_dir, "RFFileSplitter.log")
+    rfdb_file = os.path.join(data_dir, "RFDatabase.xml")
+    for barcode in barcodes:
+        d_file = os.path.join(data_dir, get_sequence_d_file(rfdb_file, barcode))
+        post_run = get_splits(splitter_file, rfdb_file, d_file, barcode = barcode)
+        if len(streamed[barcode]) != len(post_run):
+            raise RuntimeError(f"{barcode}: streamed {len(streamed[barcode])} windows, post-run splitting found {len(post_run)}")
+        for s, p in zip(streamed[barcode], post_run):
+            if s[ : 2] != p[ : 2] or abs(s[2] - p[2]) > args.tolerance_minutes or abs(s[3] - p[3]) > args.tolerance_minutes:
+                raise RuntimeError(f"{barcode}: streamed window {s} does not match post-run split {p}")
+        print(f"{barcode}: {len(post_run)} streamed windows match the post-run splits of {os.path.basename(d_file)}, "
+              f"first window at {post_run[0][2]:.3f}-{post_run[0][3]:.3f} min, last at {post_run[-1][2]:.3f}-{post_run[-1][3]:.3f} min")
+    print(f"streaming and post-run splits agree for all {len(barcodes)} plates")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Stand-in for the external executables called by the workflow (PNNL PreProcessor, MHFileSplitter,
+# msconvert, SkylineCmd, and the MassHunter-RapidFire connection script). Each stub parses the
+# command line of the tool it replaces, spends a configurable amount of time (part of it busy on
+# the CPU), and writes output files of a configurable size where the real tool would.
+#
+# Usage: python stub_tool.py <tool> <tool arguments...>
+# The stub profile is read from the .json file in the AUTONOMS_STUB_PROFILE environment variable
+################################################################################################
+import os
+import sys
+import json
+import time
+################################################################################################
+
+# Per-tool runtime (seconds, plus seconds_per_file for tools processing several files), fraction of
+# the runtime spent busy on the CPU, and output size in MB
+DEFAULT_PROFILE = {
+    "mh_splitter" : {"seconds" : 0.5, "cpu_fraction" : 0.5, "output_mb" : 8},
+    "pnnl_preprocessor" : {"seconds" : 2.0, "cpu_fraction" : 0.9, "output_mb" : 12},
+    "msconvert" : {"seconds" : 1.0, "cpu_fraction" : 0.7, "output_mb" : 6},
+    "skyline" : {"seconds" : 1.0, "seconds_per_file" : 0.1, "cpu_fraction" : 0.9, "output_mb" : 1},
+    "start_mh_rf" : {"seconds" : 0.1, "cpu_fraction" : 0.0, "output_mb" : 0},
+    "ccs_cal" : {"seconds" : 0.5, "cpu_fraction" : 0.9, "output_mb" : 0},
+}
+
+PROFILE_ENV_VAR = "AUTONOMS_STUB_PROFILE"
+
+def load_profile(profile_file = None):
+    """Loads the stub profile, starting from DEFAULT_PROFILE and overriding the values found in profile_file
+
+    :param profile_file: Path to profile .json file, defaults to the file named by the AUTONOMS_STUB_PROFILE environment variable
+    :type profile_file: str, optional
+    :return: Dictionary of tool : settings pairs
+    :rtype: dict
+    """
+    profile = {k : dict(v) for k, v in DEFAULT_PROFILE.items()}
+    profile_file = profile_file or os.environ.get(PROFILE_ENV_VAR)
+    if profile_file:
+        with open(profile_file, 'r') as f:
+            for tool, settings in json.load(f).items():
+                profile.setdefault(tool, {}).update(settings)
+    return(profile)
+
+def simulate_work(settings, n_files = 1):
+    """Spends the configured runtime, busy-looping for cpu_fraction of it and sleeping for the rest
+
+    :param settings: Tool settings from the profile
+    :type settings: dict
+    :param n_files: Number of files processed, defaults to 1
+    :type n_files: int, optional
+    """
+    seconds = settings.get("seconds", 0) + settings.get("seconds_per_file", 0) * n_files
+    busy_seconds = seconds * settings.get("cpu_fraction", 0)
+    busy_until = time.time() + busy_seconds
+    x = 0
+    while time.time() < busy_until:
+        x = (x * 31 + 7) % 1000003
+    time.sleep(max(seconds - busy_seconds, 0))
+
+def write_data(out_file, size_mb):
+    """Writes a file of the given size
+
+    :param out_file: Path to output file
+    :type out_file: str
+    :param size_mb: File size in MB
+    :type size_mb: float
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok = True)
+    chunk = os.urandom(1 << 20)
+    remaining = int(size_mb * (1 << 20))
+    with open(out_file, 'wb') as f:
+        while remaining > 0:
+            f.write(chunk[ : min(remaining, len(chunk))])
+            remaining -= len(chunk)
+
+def write_d_file(d_file, size_mb):
+    """Writes a minimal Agilent .d directory
+
+    :param d_file: Path to output .d directory
+    :type d_file: str
+    :param size_mb: Size of the scan data in MB
+    :type size_mb: float
+    """
+    write_data(os.path.join(d_file, "AcqData", "MSScan.bin"), size_mb)
+
+def get_flag(arg_list, flag):
+    """Gets the value of a flag=value argument
+
+    :param arg_list: Command line arguments
+    :type arg_list: list
+    :param flag: Flag including any leading dashes (e.g. "-out")
+    :type flag: str
+    :return: List of values for every occurrence of the flag
+    :rtype: list
+    """
+    return([x.split("=", 1)[1] for x in arg_list if x.startswith(f"{flag}=")])
+
+def run_mh_splitter(arg_list, settings):
+    # MHFileSplitter.exe <in .d> <out .d> <start> <end> 0 0 <log file>
+    in_d_file, out_d_file, start_time, end_time = arg_list[ : 4]
+    simulate_work(settings)
+    write_d_file(out_d_file, settings.get("output_mb", 0))
+    with open(arg_list[6], 'w') as f:
+        print(f"Split {in_d_file} {start_time}-{end_time} -> {out_d_file}", file = f)
+
+def run_pnnl_preprocessor(arg_list, settings):
+    # PNNL-PreProcessor.exe ... -out=<out dir> -dataset=<in .d>
+    out_dir = get_flag(arg_list, "-out")[0]
+    d_file = get_flag(arg_list, "-dataset")[0]
+    simulate_work(settings)
+    write_d_file(os.path.join(out_dir, os.path.splitext(os.path.basename(d_file))[0] + ".d"), settings.get("output_mb", 0))
+
+def run_msconvert(arg_list, settings):
+    # msconvert.exe <in .d> -o <out dir>
+    d_file = arg_list[0]
+    out_dir = arg_list[arg_list.index("-o") + 1]
+    simulate_work(settings)
+    write_data(os.path.join(out_dir, os.path.splitext(os.path.basename(d_file))[0] + ".mzML"), settings.get("output_mb", 0))
+
+def run_skyline(arg_list, settings):
+    # SkylineCmd.exe --in=... (--import-all-files=<dir> | --import-file=<file> ...) --report-file=<tsv> --out=<sky>
+    import_files = get_flag(arg_list, "--import-file")
+    for import_dir in get_flag(arg_list, "--import-all-files"):
+        import_files += [os.path.join(import_dir, x) for x in sorted(os.listdir(import_dir)) if x.lower().endswith((".d", ".mzml"))]
+    simulate_work(settings, n_files = len(import_files))
+    with open(get_flag(arg_list, "--report-file")[0], 'w') as f:
+        print("Replicate\tMolecule\tPrecursor Mz\tArea", file = f)
+        for import_file in import_files:
+            print(f"{os.path.splitext(os.path.basename(import_file))[0]}\tstub\t100.0\t1000.0", file = f)
+    write_data(get_flag(arg_list, "--out")[0], settings.get("output_mb", 0))
+
+def run_start_mh_rf(arg_list, settings):
+    simulate_work(settings)
+
+TOOLS = {"mh_splitter" : run_mh_splitter,
+         "pnnl_preprocessor" : run_pnnl_preprocessor,
+         "msconvert" : run_msconvert,
+         "skyline" : run_skyline,
+         "start_mh_rf" : run_start_mh_rf}
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in TOOLS:
+        sys.exit(f"Error - usage: stub_tool.py <tool> <args...>, tool must be one of {list(TOOLS.keys())}")
+    tool = sys.argv[1]
+    TOOLS[tool](sys.argv[2 : ], load_profile()[tool])
+
+if __name__ == "__main__":
+    main()
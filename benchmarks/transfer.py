@@ -0,0 +1,125 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Transfer engine benchmark between two local directories (e.g. a local drive and the mapped
+# 6560/RapidFire shared drive). Writes a synthetic .d file tree, copies it with shutil.copytree
+# and with the transfer engine at several thread counts, then interrupts a transfer halfway,
+# resumes it, and checks that every copy is identical to the source.
+#
+# Example: python benchmarks/transfer.py -s C:\transfer_src -d M:\transfer_dst --size_mb 2048
+################################################################################################
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+from autonoms.utils_cache import list_tree, remove_path
+from autonoms.utils_transfer import TransferEngine
+################################################################################################
+
+def write_synthetic_d_file(d_file, size_mb, n_small_files = 50):
+    """Writes a .d directory with one large scan file and a number of small metadata files
+
+    :param d_file: Path to output .d directory
+    :type d_file: str
+    :param size_mb: Size of the scan file in MB
+    :type size_mb: int
+    :param n_small_files: Number of small files, defaults to 50
+    :type n_small_files: int, optional
+    """
+    remove_path(d_file)
+    os.makedirs(os.path.join(d_file, "AcqData"))
+    block = os.urandom(1 << 20)
+    with open(os.path.join(d_file, "AcqData", "MSScan.bin"), 'wb') as f:
+        for i in range(size_mb):
+            f.write(block[i % 251 : ] + block[ : i % 251])
+    for i in range(n_small_files):
+        with open(os.path.join(d_file, "AcqData", f"meta_{i:03d}.xml"), 'wb') as f:
+            f.write(os.urandom(4096))
+
+def tree_digest(path):
+    """Computes the sha256 of all file names and contents of a directory tree
+
+    :param path: Path to directory
+    :type path: str
+    :return: Hex digest
+    :rtype: str
+    """
+    h = hashlib.sha256()
+    for rel_name, _, _ in list_tree(path):
+        h.update(rel_name.encode("utf-8"))
+        with open(os.path.join(path, rel_name), 'rb') as f:
+            for buffer in iter(lambda : f.read(1 << 20), b""):
+                h.update(buffer)
+    return(h.hexdigest())
+
+class InterruptedTransferEngine(TransferEngine):
+    """Transfer engine which stops its transfers once a number of bytes have been copied and journaled, as if the transfer was interrupted
+
+    :param stop_after_bytes: Number of copied bytes after which the transfer is stopped
+    :type stop_after_bytes: int
+    """
+    def __init__(self, stop_after_bytes, **kwargs):
+        super().__init__(**kwargs)
+        self.stop_after_bytes = stop_after_bytes
+        self.copied_bytes = 0
+
+    def _transfer_chunk(self, journal, rel_name, src_file, dst_file, i_chunk, offset, length, cancel_event):
+        copied_bytes, resumed_bytes = super()._transfer_chunk(journal, rel_name, src_file, dst_file, i_chunk, offset, length, cancel_event)
+        with self.lock:
+            self.copied_bytes += copied_bytes
+            if self.copied_bytes >= self.stop_after_bytes:
+                cancel_event.set()
+        return((copied_bytes, resumed_bytes))
+
+def interrupted_transfer(engine, src, dst, fraction = 0.5):
+    """Starts a transfer, stops it once a fraction of its bytes are copied and journaled, and resumes it. Chunks being copied when the
+    transfer is stopped are finished, so it is stopped early enough for at least one chunk to be left after those of every worker
+
+    :return: Tuple of the stopped and resumed transfer statistics
+    :rtype: tuple
+    """
+    total_bytes = sum(x[1] for x in list_tree(src))
+    stop_after_bytes = min(int(fraction * total_bytes), total_bytes - (engine.max_workers + 1) * engine.chunk_bytes)
+    if stop_after_bytes <= 0:
+        raise RuntimeError(f"{src} ({total_bytes / 1024 ** 2:.1f} MB) is too small to interrupt a transfer with {engine.max_workers} workers copying "
+                           f"{engine.chunk_bytes / 1024 ** 2:.0f} MB chunks, use a larger --size_mb or a smaller --chunk_mb")
+    stopping_engine = InterruptedTransferEngine(stop_after_bytes, max_workers = engine.max_workers, chunk_bytes = engine.chunk_bytes)
+    stopped = stopping_engine.transfer(src, dst, cancel_event = threading.Event())
+    resumed = engine.transfer(src, dst)
+    return(stopped, resumed)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the transfer engine between two directories")
+    parser.add_argument('-s', '--src_dir', required = True)
+    parser.add_argument('-d', '--dst_dir', required = True)
+    parser.add_argument('--size_mb', type = int, default = 1024)
+    parser.add_argument('--chunk_mb', type = int, default = 64)
+    parser.add_argument('--workers', type = int, nargs = '+', default = [1, 4, 8])
+    args = parser.parse_args()
+
+    src = os.path.join(args.src_dir, "sequence1.d")
+    write_synthetic_d_file(src, args.size_mb)
+    src_digest = tree_digest(src)
+    dst = os.path.join(args.dst_dir, "sequence1.d")
+    remove_path(dst)
+    start = time.perf_counter()
+    shutil.copytree(src, dst)
+    seconds = time.perf_counter() - start
+    print(f"{'copytree':<22} {seconds:8.2f} s {args.size_mb / seconds:8.1f} MB/s")
+    for workers in args.workers:
+        remove_path(dst)
+        stats = TransferEngine(max_workers = workers, chunk_bytes = args.chunk_mb << 20).transfer(src, dst)
+        if tree_digest(dst) != src_digest:
+            raise RuntimeError(f"transfer with {workers} workers does not match the source")
+        print(f"{f'engine {workers} workers':<22} {stats.seconds:8.2f} s {stats.copied_bytes / 1024 ** 2 / stats.seconds:8.1f} MB/s")
+    remove_path(dst)
+    stopped, resumed = interrupted_transfer(TransferEngine(max_workers = max(args.workers), chunk_bytes = args.chunk_mb << 20), src, dst)
+    if stopped.complete or not resumed.complete or tree_digest(dst) != src_digest:
+        raise RuntimeError("interrupted and resumed transfer does not match the source")
+    print(f"interrupted after {stopped.copied_bytes / 1024 ** 2:.0f} MB, resumed {resumed.resumed_bytes / 1024 ** 2:.0f} MB "
+          f"and copied the remaining {resumed.copied_bytes / 1024 ** 2:.0f} MB, copies identical")
+
+if __name__ == "__main__":
+    main()
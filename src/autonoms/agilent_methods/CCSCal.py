@@ -3,10 +3,7 @@
 ################################################################################################
 import sys
 import argparse
-import deimos
-import pandas as pd
-import numpy as np
-from scipy.interpolate import interp1d
+# deimos, numpy, pandas, and scipy are imported in the functions using them, they are slow to import
 ################################################################################################
 
 ################################################################################################
@@ -39,6 +36,9 @@ def tunemix(features, mz, ccs, q=[1, 1, 1, 1, 1, 1],
     :return: A calibrated deimos CCSCalibration instance
     :rtype: `deimos.calibration.CCSCalibration`
     """
+    import deimos
+    import numpy as np
+    from scipy.interpolate import interp1d
     # cast to numpy array
     mz = np.array(mz)
     ccs = np.array(ccs)
@@ -76,7 +76,8 @@ def tunemix(features, mz, ccs, q=[1, 1, 1, 1, 1, 1],
     return(cal_out)
 
 def ccs_cal(inMZML, tuneIonsFile, mz_tol_ppm = 10, bufferGasMass = 28.006148):
-    """Calculates CCS calibration coefficients (single field) from an mzML file assumed to contain standard ions
+    """Calculates CCS calibration coefficients (single field) from an mzML file assumed to contain standard ions. The mzML file is streamed and only
+    the MS1 points around the standards' m/z values are kept in memory (see autonoms.agilent_methods.mzml_stream)
 
     :param inMZML: Path to .mzML file containing standards run
     :type inMZML: str
@@ -88,22 +89,25 @@ def ccs_cal(inMZML, tuneIonsFile, mz_tol_ppm = 10, bufferGasMass = 28.006148):
     :return: XML string content of CCS calibration file containing calibration coefficients
     :rtype: str
     """
-
+    import pandas as pd
+    from autonoms.agilent_methods.mzml_stream import read_mzml_windows, ppm_windows
+    dfRef = pd.read_csv(tuneIonsFile)
     print('Loading data...')
-    data = deimos.load(inMZML, accession={'retention_time': 'MS:1000016', 'drift_time': 'MS:1002476', 'Positive Scan' : "MS:1000130", 'Negative Scan' : 'MS:1000129'})
-    ms1 = data['ms1']
-    posModeI = len(ms1['Positive Scan'].mode().values)
-    negModeI = len(ms1['Negative Scan'].mode().values)
-    if posModeI > 0 and negModeI > 0:
+    # Only the MS1 points around the tune ions are read. The windows are 1 ppm wider than the tunemix slices so that no point is lost
+    # to rounding when the m/z values are stored as float32
+    data = read_mzml_windows(inMZML, ppm_windows(dfRef['Precursor m/z'], float(mz_tol_ppm) + 1))
+    ms1 = data.points
+    if data.n_positive > 0 and data.n_negative > 0:
         sys.exit('Error - I see scans in both positive and negative mode in the same mzML file')
-    # mode = {1.0 : 'Positive', 0 : 'Negative'}[ms1['Positive Scan'].mode().values[0]]
-    if posModeI == 0 and negModeI > 0:
+    if data.n_negative > 0:
         mode = 'Negative'
-    elif negModeI == 0 and posModeI > 0:
+    elif data.n_positive > 0:
         mode = 'Positive'
+    else:
+        sys.exit(f'Error - no positive or negative mode MS1 scans found in {inMZML}')
     modeInt = {'Positive' : 1.0, 'Negative' : -1.0}[mode]
-    dfRef = pd.read_csv(tuneIonsFile)
     dfRef = pd.DataFrame(dfRef[dfRef['Precursor Charge'] * modeInt >= 1])
+    print(f'Kept {data.n_kept} of {data.n_points} points from {data.n_spectra} MS1 scans')
     print(f'...done, found {mode} mode data\n\n')
 
     # Using the built in deimos tunemix method
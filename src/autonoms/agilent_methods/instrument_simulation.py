@@ -0,0 +1,446 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Simulated RapidFire and 6560 (MassHunter Data Acquisition) instruments, for running the whole
+# workflow without the instrument computers (e.g. for throughput testing on Linux). The simulated
+# RapidFire runs .rfbat batches with injection times taken from the CycleDurations of each plate's
+# method and writes the run output of the RapidFire (batch.log, RFDatabase.xml, batch.rftime,
+# platemap.tofmap.txt, sequence<N>.d, and RFFileSplitter.log after file splitting) into the same
+# RapidFire data file tree. Instrument time passes faster than wall-clock time by a set speedup,
+# and the simulated RapidFire is served to the workflow through a local rpyc service
+# (rf_rpyc_server.SimulatedRapidFireService).
+################################################################################################
+import os
+import sys
+import time
+import shutil
+import datetime
+import threading
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from autonoms.agilent_methods.rf_run_index import MONTHS
+import autonoms.agilent_methods.utils_rapidFire as rfu
+from autonoms.utils_wait import wait_or_exit
+################################################################################################
+
+# Functions served by rf_rpyc_server.SimulatedRapidFireService in place of the utils_rapidFire functions of the same name
+SIMULATED_FUNCTIONS = ["remote_run_rfbat", "remote_file_split"]
+BATCH_LOG_TIME_FORMAT = "%m/%d/%Y %H:%M:%S.%f"
+# A plate of a batch, with the instrument seconds per injection of its method
+SimulatedPlate = namedtuple("SimulatedPlate", ["barcode", "wells", "injection_seconds"])
+
+class SimulationClock:
+    """Instrument time of a simulation, passing speedup times faster than wall-clock time
+
+    :param speedup: Instrument seconds per wall-clock second, defaults to 60
+    :type speedup: float, optional
+    """
+    def __init__(self, speedup = 60):
+        self.speedup = speedup
+        self.start_wall = time.time()
+        self.start = datetime.datetime.now()
+
+    def now(self):
+        """Gets the current instrument time
+
+        :return: Instrument time
+        :rtype: `datetime.datetime`
+        """
+        return(self.start + datetime.timedelta(seconds = (time.time() - self.start_wall) * self.speedup))
+
+    def sleep(self, seconds, stop_event = None):
+        """Lets instrument time pass
+
+        :param seconds: Instrument seconds
+        :type seconds: float
+        :param stop_event: If provided, stop sleeping once this event is set, defaults to None
+        :type stop_event: `threading.Event`, optional
+        :return: True if stop_event was set
+        :rtype: bool
+        """
+        if stop_event is not None:
+            return(stop_event.wait(seconds / self.speedup))
+        time.sleep(seconds / self.speedup)
+        return(False)
+
+def read_cycle_seconds(rfcfg_element):
+    """Gets the duration of a RapidFire injection cycle from the CycleDurations (in milliseconds) of a RF method
+
+    :param rfcfg_element: RF method xml element (the root of an .rfcfg file or the CFGFILE element of an .rfbat sequence)
+    :type rfcfg_element: class: `xml.etree.ElementTree.Element`
+    :return: Cycle duration in seconds, None if the method has no CycleDurations
+    :rtype: float
+    """
+    durations = rfcfg_element.find("CycleDurations") if rfcfg_element is not None else None
+    if durations is None:
+        return(None)
+    return(sum(int(x.text) for x in durations if x.text) / 1000)
+
+def write_rf_database(out_file, plates):
+    """Writes an RFDatabase.xml for a batch
+
+    :param out_file: Path to output RFDatabase.xml
+    :type out_file: str
+    :param plates: Plates in run order
+    :type plates: list
+    """
+    root = ET.Element("RFDatabase")
+    plates_element = ET.SubElement(root, "Plates")
+    for i_plate, plate in enumerate(plates):
+        plate_element = ET.SubElement(plates_element, "Plate")
+        ET.SubElement(plate_element, "Barcode").text = plate.barcode
+        injections = ET.SubElement(plate_element, "Injections")
+        for well in plate.wells:
+            sample = ET.SubElement(injections, "SampleInfo")
+            for name, value in [("Sequence", str(i_plate + 1)), ("Barcode", plate.barcode), ("Well", well)]:
+                field = ET.SubElement(sample, "Field")
+                ET.SubElement(field, "Name").text = name
+                ET.SubElement(field, "Value").text = value
+    ET.ElementTree(root).write(out_file)
+
+class SimulatedRapidFire:
+    """Simulated RapidFire, following the states of the RapidFire UI: idle, ready (batch loaded), running, stopping, and splitting.
+    Each injection takes the cycle duration of its plate's method plus injection_overhead_seconds of instrument time
+
+    :param clock: Simulation clock
+    :type clock: `SimulationClock`
+    :param injection_overhead_seconds: Instrument seconds added to the method cycle of every injection (needle and plate moves), defaults to 5
+    :type injection_overhead_seconds: float, optional
+    :param plate_load_seconds: Instrument seconds to load each plate, defaults to 30
+    :type plate_load_seconds: float, optional
+    :param split_seconds_per_injection: Instrument seconds the file splitter takes per injection, defaults to 0.5
+    :type split_seconds_per_injection: float, optional
+    :param scan_mb_per_injection: MB of scan data written to the sequence .d file per injection, defaults to 0
+    :type scan_mb_per_injection: float, optional
+    """
+    def __init__(self, clock, injection_overhead_seconds = 5, plate_load_seconds = 30, split_seconds_per_injection = 0.5, scan_mb_per_injection = 0):
+        self.clock = clock
+        self.injection_overhead_seconds = injection_overhead_seconds
+        self.plate_load_seconds = plate_load_seconds
+        self.split_seconds_per_injection = split_seconds_per_injection
+        self.scan_mb_per_injection = scan_mb_per_injection
+        self.lock = threading.Lock()
+        self.state = "idle"
+        self.method = None
+        self.plates = None
+        self.data_dir = None
+        self.stop_event = threading.Event()
+        self.run_thread = None
+
+    def transition(self, allowed_states, new_state, action):
+        """Changes the state, erroring if the action is not possible in the current state
+
+        :param allowed_states: States in which the action is possible
+        :type allowed_states: list
+        :param new_state: State after the action
+        :type new_state: str
+        :param action: Description of the action, for the error message
+        :type action: str
+        :return: Previous state
+        :rtype: str
+        """
+        with self.lock:
+            if self.state not in allowed_states:
+                sys.exit(f"Error - cannot {action} while the simulated RapidFire is {self.state}")
+            previous_state, self.state = self.state, new_state
+        return(previous_state)
+
+    def load_method(self, rfcfg_file):
+        """Loads a RF method (.rfcfg), whose CycleDurations are used for plates without their own method
+
+        :param rfcfg_file: Path to .rfcfg file
+        :type rfcfg_file: str
+        """
+        method = ET.parse(rfcfg_file).getroot()
+        self.transition(["idle", "ready"], self.state, "load a method")
+        self.method = method
+
+    def load_batch(self, rfbat_file):
+        """Loads a RF batch (.rfbat)
+
+        :param rfbat_file: Path to .rfbat file
+        :type rfbat_file: str
+        """
+        plates = []
+        for batch_plate in ET.parse(rfbat_file).getroot().iterfind("Plates/BatchPlate"):
+            cycle_seconds = read_cycle_seconds(batch_plate.find(".//CFGFILE"))
+            if cycle_seconds is None:
+                cycle_seconds = read_cycle_seconds(self.method)
+            if cycle_seconds is None:
+                sys.exit(f"Error - no CycleDurations for plate {batch_plate.find('uniqueName').text} in {rfbat_file} or the loaded method")
+            plates.append(SimulatedPlate(batch_plate.find("uniqueName").text, [x.text for x in batch_plate.iter("SEQUENCE")],
+                                         cycle_seconds + self.injection_overhead_seconds))
+        if not plates:
+            sys.exit(f"Error - no plates found in {rfbat_file}")
+        self.transition(["idle", "ready"], "ready", "load a batch")
+        self.plates = plates
+
+    def start_run(self, rf_base_data_dir):
+        """Starts running the loaded batch. The run directory is created in the RapidFire data file tree (<base>/<year>/<month name>/<day>)
+        before returning and the run output is written to it as the batch runs
+
+        :param rf_base_data_dir: Path to base RapidFire data directory
+        :type rf_base_data_dir: str
+        :return: Path to the run directory
+        :rtype: str
+        """
+        self.transition(["ready"], "running", "start a run")
+        now = datetime.datetime.now()
+        data_dir = os.path.join(rf_base_data_dir, str(now.year), MONTHS[now.month - 1], str(now.day), f"{self.plates[0].barcode}_{now.strftime('%H%M%S_%f')}")
+        os.makedirs(data_dir)
+        write_rf_database(os.path.join(data_dir, "RFDatabase.xml"), self.plates)
+        with open(os.path.join(data_dir, "platemap.tofmap.txt"), 'w') as f:
+            for plate in self.plates:
+                print("\t".join([plate.barcode] + plate.wells), file = f)
+        self.data_dir = data_dir
+        self.stop_event.clear()
+        self.run_thread = threading.Thread(target = self._run, args = (data_dir, list(self.plates)), daemon = True, name = "simulated_rf_run")
+        self.run_thread.start()
+        return(data_dir)
+
+    def _run(self, data_dir, plates):
+        # The first plate is loaded before the batch.log is started, so batch.log times match the time axis of the first sequence .d file
+        chunk = os.urandom(int(self.scan_mb_per_injection * (1 << 20)))
+        with open(os.path.join(data_dir, "batch.log"), 'w') as log_f, open(os.path.join(data_dir, "batch.rftime"), 'w') as time_f:
+            def log(message):
+                print(f"{self.clock.now().strftime(BATCH_LOG_TIME_FORMAT)} {message}", file = log_f, flush = True)
+            print("Barcode\tSequence\tWell\tStart\tEnd", file = time_f, flush = True)
+            stopped = self.clock.sleep(self.plate_load_seconds, self.stop_event)
+            if not stopped:
+                log("Batch started")
+            for i_plate, plate in enumerate(plates):
+                if stopped:
+                    break
+                if i_plate > 0:
+                    log(f"Loading plate {plate.barcode}")
+                    if self.clock.sleep(self.plate_load_seconds, self.stop_event):
+                        break
+                scan_file = os.path.join(data_dir, f"sequence{i_plate + 1}.d", "AcqData", "MSScan.bin")
+                os.makedirs(os.path.dirname(scan_file))
+                plate_start = self.clock.now()
+                with open(scan_file, 'wb') as scan_f:
+                    for well in plate.wells:
+                        start_minutes = (self.clock.now() - plate_start).total_seconds() / 60
+                        log(f"Injecting well {well}")
+                        stopped = self.clock.sleep(plate.injection_seconds, self.stop_event)
+                        if stopped:
+                            break
+                        scan_f.write(chunk)
+                        scan_f.flush()
+                        end_minutes = (self.clock.now() - plate_start).total_seconds() / 60
+                        print(f"{plate.barcode}\t{i_plate + 1}\t{well}\t{start_minutes:.4f}\t{end_minutes:.4f}", file = time_f, flush = True)
+            if self.stop_event.is_set():
+                log("Batch aborted by user")
+            log(rfu.BATCH_LOG_CLOSED_TEXT)
+        with self.lock:
+            self.state = "idle"
+
+    def stop_run(self):
+        """Stops the running batch and waits for it to close
+        """
+        self.transition(["running"], "stopping", "stop a run")
+        self.stop_event.set()
+        self.run_thread.join()
+
+    def file_split(self, data_dir, cancel_event = None):
+        """Runs the file splitter on a run directory, writing its RFFileSplitter.log from the injection times in batch.rftime
+
+        :param data_dir: Path to run directory
+        :type data_dir: str
+        :param cancel_event: If provided, stop splitting once this event is set, defaults to None
+        :type cancel_event: `threading.Event`, optional
+        :return: True if splitting completed
+        :rtype: bool
+        """
+        previous_state = self.transition(["idle", "ready"], "splitting", "split files")
+        try:
+            with open(os.path.join(data_dir, "batch.rftime"), 'r') as f:
+                injections = [x.rstrip("\n").split("\t") for x in f.readlines()[1 : ] if x.strip()]
+            if self.clock.sleep(self.split_seconds_per_injection * len(injections), cancel_event):
+                return(False)
+            with open(os.path.join(data_dir, "RFFileSplitter.log"), 'w') as f:
+                for i_injection, (barcode, sequence, well, start, end) in enumerate(injections):
+                    start, end = float(start), float(end)
+                    # The effective range is one injection later than the injection, as splitterExtract.get_splits shifts it back by the
+                    # interval between injections
+                    effective_start, effective_end = end, 2 * end - start
+                    print(f"Writing {os.path.join(data_dir, f'Inj{i_injection + 1:05d}-{barcode}-{well}.d')}", file = f)
+                    print(f"Original time range: {start:.4f}-{end:.4f}", file = f)
+                    print(f"Peak start: {effective_start:.4f}", file = f)
+                    print(f"Peak end: {effective_end:.4f}", file = f)
+                    print(f"Effective time range: {effective_start:.4f}-{effective_end:.4f}", file = f)
+                    print(f"Frames written: 1", file = f)
+                    print(f"Time taken: {self.split_seconds_per_injection:.1f} s", file = f)
+        finally:
+            with self.lock:
+                self.state = previous_state
+        return(True)
+
+class SimulatedMassHunter:
+    """Simulated 6560 run through MassHunter Data Acquisition, following the instrument states of utils_6560.get_instrument_state
+
+    :param clock: Simulation clock
+    :type clock: `SimulationClock`
+    :param reset_seconds: Instrument seconds from a method reset to the idle state, defaults to 30
+    :type reset_seconds: float, optional
+    :param prerun_seconds: Instrument seconds from the start of a sample run to the run state, defaults to 10
+    :type prerun_seconds: float, optional
+    :param scan_mb_per_minute: MB of scan data written per minute of acquisition, defaults to 0
+    :type scan_mb_per_minute: float, optional
+    """
+    def __init__(self, clock, reset_seconds = 30, prerun_seconds = 10, scan_mb_per_minute = 0):
+        self.clock = clock
+        self.reset_seconds = reset_seconds
+        self.prerun_seconds = prerun_seconds
+        self.scan_mb_per_minute = scan_mb_per_minute
+        self.lock = threading.Lock()
+        self.state = "idle"
+
+    def set_state(self, state):
+        with self.lock:
+            self.state = state
+        print(f"Simulated 6560 in state {state}")
+
+    def run_calibration_B(self, ms_method_name, output_d_filename_full, sample_name = "CalB", runtime = 30, overwrite = True):
+        """Simulates utils_6560.run_calibration_B, acquiring calibrant line B for runtime seconds into a .d file
+
+        :param ms_method_name: Path to .m file for the MS acquisition method
+        :type ms_method_name: str
+        :param output_d_filename_full: Path to output .d file
+        :type output_d_filename_full: str
+        :param sample_name: Sample name in metadata entry, defaults to "CalB"
+        :type sample_name: str, optional
+        :param runtime: Acquisition time (in seconds), defaults to 30
+        :type runtime: float, optional
+        :param overwrite: If true, overwrite existing output file, defaults to True
+        :type overwrite: bool, optional
+        """
+        if self.state != "idle":
+            sys.exit(f"Error - cannot start a calibration while the simulated 6560 is in state {self.state}")
+        if os.path.exists(output_d_filename_full):
+            if overwrite:
+                print(f"file {output_d_filename_full} exists, removing to overwrite")
+                shutil.rmtree(output_d_filename_full)
+            else:
+                sys.exit(f"file {output_d_filename_full} exists, please set overwrite to True and re-run to continue")
+        self.set_state("not ready")
+        self.clock.sleep(self.reset_seconds)
+        self.set_state("prerun")
+        self.clock.sleep(self.prerun_seconds)
+        self.set_state("run")
+        os.makedirs(os.path.join(output_d_filename_full, "AcqData"))
+        with open(os.path.join(output_d_filename_full, "AcqData", "sample_info.txt"), 'w') as f:
+            print(f"Sample Name\t{sample_name}\nMethod\t{ms_method_name}", file = f)
+        self.clock.sleep(runtime)
+        with open(os.path.join(output_d_filename_full, "AcqData", "MSScan.bin"), 'wb') as f:
+            f.write(os.urandom(int(self.scan_mb_per_minute * runtime / 60 * (1 << 20))))
+        self.set_state("idle")
+
+class InstrumentSimulation:
+    """Simulated RapidFire and 6560 sharing a simulation clock
+
+    :param speedup: Instrument seconds per wall-clock second, defaults to 60
+    :type speedup: float, optional
+    :param injection_overhead_seconds: See SimulatedRapidFire, defaults to 5
+    :type injection_overhead_seconds: float, optional
+    :param plate_load_seconds: See SimulatedRapidFire, defaults to 30
+    :type plate_load_seconds: float, optional
+    :param split_seconds_per_injection: See SimulatedRapidFire, defaults to 0.5
+    :type split_seconds_per_injection: float, optional
+    :param scan_mb_per_injection: See SimulatedRapidFire, defaults to 0
+    :type scan_mb_per_injection: float, optional
+    """
+    def __init__(self, speedup = 60, injection_overhead_seconds = 5, plate_load_seconds = 30, split_seconds_per_injection = 0.5, scan_mb_per_injection = 0):
+        self.clock = SimulationClock(speedup = speedup)
+        self.rapid_fire = SimulatedRapidFire(self.clock, injection_overhead_seconds = injection_overhead_seconds, plate_load_seconds = plate_load_seconds,
+                                             split_seconds_per_injection = split_seconds_per_injection, scan_mb_per_injection = scan_mb_per_injection)
+        self.mass_hunter = SimulatedMassHunter(self.clock)
+        self.server = None
+
+    def start_server(self, port = 18861):
+        """Serves the simulated RapidFire on a local rpyc server (see rf_rpyc_server.SimulatedRapidFireService) running in a background thread
+
+        :param port: Port to serve on, defaults to 18861
+        :type port: int, optional
+        :return: The running server
+        :rtype: `rpyc.utils.server.ThreadedServer`
+        """
+        from autonoms.agilent_methods.rf_rpyc_server import get_server, SimulatedRapidFireService
+        self.server = get_server(port = port, service = SimulatedRapidFireService)
+        threading.Thread(target = self.server.start, daemon = True, name = "simulated_rf_service").start()
+        wait_or_exit(lambda : self.server.active, 10, description = "simulated RapidFire service")
+        print(f"Simulated RapidFire service listening on port {port}")
+        return(self.server)
+
+    def close(self):
+        """Stops the local rpyc server
+        """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+################################################################################################
+# Shared simulation
+################################################################################################
+_simulation = None
+_simulation_lock = threading.Lock()
+
+def configure_simulation(**kwargs):
+    """Replaces the shared simulation with one built from the given InstrumentSimulation arguments
+
+    :return: The new shared simulation
+    :rtype: `InstrumentSimulation`
+    """
+    global _simulation
+    with _simulation_lock:
+        if _simulation is not None:
+            _simulation.close()
+        _simulation = InstrumentSimulation(**kwargs)
+    return(_simulation)
+
+def get_simulation():
+    """Gets the shared simulation
+
+    :return: The shared simulation, None if the instruments are not simulated
+    :rtype: `InstrumentSimulation`
+    """
+    with _simulation_lock:
+        return(_simulation)
+
+def get_rapid_fire():
+    simulation = get_simulation()
+    if simulation is None:
+        sys.exit("Error - no instrument simulation is configured (see configure_simulation)")
+    return(simulation.rapid_fire)
+
+################################################################################################
+# Simulated utils_rapidFire workflows
+################################################################################################
+def remote_run_rfbat(test = False, *args, **kwargs):
+    """Runs a sequence on the simulated RapidFire, taking the same arguments as utils_rapidFire.remote_run_rfbat
+
+    :return: Path to directory containing run output files
+    :rtype: str
+    """
+    rapid_fire = get_rapid_fire()
+    rapid_fire.load_method(kwargs['rfcfg_file'])
+    rapid_fire.load_batch(kwargs['rfbat_file'])
+    if not test:
+        rapid_fire.start_run(kwargs['rf_base_data_dir'])
+    data_dir = rfu.find_latest_dir(kwargs['rf_base_data_dir'], path_convert = {'D:\\' : "M:\\"})
+    if test:
+        return(data_dir)
+    if not rfu.monitor_batch(data_dir, kwargs['timeout_seconds'], event_callback = kwargs.get('event_callback'), cancel_event = kwargs.get('cancel_event')):
+        print(f"Run cancelled, stopping the batch in {data_dir}")
+        rapid_fire.stop_run()
+    return(data_dir)
+
+def remote_file_split(test = False, *args, **kwargs):
+    """Runs file splitting on the simulated RapidFire, taking the same arguments as utils_rapidFire.remote_file_split
+
+    :return: 0
+    :rtype: int
+    """
+    if not get_rapid_fire().file_split(kwargs['data_dir'], cancel_event = kwargs.get('cancel_event')):
+        print(f"File splitting of {kwargs['data_dir']} cancelled")
+    return(0)
@@ -0,0 +1,197 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Streaming, targeted mzML reader. Spectra are parsed one at a time, their binary arrays are
+# decoded (base64, optionally zlib compressed) and only the points inside the requested m/z
+# windows are kept, as float32 arrays. Every spectrum is discarded once it has been read, so peak
+# memory depends on the largest spectrum and the number of kept points, not on the file size.
+################################################################################################
+import sys
+import zlib
+import base64
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+# numpy and pandas are imported in the functions using them, they are slow to import
+################################################################################################
+
+# PSI-MS controlled vocabulary accessions
+MS_LEVEL = "MS:1000511"
+POSITIVE_SCAN = "MS:1000130"
+NEGATIVE_SCAN = "MS:1000129"
+SCAN_START_TIME = "MS:1000016"
+DRIFT_TIME = "MS:1002476"
+MZ_ARRAY = "MS:1000514"
+INTENSITY_ARRAY = "MS:1000515"
+FLOAT_32 = "MS:1000521"
+FLOAT_64 = "MS:1000523"
+ZLIB_COMPRESSION = "MS:1000574"
+NO_COMPRESSION = "MS:1000576"
+
+# Columns of the kept points, in the order of TargetedPoints.points
+POINT_COLUMNS = ["mz", "intensity", "drift_time", "retention_time"]
+
+TargetedPoints = namedtuple("TargetedPoints", ["points", "n_spectra", "n_positive", "n_negative", "n_points", "n_kept"])
+
+def local_name(tag):
+    """Strips the namespace from an XML tag
+
+    :param tag: XML tag, e.g. "{http://psi.hupo.org/ms/mzml}spectrum"
+    :type tag: str
+    :return: Tag without namespace, e.g. "spectrum"
+    :rtype: str
+    """
+    return(tag.rsplit('}', 1)[-1])
+
+def merge_windows(windows):
+    """Sorts m/z windows and merges overlapping ones
+
+    :param windows: List of (low, high) m/z tuples
+    :type windows: list
+    :return: Sorted list of non-overlapping (low, high) tuples
+    :rtype: list
+    """
+    merged = []
+    for low, high in sorted((float(low), float(high)) for low, high in windows):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return(merged)
+
+def ppm_windows(mz_values, tol_ppm):
+    """Builds m/z windows of +/- tol_ppm around m/z values
+
+    :param mz_values: Target m/z values
+    :type mz_values: list
+    :param tol_ppm: Window half-width in ppm
+    :type tol_ppm: float
+    :return: Sorted list of non-overlapping (low, high) tuples
+    :rtype: list
+    """
+    return(merge_windows([(mz - mz * float(tol_ppm) / 1e6, mz + mz * float(tol_ppm) / 1e6) for mz in mz_values]))
+
+def cv_params(element, ns, param_groups):
+    """Gets the cvParams of an element, including those of its referenced param groups
+
+    :param element: mzML element
+    :type element: `xml.etree.ElementTree.Element`
+    :param ns: Namespace prefix of the document, e.g. "{http://psi.hupo.org/ms/mzml}"
+    :type ns: str
+    :param param_groups: Dictionary of referenceableParamGroup id : cvParams pairs
+    :type param_groups: dict
+    :return: Dictionary of accession : value pairs
+    :rtype: dict
+    """
+    params = {}
+    for ref in element.findall(f"{ns}referenceableParamGroupRef"):
+        params.update(param_groups.get(ref.get("ref"), {}))
+    for cv in element.findall(f"{ns}cvParam"):
+        params[cv.get("accession")] = cv.get("value")
+    return(params)
+
+def decode_binary_array(binary_data_array, ns, param_groups):
+    """Decodes a binaryDataArray element
+
+    :param binary_data_array: binaryDataArray element
+    :type binary_data_array: `xml.etree.ElementTree.Element`
+    :param ns: Namespace prefix of the document
+    :type ns: str
+    :param param_groups: Dictionary of referenceableParamGroup id : cvParams pairs
+    :type param_groups: dict
+    :return: Tuple of array accession (MZ_ARRAY, INTENSITY_ARRAY, or None for other arrays) and decoded `numpy.array`
+    :rtype: tuple
+    """
+    import numpy as np
+    params = cv_params(binary_data_array, ns, param_groups)
+    kind = MZ_ARRAY if MZ_ARRAY in params else INTENSITY_ARRAY if INTENSITY_ARRAY in params else None
+    if kind is None:
+        return(None, None)
+    if FLOAT_32 in params:
+        dtype = "<f4"
+    elif FLOAT_64 in params:
+        dtype = "<f8"
+    else:
+        sys.exit(f"Error - unsupported binary data type in mzML array {sorted(params)}")
+    data = base64.b64decode(binary_data_array.findtext(f"{ns}binary") or "")
+    if ZLIB_COMPRESSION in params:
+        data = zlib.decompress(data)
+    elif NO_COMPRESSION not in params:
+        sys.exit(f"Error - unsupported compression in mzML array {sorted(params)}, convert the file with zlib or no compression")
+    return(kind, np.frombuffer(data, dtype = dtype))
+
+def iter_spectra(mzml_file):
+    """Iterates over the spectra of an mzML (or indexed mzML) file. Every spectrum element is removed from the document tree once
+    the next one is requested, so only one spectrum is held in memory at a time
+
+    :param mzml_file: Path to .mzML file
+    :type mzml_file: str
+    :return: Generator of (spectrum element, namespace prefix, referenceableParamGroup dictionary) tuples
+    :rtype: generator
+    """
+    param_groups = {}
+    stack = []
+    for event, elem in ET.iterparse(mzml_file, events = ("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        name = local_name(elem.tag)
+        if name == "referenceableParamGroup":
+            ns = elem.tag[ : -len(name)]
+            param_groups[elem.get("id")] = cv_params(elem, ns, {})
+        elif name == "spectrum":
+            yield(elem, elem.tag[ : -len(name)], param_groups)
+        if name in ["spectrum", "chromatogram"]:
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+
+def read_mzml_windows(mzml_file, windows, ms_level = 1):
+    """Reads the points of an mzML file which lie inside m/z windows, streaming the file one spectrum at a time
+
+    :param mzml_file: Path to .mzML file
+    :type mzml_file: str
+    :param windows: List of (low, high) m/z windows (inclusive) of the points to keep
+    :type windows: list
+    :param ms_level: MS level of the spectra to read, defaults to 1
+    :type ms_level: int, optional
+    :return: The kept points (a `pandas.DataFrame` with float32 columns POINT_COLUMNS; retention and drift times as given in the file), the number of
+        read spectra, the numbers of positive and negative mode spectra among them, and the numbers of read and kept points
+    :rtype: `TargetedPoints`
+    """
+    import numpy as np
+    import pandas as pd
+    windows = merge_windows(windows)
+    columns = {x : [] for x in POINT_COLUMNS}
+    n_spectra, n_positive, n_negative, n_points, n_kept = 0, 0, 0, 0, 0
+    for spectrum, ns, param_groups in iter_spectra(mzml_file):
+        params = cv_params(spectrum, ns, param_groups)
+        if MS_LEVEL in params and int(params[MS_LEVEL]) != ms_level:
+            continue
+        n_spectra += 1
+        n_positive += POSITIVE_SCAN in params
+        n_negative += NEGATIVE_SCAN in params
+        for scan in spectrum.iter(f"{ns}scan"):
+            params.update(cv_params(scan, ns, param_groups))
+        arrays = {}
+        for binary_data_array in spectrum.iter(f"{ns}binaryDataArray"):
+            kind, values = decode_binary_array(binary_data_array, ns, param_groups)
+            if kind is not None:
+                arrays[kind] = values
+        if MZ_ARRAY not in arrays or INTENSITY_ARRAY not in arrays:
+            continue
+        mz = arrays[MZ_ARRAY]
+        n_points += len(mz)
+        keep = np.zeros(len(mz), dtype = bool)
+        for low, high in windows:
+            keep |= (mz >= low) & (mz <= high)
+        n_keep = int(keep.sum())
+        if n_keep == 0:
+            continue
+        n_kept += n_keep
+        columns["mz"].append(mz[keep].astype(np.float32))
+        columns["intensity"].append(arrays[INTENSITY_ARRAY][keep].astype(np.float32))
+        columns["drift_time"].append(np.full(n_keep, float(params.get(DRIFT_TIME) or "nan"), dtype = np.float32))
+        columns["retention_time"].append(np.full(n_keep, float(params.get(SCAN_START_TIME) or "nan"), dtype = np.float32))
+    points = pd.DataFrame({k : np.concatenate(v) if v else np.zeros(0, dtype = np.float32) for k, v in columns.items()})
+    return(TargetedPoints(points, n_spectra, n_positive, n_negative, n_points, n_kept))
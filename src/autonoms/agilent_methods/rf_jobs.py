@@ -0,0 +1,351 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Asynchronous jobs on the RapidFire rpyc server. Long-running RapidFire UI commands (plate runs,
+# file splitting) are submitted as jobs and run one at a time by a single worker thread, so that
+# the UI is never driven by two commands at once, while status, progress, and cancel requests are
+# answered immediately from the server's connection threads. The controller submits a job, keeps
+# no connection open while it runs, and polls its status and progress events (see RemoteJob).
+################################################################################################
+import sys
+import time
+import uuid
+import queue
+import inspect
+import threading
+import traceback
+from collections import namedtuple
+from autonoms.utils_wait import wait_until, WaitTimeoutError
+################################################################################################
+
+FINISHED_STATES = ["done", "failed", "cancelled"]
+
+# Job status as returned by the server (a tuple of plain values so it is passed by value over rpyc)
+JobStatus = namedtuple("JobStatus", ["job_id", "function_name", "state", "result", "error", "n_events", "submitted", "started", "finished"])
+
+################################################################################################
+# Server side
+################################################################################################
+def accepts_job_kwargs(function):
+    """Checks whether a function can be given the event_callback and cancel_event keyword arguments of a job
+
+    :param function: Function run by the job
+    :type function: function
+    :return: True if the function takes **kwargs or both keyword arguments
+    :rtype: bool
+    """
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return(False)
+    if any(x.kind == inspect.Parameter.VAR_KEYWORD for x in parameters.values()):
+        return(True)
+    return("event_callback" in parameters and "cancel_event" in parameters)
+
+class Job:
+    """A function call submitted to a JobManager
+
+    :param function: Function to run
+    :type function: function
+    :param function_name: Function name
+    :type function_name: str
+    :param args: Positional function arguments
+    :type args: tuple
+    :param kwargs: Keyword function arguments
+    :type kwargs: dict
+    """
+    def __init__(self, function, function_name, args, kwargs):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.function = function
+        self.function_name = function_name
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs)
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.events = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def status(self):
+        return(JobStatus(self.job_id, self.function_name, self.state, self.result, self.error, len(self.events), self.submitted, self.started, self.finished))
+
+class JobManager:
+    """Runs submitted jobs one at a time, in submission order, on a single worker thread. Functions taking **kwargs (or event_callback and
+    cancel_event keyword arguments) are given an event_callback whose calls are recorded as the job's progress events and a cancel_event
+    (`threading.Event`) which is set when the job is cancelled while running
+
+    :param max_finished_jobs: Number of finished jobs kept for status requests, defaults to 100
+    :type max_finished_jobs: int, optional
+    """
+    def __init__(self, max_finished_jobs = 100):
+        self.max_finished_jobs = max_finished_jobs
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.worker = None
+
+    def submit(self, function, function_name, args = (), kwargs = None):
+        """Queues a function call
+
+        :param function: Function to run
+        :type function: function
+        :param function_name: Function name (for status and logging)
+        :type function_name: str
+        :param args: Positional function arguments, defaults to ()
+        :type args: tuple, optional
+        :param kwargs: Keyword function arguments, defaults to None
+        :type kwargs: dict, optional
+        :return: Job ID
+        :rtype: str
+        """
+        job = Job(function, function_name, args, kwargs or {})
+        with self.lock:
+            self.jobs[job.job_id] = job
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target = self._worker_loop, daemon = True, name = "rf_job_worker")
+                self.worker.start()
+        print(f"Queued job {job.job_id} ({function_name})")
+        self.queue.put(job)
+        return(job.job_id)
+
+    def _worker_loop(self):
+        while True:
+            self._run(self.queue.get())
+
+    def _run(self, job):
+        with self.lock:
+            if job.state != "queued":
+                return
+            job.state = "running"
+            job.started = time.time()
+        print(f"Running job {job.job_id} ({job.function_name})")
+        kwargs = dict(job.kwargs)
+        callback = kwargs.pop("event_callback", None)
+        def event_callback(*event):
+            job.events.append(tuple(event))
+            if callback is not None:
+                callback(*event)
+        if accepts_job_kwargs(job.function):
+            kwargs["event_callback"] = event_callback
+            kwargs["cancel_event"] = job.cancel_event
+        result, error = None, None
+        try:
+            result = job.function(*job.args, **kwargs)
+            state = "cancelled" if job.cancel_event.is_set() else "done"
+        except (Exception, SystemExit) as e:
+            traceback.print_exc()
+            state, error = "failed", f"{type(e).__name__}: {e}"
+        with self.lock:
+            job.state, job.result, job.error, job.finished = state, result, error, time.time()
+            self._prune()
+        print(f"Job {job.job_id} ({job.function_name}) {state} after {job.finished - job.started:.1f} seconds")
+        job.done_event.set()
+
+    def _prune(self):
+        finished = [x for x in self.jobs.values() if x.state in FINISHED_STATES]
+        for job in sorted(finished, key = lambda x : x.finished)[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self.jobs[job.job_id]
+
+    def get_job(self, job_id):
+        with self.lock:
+            if job_id not in self.jobs:
+                raise ValueError(f"Unknown job {job_id}")
+            return(self.jobs[job_id])
+
+    def status(self, job_id):
+        """Gets the status of a job
+
+        :param job_id: Job ID
+        :type job_id: str
+        :return: Job status
+        :rtype: `JobStatus`
+        """
+        return(self.get_job(job_id).status())
+
+    def events(self, job_id, start = 0):
+        """Gets the progress events of a job
+
+        :param job_id: Job ID
+        :type job_id: str
+        :param start: Index of the first event to return, defaults to 0
+        :type start: int, optional
+        :return: Tuple of events, each a tuple of the event_callback arguments
+        :rtype: tuple
+        """
+        return(tuple(self.get_job(job_id).events[start:]))
+
+    def cancel(self, job_id):
+        """Cancels a job. Queued jobs are removed from the queue, running jobs are asked to stop through their cancel_event
+
+        :param job_id: Job ID
+        :type job_id: str
+        :return: True if the job was queued or running
+        :rtype: bool
+        """
+        job = self.get_job(job_id)
+        with self.lock:
+            if job.state == "queued":
+                job.state, job.finished = "cancelled", time.time()
+                job.done_event.set()
+                return(True)
+            if job.state == "running":
+                job.cancel_event.set()
+                return(True)
+        return(False)
+
+    def wait(self, job_id, timeout_seconds = None):
+        """Waits for a job to finish
+
+        :param job_id: Job ID
+        :type job_id: str
+        :param timeout_seconds: Seconds to wait, defaults to None (no limit)
+        :type timeout_seconds: float, optional
+        :return: Job status
+        :rtype: `JobStatus`
+        """
+        job = self.get_job(job_id)
+        job.done_event.wait(timeout_seconds)
+        return(job.status())
+
+    def list_jobs(self):
+        """Lists the status of all known jobs
+
+        :return: Tuple of job statuses in submission order
+        :rtype: tuple
+        """
+        with self.lock:
+            return(tuple(x.status() for x in sorted(self.jobs.values(), key = lambda x : x.submitted)))
+
+################################################################################################
+# Client side
+################################################################################################
+class RemoteJob:
+    """Handle on a job running on an rpyc service with the job API (see rf_rpyc_server.RapidFireService). Every request uses a
+    short-lived checkout of a pooled connection (see autonoms.utils_rpyc), so no connection or thread is tied up while the job runs
+
+    :param host: Host name or IP address of the service
+    :type host: str
+    :param port: Port number of the service
+    :type port: int
+    :param job_id: Job ID
+    :type job_id: str
+    :param event_callback: If provided, called with the arguments of every new progress event of the job when it is polled, defaults to None
+    :type event_callback: function, optional
+    :param request_timeout: Timeout seconds for individual requests, defaults to 60
+    :type request_timeout: float, optional
+    """
+    def __init__(self, host, port, job_id, event_callback = None, request_timeout = 60):
+        self.host = host
+        self.port = port
+        self.job_id = job_id
+        self.event_callback = event_callback
+        self.request_timeout = request_timeout
+        self.n_events = 0
+        self.last_status = None
+
+    @staticmethod
+    def request(host, port, method, *args, request_timeout = 60, **kwargs):
+        from autonoms.utils_rpyc import get_connection_pool
+        with get_connection_pool().connection(host, port, sync_request_timeout = request_timeout) as connection:
+            return(getattr(connection.root, method)(*args, **kwargs))
+
+    @classmethod
+    def submit(cls, host, port, function_name, args = (), kwargs = None, event_callback = None, request_timeout = 60):
+        """Submits a job to the service
+
+        :param host: Host name or IP address of the service
+        :type host: str
+        :param port: Port number of the service
+        :type port: int
+        :param function_name: Name of the function to run
+        :type function_name: str
+        :param args: Positional function arguments, defaults to ()
+        :type args: tuple, optional
+        :param kwargs: Keyword function arguments, defaults to None
+        :type kwargs: dict, optional
+        :return: The submitted job
+        :rtype: `RemoteJob`
+        """
+        job_id = cls.request(host, port, "submit_job", function_name, *args, request_timeout = request_timeout, **(kwargs or {}))
+        return(cls(host, port, job_id, event_callback = event_callback, request_timeout = request_timeout))
+
+    def poll(self):
+        """Gets the job status and passes new progress events to event_callback
+
+        :return: Job status
+        :rtype: `JobStatus`
+        """
+        status = JobStatus(*self.request(self.host, self.port, "job_status", self.job_id, request_timeout = self.request_timeout))
+        if status.n_events > self.n_events:
+            for event in self.request(self.host, self.port, "job_events", self.job_id, self.n_events, request_timeout = self.request_timeout):
+                self.n_events += 1
+                if self.event_callback is not None:
+                    self.event_callback(*event)
+        self.last_status = status
+        return(status)
+
+    @property
+    def done(self):
+        return(self.last_status is not None and self.last_status.state in FINISHED_STATES)
+
+    def cancel(self):
+        """Cancels the job
+
+        :return: True if the job was queued or running
+        :rtype: bool
+        """
+        return(self.request(self.host, self.port, "cancel_job", self.job_id, request_timeout = self.request_timeout))
+
+    def result(self):
+        """Gets the result of a finished job, erroring if the job failed or was cancelled
+
+        :return: Return value of the job function
+        :rtype: object
+        """
+        if not self.done:
+            sys.exit(f"Error - job {self.job_id} has not finished")
+        if self.last_status.state != "done":
+            sys.exit(f"Error - job {self.job_id} ({self.last_status.function_name}) on {self.host} {self.last_status.state}: {self.last_status.error}")
+        return(self.last_status.result)
+
+    def wait(self, timeout_seconds = None, poll_seconds = 5):
+        """Polls the job until it finishes. The job is cancelled if it does not finish within timeout_seconds
+
+        :param timeout_seconds: Seconds to wait, defaults to None (no limit)
+        :type timeout_seconds: float, optional
+        :param poll_seconds: Seconds between polls, defaults to 5
+        :type poll_seconds: float, optional
+        :return: Return value of the job function
+        :rtype: object
+        """
+        wait_jobs([self], timeout_seconds = timeout_seconds, poll_seconds = poll_seconds)
+        return(self.result())
+
+def wait_jobs(jobs, timeout_seconds = None, poll_seconds = 5):
+    """Polls several remote jobs from a single thread until all of them have finished. Jobs still running after timeout_seconds are cancelled
+
+    :param jobs: Jobs to wait for
+    :type jobs: list
+    :param timeout_seconds: Seconds to wait, defaults to None (no limit)
+    :type timeout_seconds: float, optional
+    :param poll_seconds: Seconds between polls, defaults to 5
+    :type poll_seconds: float, optional
+    :return: List of the final job statuses
+    :rtype: list
+    """
+    pending = list(jobs)
+    def all_done():
+        pending[:] = [x for x in pending if not x.done and x.poll().state not in FINISHED_STATES]
+        return(not pending)
+    try:
+        wait_until(all_done, timeout_seconds, description = "RapidFire jobs", initial_seconds = 0.5, max_interval_seconds = poll_seconds)
+    except WaitTimeoutError:
+        for job in pending:
+            print(f"Warning - job {job.job_id} ({job.last_status.function_name}) did not finish within {timeout_seconds} seconds, cancelling it")
+            job.cancel()
+        sys.exit(f"Error - timed out after {timeout_seconds} seconds waiting for jobs {[x.job_id for x in pending]}")
+    return([x.last_status for x in jobs])
@@ -1,22 +1,80 @@
 import rpyc
 from rpyc.utils.server import ThreadedServer
-from autonoms.agilent_methods.utils_rapidFire import *
+import importlib
 import sys
+from autonoms.agilent_methods.rf_jobs import JobManager
+
+# Functions which only read files and can run alongside UI commands. All other functions drive the RapidFire UI and are
+# run one at a time on the job queue
+STATUS_FUNCTIONS = ["find_latest_dir", "get_rf_output_dir", "parse_batch_log_line"]
 
 class RapidFireService(rpyc.Service):
-    def exposed_call_function(self, function_name, *args, **kwargs):
+    # Shared by all connections
+    jobs = JobManager()
+
+    def get_function(self, function_name):
         print(f"Looking for function name {function_name}")
-        function = globals().get(function_name)
-        if function:
+        # utils_rapidFire (and pywinauto) is imported on the first call so that the server starts listening immediately
+        utils_rapidFire = importlib.import_module("autonoms.agilent_methods.utils_rapidFire")
+        function = getattr(utils_rapidFire, function_name, None)
+        if function is None:
+            raise ValueError(f"Function '{function_name}' not found in utils_rapidFire.py")
+        return(function)
+
+    def exposed_call_function(self, function_name, *args, **kwargs):
+        function = self.get_function(function_name)
+        if function_name in STATUS_FUNCTIONS:
             result = function(*args, **kwargs)
-            print(f'Im done running {function}. It had return value {result}')
-            return(result)
         else:
-            raise ValueError(f"Function '{function_name}' not found in utils_rapidFire.py")
-        
+            job_id = self.jobs.submit(function, function_name, args, kwargs)
+            status = self.jobs.wait(job_id)
+            if status.state != "done":
+                raise RuntimeError(f"Job {job_id} ({function_name}) {status.state}: {status.error}")
+            result = status.result
+        print(f'Im done running {function}. It had return value {result}')
+        return(result)
+
+    def exposed_submit_job(self, function_name, *args, **kwargs):
+        return(self.jobs.submit(self.get_function(function_name), function_name, args, kwargs))
+
+    def exposed_job_status(self, job_id):
+        return(tuple(self.jobs.status(job_id)))
+
+    def exposed_job_events(self, job_id, start = 0):
+        return(self.jobs.events(job_id, start = start))
+
+    def exposed_cancel_job(self, job_id):
+        return(self.jobs.cancel(job_id))
+
+    def exposed_list_jobs(self):
+        return(tuple(tuple(x) for x in self.jobs.list_jobs()))
+
+class SimulatedRapidFireService(RapidFireService):
+    # Serves the simulated RapidFire (see instrument_simulation) with its own job queue. Functions which are not simulated
+    # (e.g. find_latest_dir) run from utils_rapidFire as on the RapidFire computer
+    jobs = JobManager()
+
+    def get_function(self, function_name):
+        instrument_simulation = importlib.import_module("autonoms.agilent_methods.instrument_simulation")
+        if function_name in instrument_simulation.SIMULATED_FUNCTIONS:
+            return(getattr(instrument_simulation, function_name))
+        return(super().get_function(function_name))
+
+def get_server(port = 18861, service = RapidFireService):
+    """Builds the RapidFire rpyc server, e.g. to run a local RapidFireService for testing the client connection pool
+
+    :param port: Port to serve on, defaults to 18861
+    :type port: int, optional
+    :param service: rpyc service class to serve, defaults to RapidFireService
+    :type service: class, optional
+    :return: The server, started with its start method
+    :rtype: `rpyc.utils.server.ThreadedServer`
+    """
+    return(ThreadedServer(service, port = port, protocol_config = {"allow_public_attrs" : True}))
+
 def main():
     port = 18861
-    server = ThreadedServer(RapidFireService, port = port, protocol_config = {"allow_puyblic_attrs":True})
+    server = get_server(port = port)
     print(f"starting server on port {port}")
     server.start()
         
@@ -0,0 +1,252 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Persistent index of the RapidFire data file tree (<base>/<year>/<month name>/<day>/<run dir>).
+# The index records the date, modification time, and plate barcodes (sequence names) of every
+# run directory and is stored in the user's home directory between runs. Refreshing it only
+# lists date directories whose modification time changed (plus the most recent ones, where new
+# runs appear) and only reads the RFDatabase.xml of run directories which changed.
+################################################################################################
+import os
+import re
+import json
+import hashlib
+import datetime
+import threading
+################################################################################################
+
+INDEX_VERSION = 1
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June',
+          'July', 'August', 'September', 'October', 'November', 'December']
+BARCODE_PATTERN = re.compile(r"Barcode>([^<]+)<")
+
+def default_index_file(base_path, start_year = 2021):
+    """Gets the default index file location for a RapidFire data directory
+
+    :param base_path: Path to base RapidFire data directory
+    :type base_path: str
+    :param start_year: First indexed year, defaults to 2021
+    :type start_year: int, optional
+    :return: Path to index .json file in the user's home directory
+    :rtype: str
+    """
+    key = hashlib.sha1(f"{base_path}|{start_year}".encode("utf-8")).hexdigest()[:16]
+    return(os.path.join(os.path.expanduser("~"), ".autonoms", "rf_run_index", f"{key}.json"))
+
+def scan_subdirs(path):
+    """Lists the subdirectories of a directory together with their modification times. Uses os.scandir, which on Windows
+    gets the modification times from the directory listing itself without extra requests to the (shared) drive
+
+    :param path: Path to directory
+    :type path: str
+    :return: Dictionary of subdirectory name : modification time pairs, empty if the directory does not exist
+    :rtype: dict
+    """
+    try:
+        with os.scandir(path) as entries:
+            return({x.name : x.stat().st_mtime for x in entries if x.is_dir()})
+    except (FileNotFoundError, NotADirectoryError):
+        return({})
+
+def read_barcodes(rfdb_file):
+    """Reads the plate barcodes from a RapidFire RFDatabase.xml file
+
+    :param rfdb_file: Path to RFDatabase.xml
+    :type rfdb_file: str
+    :return: Sorted list of barcodes
+    :rtype: list
+    """
+    with open(rfdb_file, 'r', errors = "replace") as f:
+        return(sorted(set(BARCODE_PATTERN.findall(f.read()))))
+
+class RunIndex:
+    """Persistent, incrementally updated index of the run directories in a RapidFire data file tree, answering which run
+    directory is the latest (by modification time) overall or for a given sequence (plate barcode)
+
+    :param base_path: Path to base RapidFire data directory
+    :type base_path: str
+    :param index_file: Path to index .json file, defaults to a file in ~/.autonoms/rf_run_index
+    :type index_file: str, optional
+    :param start_year: First year to index, defaults to 2021
+    :type start_year: int, optional
+    :param active_days: Date directories at most this many days old are always re-listed, older ones only when their modification time changed, defaults to 2
+    :type active_days: int, optional
+    """
+    def __init__(self, base_path, index_file = None, start_year = 2021, active_days = 2):
+        self.base_path = str(base_path)
+        self.index_file = index_file or default_index_file(self.base_path, start_year = start_year)
+        self.start_year = start_year
+        self.active_days = active_days
+        self.lock = threading.RLock()
+        self.dirs = {}
+        self.runs = {}
+        self.latest = {}
+        self.latest_run = None
+        self.load()
+
+    def path(self, rel_path):
+        return(os.path.join(self.base_path, *rel_path.split("/")))
+
+    def load(self):
+        """Loads the index from its index file, if there is a valid one
+        """
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                d = json.load(f)
+        except (OSError, ValueError):
+            print(f"Warning - could not read RapidFire run index {self.index_file}, rebuilding it")
+            return
+        if d.get("version") != INDEX_VERSION or d.get("base_path") != self.base_path:
+            return
+        self.dirs = d["dirs"]
+        self.runs = d["runs"]
+        self.update_latest()
+
+    def save(self):
+        """Writes the index to its index file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok = True)
+        temp_file = f"{self.index_file}.{os.getpid()}_{threading.get_ident()}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump({"version" : INDEX_VERSION, "base_path" : self.base_path, "dirs" : self.dirs, "runs" : self.runs}, f)
+        os.replace(temp_file, self.index_file)
+
+    def update_latest(self, run_paths = None):
+        """Updates the latest run directory overall and per barcode with the given run directories
+
+        :param run_paths: Run directories (relative to base_path) to consider, defaults to all indexed run directories
+        :type run_paths: list, optional
+        """
+        if run_paths is None:
+            self.latest = {}
+            self.latest_run = None
+            run_paths = self.runs.keys()
+        for run_path in run_paths:
+            run = self.runs[run_path]
+            for barcode in run["barcodes"]:
+                current = self.latest.get(barcode)
+                if current is None or current not in self.runs or self.runs[current]["mtime"] <= run["mtime"]:
+                    self.latest[barcode] = run_path
+            if self.latest_run is None or self.latest_run not in self.runs or self.runs[self.latest_run]["mtime"] <= run["mtime"]:
+                self.latest_run = run_path
+
+    def index_run(self, run_path, mtime, date):
+        """Adds or updates a run directory, reading its RFDatabase.xml if it changed
+
+        :param run_path: Run directory relative to base_path
+        :type run_path: str
+        :param mtime: Modification time of the run directory
+        :type mtime: float
+        :param date: ISO date of the run's date directory
+        :type date: str
+        :return: True if the run directory is new or changed
+        :rtype: bool
+        """
+        run = self.runs.get(run_path)
+        # Runs without barcodes are re-checked as their RFDatabase.xml may not have been written yet
+        if run is not None and run["mtime"] == mtime and run["barcodes"]:
+            return(False)
+        rfdb_file = os.path.join(self.path(run_path), "RFDatabase.xml")
+        try:
+            rfdb_mtime = os.path.getmtime(rfdb_file)
+            barcodes = run["barcodes"] if run is not None and run["rfdb_mtime"] == rfdb_mtime else read_barcodes(rfdb_file)
+        except OSError:
+            rfdb_mtime, barcodes = None, []
+        self.runs[run_path] = {"date" : date, "mtime" : mtime, "rfdb_mtime" : rfdb_mtime, "barcodes" : barcodes}
+        return(True)
+
+    def refresh(self, full = False):
+        """Brings the index up to date with the RapidFire data file tree
+
+        :param full: Re-list every date directory instead of only the changed and recent ones, defaults to False
+        :type full: bool, optional
+        :return: True if the index changed
+        :rtype: bool
+        """
+        with self.lock:
+            today = datetime.date.today()
+            changed_runs = []
+            removed_runs = []
+            listed_days = set()
+            for year_name in scan_subdirs(self.base_path):
+                if not year_name.isdigit() or int(year_name) < self.start_year:
+                    continue
+                for month_name, month_mtime in scan_subdirs(self.path(year_name)).items():
+                    if month_name not in MONTHS:
+                        continue
+                    month_path = f"{year_name}/{month_name}"
+                    month_start = datetime.date(int(year_name), MONTHS.index(month_name) + 1, 1)
+                    month_active = (today - month_start).days <= 31 + self.active_days
+                    if not (full or month_active or self.dirs.get(month_path) != month_mtime):
+                        continue
+                    for day_name, day_mtime in scan_subdirs(self.path(month_path)).items():
+                        try:
+                            date = datetime.date(month_start.year, month_start.month, int(day_name))
+                        except ValueError:
+                            continue
+                        day_path = f"{month_path}/{day_name}"
+                        if not (full or (today - date).days <= self.active_days or self.dirs.get(day_path) != day_mtime):
+                            continue
+                        run_dirs = scan_subdirs(self.path(day_path))
+                        for run_name, run_mtime in run_dirs.items():
+                            run_path = f"{day_path}/{run_name}"
+                            if self.index_run(run_path, run_mtime, date.isoformat()):
+                                changed_runs.append(run_path)
+                        removed_runs.extend(x for x in self.runs if x.startswith(f"{day_path}/") and x.split("/")[-1] not in run_dirs)
+                        self.dirs[day_path] = day_mtime
+                        listed_days.add(day_path)
+                    self.dirs[month_path] = month_mtime
+            if full:
+                # Date directories which no longer exist
+                removed_runs.extend(x for x in self.runs if x.rsplit("/", 1)[0] not in listed_days)
+                self.dirs = {k : v for k, v in self.dirs.items() if k in listed_days or k.count("/") == 1}
+            for run_path in removed_runs:
+                self.runs.pop(run_path, None)
+            if removed_runs:
+                self.update_latest()
+            else:
+                self.update_latest(changed_runs)
+            if changed_runs or removed_runs:
+                self.save()
+            return(bool(changed_runs or removed_runs))
+
+    def find_latest(self, sequence_name = None, refresh = True):
+        """Gets the latest run directory
+
+        :param sequence_name: If provided, only consider run directories containing data from the RF sequence (plate barcode) with this name, defaults to None
+        :type sequence_name: str, optional
+        :param refresh: Refresh the index before the lookup, defaults to True
+        :type refresh: bool, optional
+        :return: Path to the latest-modified run directory, None if there is none
+        :rtype: str
+        """
+        with self.lock:
+            if refresh:
+                self.refresh()
+            run_path = self.latest.get(sequence_name) if sequence_name else self.latest_run
+            if run_path is not None and not os.path.isdir(self.path(run_path)):
+                # The run directory was removed since it was indexed
+                self.refresh(full = True)
+                run_path = self.latest.get(sequence_name) if sequence_name else self.latest_run
+            return(self.path(run_path) if run_path else None)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_run_index(base_path, start_year = 2021):
+    """Gets the (shared) run index of a RapidFire data directory
+
+    :param base_path: Path to base RapidFire data directory
+    :type base_path: str
+    :param start_year: First year to index, defaults to 2021
+    :type start_year: int, optional
+    :return: The run index
+    :rtype: `RunIndex`
+    """
+    key = (str(base_path), start_year)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = RunIndex(base_path, start_year = start_year)
+        return(_indexes[key])
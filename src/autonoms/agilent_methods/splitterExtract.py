@@ -5,10 +5,188 @@ import os
 import re
 import xml.etree.ElementTree as ET
 import argparse
+import functools
+from collections import namedtuple
 ####################################################################################
 
+# An injection from the RapidFire UI splitter log, with its plate sequence number from RFDatabase.xml (times in minutes)
+InjectionRecord = namedtuple("InjectionRecord", ["barcode", "sequence", "well", "original_start", "original_end", 
+                                                 "effective_start", "effective_end", "output_name"])
+SAMPLE_INFO_PATH = ["Plates", "Plate", "Injections", "SampleInfo"]
+TIME_RANGE_PATTERN = re.compile(r"(-?\d+(?:\.\d*)?)\s*-\s*(-?\d+(?:\.\d*)?)")
+OUTPUT_NAME_PATTERN = re.compile(r"(Inj[^\\/]*?)-([^\\/]+)-([^-\\/]+)\.d\b")
 
-def get_splits(splitterLog, RFDB, dFile):
+
+def iter_rfdb_samples(RFDB):
+    """Streams the injections (SampleInfo elements) of a RFDatabase.xml file, keeping only the current injection in memory
+
+    :param RFDB: Path to RFDatabase.xml output file from RapidFire run
+    :type RFDB: str
+    :return: Generator of dictionaries of field name : value pairs (e.g. Sequence, Barcode, Well), one for each injection
+    :rtype: generator
+    """
+    path = []
+    for event, elem in ET.iterparse(RFDB, events = ("start", "end")):
+        if event == "start":
+            path.append(elem.tag)
+            continue
+        if elem.tag == "SampleInfo" and path[1 : ] == SAMPLE_INFO_PATH:
+            yield({x.findtext("Name") : x.findtext("Value") for x in elem if x.tag == "Field"})
+            elem.clear()
+        elif elem.tag == "Plate" and path[1 : ] == SAMPLE_INFO_PATH[ : 2]:
+            elem.clear()
+        path.pop()
+
+def file_key(path):
+    # Identifies a version of a file, so parsed files are re-read once they change
+    st = os.stat(path)
+    return((os.path.abspath(path), st.st_size, st.st_mtime_ns))
+
+def injection_keys(injections):
+    """Numbers repeated injections of the same well of a plate, in order
+
+    :param injections: Iterable of (barcode, well) tuples in acquisition order
+    :type injections: iterable
+    :return: Generator of (barcode, well, injection index) tuples, the index counting earlier injections of the same barcode and well
+    :rtype: generator
+    """
+    counts = {}
+    for barcode, well in injections:
+        index = counts.get((barcode, well), 0)
+        counts[(barcode, well)] = index + 1
+        yield((barcode, well, index))
+
+@functools.lru_cache(maxsize = 8)
+def _read_rfdb_sequences(key):
+    samples = [(x.get("Barcode"), x.get("Well"), x.get("Sequence")) for x in iter_rfdb_samples(key[0])]
+    return(dict(zip(injection_keys((b, w) for b, w, _ in samples), (s for _, _, s in samples))))
+
+def read_rfdb_sequences(RFDB):
+    """Reads the plate sequence number of every injection in a RFDatabase.xml file in one pass. The result is kept until the file changes,
+    so the plates of a multi-plate batch are looked up without re-reading the file. Repeated injections of the same well are kept apart by 
+    their injection index
+
+    :param RFDB: Path to RFDatabase.xml output file from RapidFire run
+    :type RFDB: str
+    :return: Dictionary of (barcode, well, injection index) : sequence pairs (see injection_keys)
+    :rtype: dict
+    """
+    return(dict(_read_rfdb_sequences(file_key(RFDB))))
+
+def parse_time_range(line):
+    # Reads the (start, end) minutes after the last ": " of a splitter log line, None if there is no time range
+    m = TIME_RANGE_PATTERN.search(line.rsplit(": ", 1)[-1])
+    return((float(m.group(1)), float(m.group(2))) if m else None)
+
+def iter_splitter_log(splitterLog):
+    """Streams the injections written by the RapidFire UI splitter from its log, line by line. An injection entry starts with its 
+    "Writing <output .d file>" line and its time ranges are read from the following "Original time range" and "Effective time range" lines. 
+    Entries without these labels are read by position as in the original splitter log format: the original time range on the first and the effective 
+    time range on the fourth line after the "Writing" line, the entry ending with a "Time" line on the sixth. "Writing" lines of other output 
+    files and entries whose time ranges cannot be read are skipped
+
+    :param splitterLog: Path to RapidFire UI splitter output log
+    :type splitterLog: str
+    :return: Generator of InjectionRecord injections, without sequence numbers
+    :rtype: generator
+    """
+    def record(entry):
+        original, effective = entry["original"], entry["effective"]
+        lines = entry["lines"]
+        if (original is None or effective is None) and len(lines) >= 7 and lines[6].startswith("Time"):
+            original, effective = original or parse_time_range(lines[1]), effective or parse_time_range(lines[4])
+        if original is None or effective is None:
+            return(None)
+        m = entry["match"]
+        return(InjectionRecord(m.group(2), None, m.group(3), *original, *effective, f"{m.group(1)}-{m.group(2)}-{m.group(3)}.d"))
+    entry = None
+    with open(splitterLog, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("Writing "):
+                if entry is not None:
+                    injection = record(entry)
+                    if injection is not None:
+                        yield(injection)
+                m = OUTPUT_NAME_PATTERN.search(os.path.basename(line[len("Writing ") : ].strip()))
+                entry = {"match" : m, "lines" : [line], "original" : None, "effective" : None} if m else None
+            elif entry is not None:
+                if len(entry["lines"]) < 7:
+                    entry["lines"].append(line)
+                if line.startswith(("Original time range", "Effective time range")):
+                    entry["original" if line.startswith("Original") else "effective"] = parse_time_range(line)
+    if entry is not None:
+        injection = record(entry)
+        if injection is not None:
+            yield(injection)
+
+@functools.lru_cache(maxsize = 8)
+def _read_splitter_log(key):
+    return(tuple(iter_splitter_log(key[0])))
+
+def read_splitter_log(splitterLog):
+    """Reads the injections written by the RapidFire UI splitter from its log in one pass. The result is kept until the file changes
+
+    :param splitterLog: Path to RapidFire UI splitter output log
+    :type splitterLog: str
+    :return: Tuple of InjectionRecord injections, without sequence numbers
+    :rtype: tuple
+    """
+    return(_read_splitter_log(file_key(splitterLog)))
+
+def read_injections(splitterLog, RFDB):
+    """Reads the injections written by the RapidFire UI splitter together with their plate sequence numbers, streaming each file once
+
+    :param splitterLog: Path to RapidFire UI splitter output log
+    :type splitterLog: str
+    :param RFDB: Path to RFDatabase.xml output file from RapidFire sequence on which UI splitter was run
+    :type RFDB: str
+    :return: Generator of InjectionRecord injections in splitter log order (sequence is None for injections not found in RFDB)
+    :rtype: generator
+    """
+    well_sequences = read_rfdb_sequences(RFDB)
+    barcode_sequences = {}
+    for (barcode, well, index), sequence in well_sequences.items():
+        barcode_sequences.setdefault(barcode, set()).add(sequence)
+    counts = {}
+    for injection in iter_splitter_log(splitterLog):
+        index = counts.get((injection.barcode, injection.well), 0)
+        counts[(injection.barcode, injection.well)] = index + 1
+        sequence = well_sequences.get((injection.barcode, injection.well, index))
+        if sequence is None and len(barcode_sequences.get(injection.barcode, [])) == 1:
+            sequence = next(iter(barcode_sequences[injection.barcode]))
+        yield(injection._replace(sequence = sequence))
+
+def get_sequence_d_file(RFDB, barcode):
+    """Gets the name of the sequence .d file holding the injections of a plate. In multi-plate batches each plate is acquired into its own sequence .d file
+
+    :param RFDB: Path to RFDatabase.xml output file from RapidFire run
+    :type RFDB: str
+    :param barcode: Plate barcode (the sequence name)
+    :type barcode: str
+    :return: Sequence .d file name, e.g. sequence1.d
+    :rtype: str
+    """
+    sequences = set(s for (b, well, index), s in read_rfdb_sequences(RFDB).items() if b == barcode)
+    if len(sequences) != 1:
+        sys.exit(f"Error - expected a single sequence for plate barcode {barcode} in {RFDB}, but got sequence set = {sequences}")
+    return(f"sequence{sequences.pop()}.d")
+
+def correct_injection_offset(effective_range, interval):
+    """Shifts the effective time range the RapidFire file splitter reports for an injection back by one injection interval, 
+    as the splitter reports each injection one injection late
+
+    :param effective_range: Tuple of the effective start and end times of the injection (minutes)
+    :type effective_range: tuple
+    :param interval: Minutes between the effective start of this injection and that of the next one (of the previous one for the last 
+        injection of a plate, 0 for a plate with a single injection)
+    :type interval: float
+    :return: Tuple of the corrected start and end times (minutes), the start being at least 0.1
+    :rtype: tuple
+    """
+    return((max(effective_range[0] - interval, 0.1), effective_range[1] - interval))
+
+def get_splits(splitterLog, RFDB, dFile, barcode = None):
     """Extract split start and end times from the splitter log produced by RapidFire UI splitter output
 
     :param splitterLog: Path to RapidFire UI splitter output log
@@ -17,40 +195,30 @@ def get_splits(splitterLog, RFDB, dFile):
     :type RFDB: str
     :param dFile: .d file on which splitter was run
     :type dFile: str
+    :param barcode: If provided, only extract splits of the plate with this barcode (for multi-plate batches), defaults to None
+    :type barcode: str, optional
     :return: List of strings of individual well split start and end times
     :rtype: list
     """
     sequence = os.path.basename(dFile.lower()).replace(".demp.d", "").replace('.d', '').replace('sequence', '')
-    tree = ET.parse(RFDB)
-    root = tree.getroot()
-    samples =  [x for x in root.iterfind("Plates/Plate/Injections/SampleInfo") if x.find(".//Name[.='Sequence']/../Value").text == sequence]
-    barcodes = [s.find("./Field/Name[.='Barcode']/../Value").text for s in samples]
-    if len(set(barcodes)) != 1:
+    well_sequences = read_rfdb_sequences(RFDB)
+    barcodes = set(b for (b, well, index), s in well_sequences.items() if s == sequence and (barcode is None or b == barcode))
+    if len(barcodes) != 1:
         sys.exit('Error - more than one plate barcode found?')
-    barcode = barcodes[0]
+    barcode = barcodes.pop()
+    injections = [x for x in read_splitter_log(splitterLog) if x.barcode == barcode]
 
-    with open(splitterLog, 'r') as f:
-        logLines = f.read()
-    splitterLines = re.findall(rf"Writing .*-{barcode}-.*\.d.*\n.*\n.*\n.*\n.*\n.*\nTime.*", logLines)
-
-    def fl(l):
-        return([(float(x), float(y)) for (x,y) in l])
-    originalTimes = fl([x.split('\n')[1].split(': ')[-1].split('-') for x in splitterLines])
-    effectiveTimes = fl([x.split('\n')[4].split(': ')[-1].split('-') for x in splitterLines])
-    effectiveTimesStart = [x[0] for x in effectiveTimes]
-    effectiveTimesEnd = [x[1] for x in effectiveTimes]
-    if len(effectiveTimes) == 1:
+    effectiveTimesStart = [x.effective_start for x in injections]
+    if len(injections) == 1:
         diffs = [0]
     else:
         diffs = [effectiveTimesStart[i] - effectiveTimesStart[i - 1] for i in range(1, len(effectiveTimesStart))]
-        diffs = diffs + [diffs[-1]]
-    newTimes = [(max(s - diffs[i], 0.1), e - diffs[i]) for i, (s,e) in enumerate(effectiveTimes)]
-    outSufs = [re.findall(rf"Inj.*\.d", x)[0].replace('.d', '') for x in splitterLines]
+        diffs = diffs + diffs[-1 : ]
+    newTimes = [correct_injection_offset((x.effective_start, x.effective_end), diffs[i]) for i, x in enumerate(injections)]
 
     out_lines = []
     for i, (startTime_adjusted, endTime_adjusted) in enumerate(newTimes):
-        outSuf = outSufs[i]
-        t = (os.path.basename(dFile), f"{outSuf}.d", startTime_adjusted, endTime_adjusted)
+        t = (os.path.basename(dFile), injections[i].output_name, startTime_adjusted, endTime_adjusted)
         out_lines.append(t)
     return(out_lines)
 
@@ -4,52 +4,51 @@
 import os
 import sys
 import time
-if sys.platform.startswith('win'):
-    # Import pywin libraries if we're running on windows
-    from pywinauto import Application
-    from pywinauto import Desktop
 import shutil
-
+from autonoms.agilent_methods.utils_automation import get_automation_backend, get_window, ElementNotFoundError
+from autonoms.utils_wait import wait_until, wait_or_exit, WaitTimeoutError
 ################################################################################################
 # Functions for individual actions in the MassHunter Data Acquisition Program
 ################################################################################################
 def initialize_app(search_str = "Agilent MassHunter Workstation Data Acquisition", backend = 'uia'):
-    """Finds the (open) MassHunter Acquisition application and returns its handles
+    """Finds the (open) MassHunter Acquisition application and returns its handles. The connection and window are kept between calls 
+    (see autonoms.agilent_methods.utils_automation), so repeated calls do not reconnect to the application
 
     :param search_str: Identifying application text to search for, defaults to "Agilent MassHunter Workstation Data Acquisition"
     :type search_str: str, optional
-    :param backend: pywinauto backend to use, defaults to "uia"
+    :param backend: pywinauto backend to use if no automation backend was configured, defaults to "uia"
     :type backend: str, optional
-    :return: Respectively the pywinauto application and pywinauto window corresponding to MassHunter Workstation Data Acquisition
+    :return: Respectively the application and the window (`autonoms.agilent_methods.utils_automation.UIWindow`) corresponding to MassHunter Workstation Data Acquisition
     :rtype: tuple
     """
-    app = Application(backend = backend).connect(title_re = f".*{search_str}")
-    window = app.window(title_re = f".*{search_str}")
-    if not window:
-        print(f"Could not find window with title '{window_title}'")
+    get_automation_backend(pywinauto_backend = backend)
+    try:
+        window = get_window(f".*{search_str}", title_re = f".*{search_str}")
+    except ElementNotFoundError:
+        print(f"Could not find window with title '{search_str}'")
         sys.exit(1)
-    return(app, window)
+    return(window.app, window)
 
 
 def open_ms_method(window, method_name):
     """Loads an MS acquisition method by name
 
-    :param window: pywinauto window corresponding to MassHunter Workstation Data Acquisition
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param method_name: Acquisition method name
     :type method_name: str
     """
 
-    open_method = window.child_window(auto_id = "openMethodBtn")
+    open_method = window.element(auto_id = "openMethodBtn")
     # open_method.set_focus()
     open_method.click_input()
 
-    filename_input = window.child_window(auto_id = "txtFileName")
+    filename_input = window.element(auto_id = "txtFileName")
     # filename_input.set_focus()
     filename_input.set_edit_text("")
     filename_input.type_keys(method_name)
 
-    open_button = window.child_window(auto_id = "btnOpenSaveFile")
+    open_button = window.element(auto_id = "btnOpenSaveFile")
     # open_button.set_focus()
     open_button.click_input()
 
@@ -57,8 +56,8 @@ def open_ms_method(window, method_name):
 def set_calibration_output(window, sample_name, out_d_file_name):
     """Sets the output filename of a single-sample instrument run
 
-    :param window: pywinauto window corresponding to MassHunter Workstation Data Acquisition
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param sample_name: Output metadata sample name
     :type sample_name: str
     :param out_d_file_name: Output .d file name
@@ -66,17 +65,17 @@ def set_calibration_output(window, sample_name, out_d_file_name):
     :return: Full path to the output .d file
     :rtype: str
     """
-    sample_name_box = window.child_window(auto_id = "txtSampleName")
+    sample_name_box = window.element(auto_id = "txtSampleName")
     # sample_name_box.set_focus()
     sample_name_box.set_edit_text("")
     sample_name_box.type_keys(sample_name)
 
-    output_name = window.child_window(auto_id = "txtSampleDataFileName")
+    output_name = window.element(auto_id = "txtSampleDataFileName")
     # output_name.set_focus()
     output_name.set_edit_text("")
     output_name.type_keys(out_d_file_name)
 
-    output_path = window.child_window(auto_id = "txtSampleDataPath")
+    output_path = window.element(auto_id = "txtSampleDataPath")
     # output_path.set_focus()
 
     # Can change this later to just move the output file to the desired output directory
@@ -88,14 +87,14 @@ def set_calibration_output(window, sample_name, out_d_file_name):
 def get_instrument_state(window):
     """Function for monitoring the 6560 instrument state in the main MH Data Acquisition Window
 
-    :param window: pywinauto window corresponding to MassHunter Workstation Data Acquisition
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :return: Instrument state
     :rtype: str
     """
     state_colors = {"idle" : '#FF75C335', 'not ready' : "#FFFFBA00", "run" : "#FF4780EA", "prerun" : '#FF5F4AC9'}
     colors_state = {v : k for k,v in state_colors.items()}
-    status_bar = window.child_window(auto_id = "AutomationId.StatusBar.StateLabel")
+    status_bar = window.element(auto_id = "AutomationId.StatusBar.StateLabel")
     status_color = status_bar.legacy_properties()["Value"]
     if status_color not in colors_state.keys():
         sys.exit(f"Error - couldnt find a state color for status color {status_color}")
@@ -105,8 +104,8 @@ def get_instrument_state(window):
 def wait_for_state(window, state, timeout_seconds):
     """Waits for 6560 to reach a given state by monitoring the main MH Data Acquisition window
 
-    :param window: pywinauto window corresponding to MassHunter Workstation Data Acquisition
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param state: Desired state (one of ["idle", "not read", "run", "prerun"])
     :type state: str
     :param timeout_seconds: Seconds to wait for instrument to reach state before erroring
@@ -116,65 +115,78 @@ def wait_for_state(window, state, timeout_seconds):
     # Yellow (not ready) = "#FFFFBA00"
     # Blue (run) = "#FF4780EA"
     # Purple (prerun) = '#FF5F4AC9'
-    start_time = time.time()
-    current_state = "(initializing state check)"
-    reached_state = (current_state == state)
-    while (time.time() - start_time < timeout_seconds) and not reached_state:
-        time.sleep(1)
+    current_state = ["(initializing state check)"]
+    def reached_state():
         new_state = get_instrument_state(window)
-        if new_state != current_state:
+        if new_state != current_state[0]:
             print(f"Waiting for state {state}....Instrument currently in state {new_state}")
-        current_state = new_state
-        reached_state = (current_state == state)
-    if not reached_state:
-        sys.exit(f"Error - instrument timed out reaching state {state} after {timeout_seconds} seconds")
+        current_state[0] = new_state
+        return(new_state == state)
+    wait_or_exit(reached_state, timeout_seconds, description = f"6560 state {state}")
     print(f"Instrument reached state {state}")
 
 def start_sample_run(window, overwrite = True):
     """Starts a single sample run
 
-    :param window: pywinauto window corresponding to MassHunter Workstation Data Acquisition
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param overwite: Overwrite existing output file, defaults to True
     :type overwite: bool, optional
     """
-    sample_run_pane = window.child_window(auto_id = "toolStrip1")
-    run_button = sample_run_pane.child_window(title = "Run")
+    run_button = window.element({"auto_id" : "toolStrip1"}, title = "Run")
     # run_button.set_focus()
     run_button.click_input()
 
     check_overwrite_text = "Starting the run will overwrite the existing data file. Do you want to continue?"
     continued = True
-    if (window.child_window(auto_id =  "txtBlockMessageText").exists()):
+    # Message box controls only exist while the message box is shown, so they are not cached
+    if (window.exists(auto_id =  "txtBlockMessageText")):
         if overwrite:
-            overwrite_button = window.child_window(auto_id = "btnYes")
+            overwrite_button = window.find(auto_id = "btnYes")
         else:
-            overwrite_button = window.child_window(auto_id = "btnNo")
+            overwrite_button = window.find(auto_id = "btnNo")
             continued = False
             print(f"Existing output file name and overwrite was set to False - aborting")
         # overwrite_button.set_focus()
         overwrite_button.click_input()
 
+def click_message_button(window, auto_id, timeout_seconds, description):
+    """Waits for a message box button to appear and clicks it. Message box controls only exist while the message box is shown, 
+    so they are not cached
+
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param auto_id: Automation ID of the button
+    :type auto_id: str
+    :param timeout_seconds: Seconds to wait for the button
+    :type timeout_seconds: float
+    :param description: Description of the message box for wait statistics and warnings
+    :type description: str
+    :return: True if the button appeared and was clicked
+    :rtype: bool
+    """
+    try:
+        wait_until(lambda : window.exists(auto_id = auto_id), timeout_seconds, description = description)
+    except WaitTimeoutError:
+        print(f"Warning - {description} did not appear within {timeout_seconds} seconds")
+        return(False)
+    button = window.find(auto_id = auto_id)
+    # button.set_focus()
+    button.click_input()
+    return(True)
+
 def stop_sample_run(window):
     """Stops a running single sample run
 
-    :param window: pywinauto window corresponding to MassHunter Workstation Data Acquisition
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to MassHunter Workstation Data Acquisition
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     """
-    sample_run_pane = window.child_window(auto_id = "toolStrip1")
-    stop_button = sample_run_pane.child_window(title = "Stop")
+    stop_button = window.element({"auto_id" : "toolStrip1"}, title = "Stop")
     # stop_button.set_focus()
     stop_button.click_input()
-    time.sleep(5)
 
     # "User stopped the run" message
-    ok_button = window.child_window(auto_id = "btnOK")
-    start_time = time.time()
-    while (not ok_button.exists()) and (time.time() - start_time) < 10:
-        time.sleep(1)
-    if ok_button.exists():
-        # ok_button.set_focus()
-        ok_button.click_input()
+    click_message_button(window, "btnOK", 15, "6560 run stopped message")
 
 
 def run_calibration_B(ms_method_name, output_d_filename_full, sample_name = "CalB", runtime = 30, manual_stop = True, overwrite = True, timeout_seconds = 900):
@@ -207,16 +219,10 @@ def run_calibration_B(ms_method_name, output_d_filename_full, sample_name = "Cal
     open_ms_method(window, ms_method_name)
     output_d_file_base = os.path.basename(output_d_filename_full)
     agilent_output_file = set_calibration_output(window, sample_name, output_d_file_base)
-    reset_button = window.child_window(auto_id = "resetMethodBtn")
+    reset_button = window.element(auto_id = "resetMethodBtn")
     # reset_button.set_focus()
     reset_button.click_input()
-    yes_button = window.child_window(auto_id = "btnYes")
-    start_time = time.time()
-    while (not yes_button.exists()) and (time.time()- start_time) < 15:
-        time.sleep(1)
-    if yes_button.exists():
-        # yes_button.set_focus()
-        yes_button.click_input()
+    click_message_button(window, "btnYes", 15, "6560 method reset confirmation")
     wait_for_state(window, "idle", timeout_seconds = timeout_seconds)
     start_sample_run(window, overwrite = overwrite)
     wait_for_state(window, "run", timeout_seconds = timeout_seconds)
@@ -225,13 +231,7 @@ def run_calibration_B(ms_method_name, output_d_filename_full, sample_name = "Cal
         stop_sample_run(window)
     else:
         # "Run Completed" message box
-        ok_button = window.child_window(auto_id = "btnOK")
-        start_time = time.time()
-        while (not ok_button.exists()) and (time.time() - start_time) < 15:
-            time.sleep(1)
-        if ok_button.exists():
-            # ok_button.set_focus()
-            ok_button.click_input()
+        click_message_button(window, "btnOK", 15, "6560 run completed message")
         wait_for_state(window, "idle", timeout_seconds = timeout_seconds)
 
     wait_for_state(window, 'idle', timeout_seconds = timeout_seconds)
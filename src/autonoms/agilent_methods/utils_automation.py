@@ -0,0 +1,518 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# UI automation layer for the instrument control programs (RapidFire UI, MassHunter Data
+# Acquisition). Windows are looked up once and kept between calls, and the controls inside a
+# window are resolved once and cached, only being looked up again once a cached handle is no
+# longer valid (e.g. a menu item of a closed menu). Lookups go through an automation backend:
+# PywinautoBackend drives the real programs on Windows and FakeBackend works on an in-memory
+# element tree, so the UI functions can be run and timed on any platform.
+################################################################################################
+import re
+import sys
+import time
+import threading
+from autonoms.utils_wait import wait_until, WaitTimeoutError
+################################################################################################
+
+# Criteria which are passed on to pywinauto child_window/window lookups, all other criteria are matched by scanning elements
+SPEC_CRITERIA = ["title", "title_re", "control_type", "class_name", "auto_id"]
+
+class ElementNotFoundError(LookupError):
+    pass
+
+def element_matches(properties, criteria):
+    """Checks whether an element matches lookup criteria
+
+    :param properties: Element properties (title, texts, control_type, class_name, auto_id)
+    :type properties: dict
+    :param criteria: Lookup criteria. Supported are title, title_re, control_type, class_name, and auto_id (as in pywinauto),
+        auto_id_contains and text_contains (substrings of the automation ID and window text), and text (one of the element texts)
+    :type criteria: dict
+    :return: True if the element matches all criteria
+    :rtype: bool
+    """
+    for k, v in criteria.items():
+        if k == "children_only":
+            continue
+        elif k == "title_re":
+            if not re.match(v, properties["title"] or ""):
+                return(False)
+        elif k == "text_contains":
+            if v not in (properties["title"] or ""):
+                return(False)
+        elif k == "auto_id_contains":
+            if v not in (properties["auto_id"] or ""):
+                return(False)
+        elif k == "text":
+            if v not in properties["texts"]:
+                return(False)
+        elif k in ["title", "control_type", "class_name", "auto_id"]:
+            if properties[k] != v:
+                return(False)
+        else:
+            sys.exit(f"Error - unrecognized element lookup criterion {k}")
+    return(True)
+
+################################################################################################
+# Backends
+################################################################################################
+class AutomationBackend:
+    """Interface of the automation backends. Element handles returned by a backend support the control methods used by the UI functions
+    (click_input, set_edit_text, type_keys, get_value, legacy_properties, get_toggle_state, toggle, texts, set_focus)
+    """
+    def connect(self, title_re):
+        """Connects to a running application
+
+        :param title_re: Regular expression matching the title of one of the application's windows
+        :type title_re: str
+        :return: Application handle
+        :rtype: object
+        """
+        raise NotImplementedError
+
+    def top_window(self, app, **criteria):
+        """Finds a top-level window of an application, raising ElementNotFoundError if there is none
+        """
+        raise NotImplementedError
+
+    def properties(self, element):
+        """Gets the properties of an element matched by element_matches
+        """
+        raise NotImplementedError
+
+    def children(self, element):
+        raise NotImplementedError
+
+    def descendants(self, element):
+        raise NotImplementedError
+
+    def is_valid(self, element):
+        """Checks whether an element handle still refers to an element shown in the UI
+        """
+        raise NotImplementedError
+
+    def find_child(self, parent, criteria):
+        """Finds the first element below parent matching criteria, raising ElementNotFoundError if there is none
+
+        :param parent: Parent element handle
+        :type parent: object
+        :param criteria: Lookup criteria (see element_matches). If children_only is set only the direct children of parent are searched
+        :type criteria: dict
+        :return: Element handle
+        :rtype: object
+        """
+        candidates = self.children(parent) if criteria.get("children_only") else self.descendants(parent)
+        for element in candidates:
+            if element_matches(self.properties(element), criteria):
+                return(element)
+        raise ElementNotFoundError(f"No element matching {criteria}")
+
+    def find(self, root, path):
+        """Finds an element by a path of lookup criteria, each level being looked up below the element found for the previous one
+
+        :param root: Window handle
+        :type root: object
+        :param path: List of lookup criteria dictionaries
+        :type path: list
+        :return: Element handle
+        :rtype: object
+        """
+        element = root
+        for criteria in path:
+            element = self.find_child(element, criteria)
+        return(element)
+
+    def wait_window(self, app, timeout_seconds, **criteria):
+        """Waits for a top-level window to appear, raising ElementNotFoundError if it does not appear within timeout_seconds
+        """
+        def window():
+            try:
+                return(self.top_window(app, **criteria))
+            except ElementNotFoundError:
+                return(None)
+        try:
+            return(wait_until(window, timeout_seconds, description = f"window {criteria}"))
+        except WaitTimeoutError:
+            raise ElementNotFoundError(f"No window matching {criteria} appeared within {timeout_seconds} seconds")
+
+class PywinautoBackend(AutomationBackend):
+    """Automation backend driving Windows applications through pywinauto
+
+    :param backend: pywinauto backend, defaults to "uia"
+    :type backend: str, optional
+    """
+    def __init__(self, backend = 'uia'):
+        self.backend = backend
+
+    def connect(self, title_re):
+        # pywinauto is only available on Windows and slow to import, so it is imported on first use
+        from pywinauto import Application
+        return(Application(backend = self.backend).connect(title_re = title_re))
+
+    def top_window(self, app, **criteria):
+        if all(k in SPEC_CRITERIA for k in criteria):
+            # Window specifications are kept (rather than the resolved wrapper) so that child lookups can use child_window
+            window = app.window(**criteria)
+            if not window.exists(timeout = 0):
+                raise ElementNotFoundError(f"No window matching {criteria}")
+            return(window)
+        for window in app.windows():
+            if element_matches(self.properties(window), criteria):
+                return(window)
+        raise ElementNotFoundError(f"No window matching {criteria}")
+
+    def properties(self, element):
+        return({"title" : element.window_text(), "texts" : element.texts(), "control_type" : element.element_info.control_type,
+                "class_name" : element.class_name(), "auto_id" : element.automation_id()})
+
+    def children(self, element):
+        if hasattr(element, "wrapper_object"):
+            element = element.wrapper_object()
+        return(element.children())
+
+    def descendants(self, element):
+        if hasattr(element, "wrapper_object"):
+            element = element.wrapper_object()
+        return(element.descendants())
+
+    def find(self, root, path):
+        # Leading levels which pywinauto can look up itself are resolved in a single child_window chain
+        element = root
+        for i_level, criteria in enumerate(path):
+            if not (hasattr(element, "child_window") and all(k in SPEC_CRITERIA for k in criteria)):
+                if hasattr(element, "wrapper_object"):
+                    element = element.wrapper_object()
+                return(AutomationBackend.find(self, element, path[i_level : ]))
+            element = element.child_window(**criteria)
+        from pywinauto.findwindows import ElementNotFoundError as PywinautoElementNotFoundError
+        try:
+            return(element.wrapper_object())
+        except PywinautoElementNotFoundError:
+            raise ElementNotFoundError(f"No element matching {path}")
+
+    def is_valid(self, element):
+        try:
+            if hasattr(element, "exists"):
+                return(element.exists(timeout = 0))
+            return(element.is_visible())
+        except Exception:
+            return(False)
+
+    def wait_window(self, app, timeout_seconds, **criteria):
+        if not all(k in SPEC_CRITERIA for k in criteria):
+            return(AutomationBackend.wait_window(self, app, timeout_seconds, **criteria))
+        window = app.window(**criteria)
+        try:
+            window.wait('visible', timeout = timeout_seconds)
+        except Exception:
+            raise ElementNotFoundError(f"No window matching {criteria} appeared within {timeout_seconds} seconds")
+        return(window)
+
+class FakeElement:
+    """In-memory UI element for FakeBackend. Implements the control methods used by the UI functions and records the actions taken on it
+
+    :param title: Window text, defaults to ""
+    :type title: str, optional
+    :param auto_id: Automation ID, defaults to None
+    :type auto_id: str, optional
+    :param control_type: Control type, defaults to None
+    :type control_type: str, optional
+    :param class_name: Class name, defaults to None
+    :type class_name: str, optional
+    :param value: Control value (e.g. text box contents), defaults to ""
+    :type value: str, optional
+    :param children: Child elements, defaults to None
+    :type children: list, optional
+    :param on_click: If provided, called with the element when it is clicked, defaults to None
+    :type on_click: function, optional
+    """
+    def __init__(self, title = "", auto_id = None, control_type = None, class_name = None, value = "", children = None, on_click = None):
+        self.title = title
+        self.auto_id = auto_id
+        self.control_type = control_type
+        self.class_name_ = class_name
+        self.value = value
+        self.toggle_state = 0
+        self.visible = True
+        self.on_click = on_click
+        self.parent = None
+        self.child_elements = []
+        self.actions = []
+        for child in children or []:
+            self.add(child)
+
+    def add(self, child):
+        child.parent = self
+        self.child_elements.append(child)
+        return(child)
+
+    def window_text(self):
+        return(self.title)
+
+    def texts(self):
+        return([self.title])
+
+    def automation_id(self):
+        return(self.auto_id)
+
+    def class_name(self):
+        return(self.class_name_)
+
+    def children(self):
+        return([x for x in self.child_elements if x.visible])
+
+    def descendants(self):
+        out_elements = []
+        for child in self.children():
+            out_elements.append(child)
+            out_elements.extend(child.descendants())
+        return(out_elements)
+
+    def is_visible(self):
+        element = self
+        while element is not None:
+            if not element.visible:
+                return(False)
+            element = element.parent
+        return(True)
+
+    def exists(self, timeout = None):
+        return(self.is_visible())
+
+    def set_focus(self):
+        self.actions.append(("set_focus", ))
+
+    def click_input(self):
+        self.actions.append(("click", ))
+        if self.on_click is not None:
+            self.on_click(self)
+
+    def set_edit_text(self, text):
+        self.actions.append(("set_edit_text", text))
+        self.value = text
+
+    def type_keys(self, keys):
+        self.actions.append(("type_keys", keys))
+        self.value += keys
+
+    def get_value(self):
+        return(self.value)
+
+    def legacy_properties(self):
+        return({"Value" : self.value})
+
+    def get_toggle_state(self):
+        return(self.toggle_state)
+
+    def toggle(self):
+        self.actions.append(("toggle", ))
+        self.toggle_state = 1 - self.toggle_state
+
+class FakeApp:
+    """In-memory application for FakeBackend
+
+    :param title: Application (main window) title
+    :type title: str
+    :param windows: Top-level windows, defaults to None
+    :type windows: list, optional
+    """
+    def __init__(self, title, windows = None):
+        self.title = title
+        self.window_elements = list(windows or [])
+
+    def windows(self):
+        return([x for x in self.window_elements if x.visible])
+
+class FakeBackend(AutomationBackend):
+    """Automation backend working on FakeApp/FakeElement trees, with a configurable cost per visited element to model the latency
+    of UI Automation tree walks. Visited elements and connections are counted in stats
+
+    :param apps: Applications to connect to, defaults to None
+    :type apps: list, optional
+    :param latency_seconds: Seconds added for every element visited during a lookup, defaults to 0
+    :type latency_seconds: float, optional
+    """
+    def __init__(self, apps = None, latency_seconds = 0):
+        self.apps = list(apps or [])
+        self.latency_seconds = latency_seconds
+        self.stats = {"connects" : 0, "visited" : 0}
+
+    def visit(self, n = 1):
+        self.stats["visited"] += n
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds * n)
+
+    def connect(self, title_re):
+        self.stats["connects"] += 1
+        for app in self.apps:
+            if any(re.match(title_re, x.title) for x in app.windows()):
+                return(app)
+        raise ElementNotFoundError(f"No application with a window matching {title_re}")
+
+    def top_window(self, app, **criteria):
+        for window in app.windows():
+            self.visit()
+            if element_matches(self.properties(window), criteria):
+                return(window)
+        raise ElementNotFoundError(f"No window matching {criteria}")
+
+    def properties(self, element):
+        return({"title" : element.title, "texts" : element.texts(), "control_type" : element.control_type,
+                "class_name" : element.class_name_, "auto_id" : element.auto_id})
+
+    def children(self, element):
+        return(element.children())
+
+    def descendants(self, element):
+        return(element.descendants())
+
+    def find_child(self, parent, criteria):
+        candidates = self.children(parent) if criteria.get("children_only") else self.descendants(parent)
+        for element in candidates:
+            self.visit()
+            if element_matches(self.properties(element), criteria):
+                return(element)
+        raise ElementNotFoundError(f"No element matching {criteria}")
+
+    def is_valid(self, element):
+        self.visit()
+        return(element.is_visible())
+
+################################################################################################
+# Cached windows
+################################################################################################
+class UIWindow:
+    """Top-level window whose controls are resolved once and cached. A cached control is checked (see AutomationBackend.is_valid)
+    when it is used again and looked up anew if it is no longer valid. Other attributes are passed through to the window handle
+
+    :param backend: Automation backend
+    :type backend: `AutomationBackend`
+    :param app: Application handle
+    :type app: object
+    :param handle: Window handle
+    :type handle: object
+    """
+    def __init__(self, backend, app, handle):
+        self.backend = backend
+        self.app = app
+        self.handle = handle
+        self.cache = {}
+        self.stats = {"hits" : 0, "misses" : 0, "stale" : 0}
+
+    def __getattr__(self, name):
+        if name == "handle":
+            raise AttributeError(name)
+        return(getattr(self.handle, name))
+
+    def element(self, *path, **criteria):
+        """Gets a control of the window, from the cache if possible. Nested controls are given as the lookup criteria of their
+        parents followed by their own, e.g. window.element({"auto_id" : "toolStrip1"}, title = "Run")
+
+        :return: Element handle
+        :rtype: object
+        """
+        path = list(path) + [criteria]
+        key = tuple(tuple(sorted(x.items())) for x in path)
+        element = self.cache.get(key)
+        if element is not None:
+            if self.backend.is_valid(element):
+                self.stats["hits"] += 1
+                return(element)
+            self.stats["stale"] += 1
+        self.stats["misses"] += 1
+        element = self.backend.find(self.handle, path)
+        self.cache[key] = element
+        return(element)
+
+    def find(self, *path, **criteria):
+        """Looks up a control of the window without the cache, e.g. for controls of transient dialogs
+
+        :return: Element handle
+        :rtype: object
+        """
+        return(self.backend.find(self.handle, list(path) + [criteria]))
+
+    def exists(self, *path, **criteria):
+        """Checks whether a control is currently shown in the window (without the cache)
+
+        :return: True if the control exists
+        :rtype: bool
+        """
+        try:
+            return(self.backend.is_valid(self.find(*path, **criteria)))
+        except ElementNotFoundError:
+            return(False)
+
+    def invalidate(self):
+        """Empties the control cache
+        """
+        self.cache = {}
+
+################################################################################################
+# Shared backend and windows
+################################################################################################
+_backend = None
+_apps = {}
+_windows = {}
+_automation_lock = threading.RLock()
+
+def configure_automation(backend):
+    """Sets the automation backend used by the UI functions and drops all cached windows
+
+    :param backend: Automation backend
+    :type backend: `AutomationBackend`
+    :return: The backend
+    :rtype: `AutomationBackend`
+    """
+    global _backend
+    with _automation_lock:
+        _backend = backend
+        _apps.clear()
+        _windows.clear()
+    return(_backend)
+
+def get_automation_backend(pywinauto_backend = 'uia'):
+    """Gets the automation backend used by the UI functions, creating a PywinautoBackend if none was configured
+
+    :param pywinauto_backend: pywinauto backend used if no backend was configured, defaults to "uia"
+    :type pywinauto_backend: str, optional
+    :return: The automation backend
+    :rtype: `AutomationBackend`
+    """
+    global _backend
+    with _automation_lock:
+        if _backend is None:
+            _backend = PywinautoBackend(backend = pywinauto_backend)
+        return(_backend)
+
+def get_window(app_title_re, **criteria):
+    """Gets a top-level window of a running application. The application connection and window are kept between calls and only
+    looked up again once the window is no longer valid
+
+    :param app_title_re: Regular expression matching the title of one of the application's windows
+    :type app_title_re: str
+    :return: The window
+    :rtype: `UIWindow`
+    """
+    backend = get_automation_backend()
+    key = (app_title_re, tuple(sorted(criteria.items())))
+    with _automation_lock:
+        window = _windows.get(key)
+        if window is not None and backend.is_valid(window.handle):
+            return(window)
+        app = _apps.get(app_title_re)
+        handle = None
+        if app is not None:
+            try:
+                handle = backend.top_window(app, **criteria)
+            except ElementNotFoundError:
+                handle = None
+        if handle is None:
+            # The application may have been restarted since it was connected to
+            app = backend.connect(app_title_re)
+            _apps[app_title_re] = app
+            handle = backend.top_window(app, **criteria)
+        window = UIWindow(backend, app, handle)
+        _windows[key] = window
+        return(window)
@@ -2,11 +2,12 @@
 # gk@reder.io
 ################################################################################################
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
-import pandas as pd
+import io
 import sys
 import os
-import xml.etree.ElementTree as ET
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from autonoms.utils_experiment import load_experiment
 ################################################################################################
 
 ################################################################################################
@@ -37,24 +38,57 @@ def create_rfmap_xml(sequences, output_file = None, plate_type="P384"):
     :return: rfmap xml string content
     :rtype: str
     """
-    rf_plate_map = ET.Element("RFPlateMap")
-    rf_plate_map.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    rf_plate_map.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
-    file_name = ET.SubElement(rf_plate_map, "FileName")
-    if output_file:
-        file_name.text = output_file
-    plate_type_element = ET.SubElement(rf_plate_map, "PlateType")
-    plate_type_element.text = plate_type
-    sequences_element = ET.SubElement(rf_plate_map, "Sequences")
-    array_of_string = ET.SubElement(sequences_element, "ArrayOfString")
-    for seq in sequences:
-        seq_element = ET.SubElement(array_of_string, "string")
-        seq_element.text = seq
+    rf_plate_map = build_rfmap(sequences, plate_type = plate_type, file_name = output_file)
     xml_string = ET.tostring(rf_plate_map, encoding="utf-8", method="xml")
     if output_file:
         write_xml(xml_string, output_file, add_header = True)
     return(xml_string)
 
+def xml_escape(text):
+    """Escapes text for use as xml element content or attribute value
+
+    :param text: Text to escape
+    :type text: str
+    :return: Escaped text
+    :rtype: str
+    """
+    return(str(text).replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;"))
+
+def write_pretty_xml(elem, f, indent = "  ", level = 0):
+    """Writes an xml element and its children to an open text file in a single pass, one element per line
+
+    :param elem: xml element to write
+    :type elem: class: `xml.etree.ElementTree.Element`
+    :param f: Open text file (or other object with a write method) to write to
+    :type f: file
+    :param indent: Indentation per nesting level, defaults to two spaces
+    :type indent: str, optional
+    :param level: Nesting level of elem, defaults to 0
+    :type level: int, optional
+    """
+    pad = indent * level
+    attrs = "".join(f' {k}="{xml_escape(v)}"' for k, v in elem.attrib.items())
+    if len(elem):
+        f.write(f"{pad}<{elem.tag}{attrs}>\n")
+        for child in elem:
+            write_pretty_xml(child, f, indent = indent, level = level + 1)
+        f.write(f"{pad}</{elem.tag}>\n")
+    elif elem.text is None or elem.text == "":
+        f.write(f"{pad}<{elem.tag}{attrs}/>\n")
+    else:
+        f.write(f"{pad}<{elem.tag}{attrs}>{xml_escape(elem.text)}</{elem.tag}>\n")
+
+def write_xml_file(elem, output_file):
+    """Writes an xml element to a pretty-printed utf-8 xml file
+
+    :param elem: xml element to write
+    :type elem: class: `xml.etree.ElementTree.Element`
+    :param output_file: Path to output file
+    :type output_file: str
+    """
+    with open(output_file, 'w', encoding = "utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        write_pretty_xml(elem, f)
 
 def prettify(elem):
     """Prepares an xml ElementTree in preparation for file writing
@@ -64,23 +98,86 @@ def prettify(elem):
     :return: Prepared xml string
     :rtype: str
     """
-    rough_string = ET.tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml = reparsed.toprettyxml(indent="  ", encoding="utf-8").decode('utf-8')
-    out_s = '\n'.join([line for line in pretty_xml.split('\n') if line.strip()])
-    return (out_s)
+    out_s = io.StringIO()
+    out_s.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    write_pretty_xml(elem, out_s)
+    return(out_s.getvalue().rstrip("\n"))
 
+def build_rfmap(wells, plate_type = "P384", file_name = None):
+    """Builds a RF .rfmap plate map xml element
 
+    :param wells: List of wells, one for each injection
+    :type wells: list
+    :param plate_type: RF plate type value to use, must be already set in RF configs (via RapidFire UI), defaults to "P384"
+    :type plate_type: str, optional
+    :param file_name: If not None, path of the .rfmap file to record in the plate map, defaults to None
+    :type file_name: str, optional
+    :return: rfmap xml element
+    :rtype: class: `xml.etree.ElementTree.Element`
+    """
+    rf_plate_map = ET.Element("RFPlateMap")
+    rf_plate_map.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
+    rf_plate_map.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
+    file_name_element = ET.SubElement(rf_plate_map, "FileName")
+    if file_name:
+        file_name_element.text = file_name
+    plate_type_element = ET.SubElement(rf_plate_map, "PlateType")
+    plate_type_element.text = plate_type
+    sequences_element = ET.SubElement(rf_plate_map, "Sequences")
+    array_of_string = ET.SubElement(sequences_element, "ArrayOfString")
+    for seq in wells:
+        seq_element = ET.SubElement(array_of_string, "string")
+        seq_element.text = seq
+    return(rf_plate_map)
 
-def create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method, column_type, sequence_name, plate_name, cal_method):
-    """Creates a RF batch .rfbat file
+def build_rfcfg(rf_params):
+    """Builds a RF .rfcfg method xml element from RF method parameters
 
-    :param rfmap_filename: Path to input RF .rfmap file
+    :param rf_params: RF method parameter rows, each a list of strings starting with the parameter name (see autonoms.utils_experiment.Experiment)
+    :type rf_params: list
+    :return: rfcfg xml element
+    :rtype: class: `xml.etree.ElementTree.Element`
+    """
+    types_d = {"CycleNames" : "string", "CycleDurations" : "int", 
+               "Pump1Composition" : "double", "Pump2Composition" : "double", 
+               "Pump3Composition" : "double" }
+    root = ET.Element("RFConfig")
+    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
+    root.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
+    bool_params = ["StandByAfterRun","UsePlateHandler","UseBcodeScanner",
+                   "MSStandbyAfterRun","Pump1Active","Pump2Active",
+                   "Pump3Active","Pump4Active"]
+    bool_d = {'0' : 'false', '1' : 'true'}
+    for row in rf_params:
+        param = row[0]
+        values = row[1 : ]
+        if param in bool_params:
+            values = [bool_d[x] for x in values]
+        if not values:
+            continue
+        if len(values) == 1:
+            elem = ET.SubElement(root, param)
+            elem.text = values[0]
+        else:
+            parent = ET.SubElement(root, param)
+            for value in values:
+                elem = ET.SubElement(parent, types_d[param])
+                elem.text = value
+    return(root)
+
+def build_rfbat(rfcfg, wells, rfmap_filename, rfcfg_filename, rfbat_filename, ms_method, column_type, sequence_name, plate_name, cal_method):
+    """Builds a RF batch .rfbat xml element
+
+    :param rfcfg: RF method xml element (see build_rfcfg), its parameters are included in the batch
+    :type rfcfg: class: `xml.etree.ElementTree.Element`
+    :param wells: List of wells, one for each injection
+    :type wells: list
+    :param rfmap_filename: Path to RF .rfmap file
     :type rfmap_filename: str
-    :param rfcfg_filename: Path to input RF method .rfcfg file
-    :type rfcfg_filename: str
-    :param rfbat_filename: Path to output RF batch .rfbat file
+    :param rfcfg_filename: Path to RF method .rfcfg file
     :type rfcfg_filename: str
+    :param rfbat_filename: Path to RF batch .rfbat file
+    :type rfbat_filename: str
     :param ms_method: Path to input Agilent .m MS acquisition method file
     :type ms_method: str
     :param column_type: Column type for RF injection (note for BLAZE mode, can be any value without effect)
@@ -91,20 +188,9 @@ def create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method,
     :type plate_name: str
     :param cal_method: Calibration method to write into the .rfbat file (will not affect anything at runtime but will be recorded in file for future use)
     :type cal_method: str
+    :return: rfbat xml element
+    :rtype: class: `xml.etree.ElementTree.Element`
     """
-    
-    rfcfg_tree = ET.parse(rfcfg_filename)
-    rfcfg_data = rfcfg_tree.getroot()
-
-    rfmap_tree = ET.parse(rfmap_filename)
-    rfmap_data = rfmap_tree.getroot()
-    sequences_element = rfmap_data.find('Sequences')
-    rfmap_injections = []
-    for string_element in sequences_element.findall('.//string'):
-        rfmap_injections.append(string_element.text)
-    mapping_file = os.path.basename(rfmap_filename)
-
-
     rfbatch = ET.Element('RFBatch')
     rfbatch.set('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
     rfbatch.set('xmlns:xsd', 'http://www.w3.org/2001/XMLSchema')
@@ -116,7 +202,7 @@ def create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method,
 
     plates = ET.SubElement(rfbatch, 'Plates')
     batch_plate = ET.SubElement(plates, 'BatchPlate')
-    ET.SubElement(batch_plate, 'MappingFile').text = mapping_file
+    ET.SubElement(batch_plate, 'MappingFile').text = os.path.basename(rfmap_filename)
 
     unique_name = ET.SubElement(batch_plate, 'uniqueName')
     unique_name.text = sequence_name
@@ -124,11 +210,11 @@ def create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method,
     sequences = ET.SubElement(batch_plate, 'Sequences')
     sequence = ET.SubElement(sequences, 'Sequence')
 
-    for well in rfmap_injections:
+    for well in wells:
         ET.SubElement(sequence, 'SEQUENCE').text = well
 
     cfgfile = ET.SubElement(sequence, 'CFGFILE')
-    cfgfile.extend(rfcfg_data)
+    cfgfile.extend(rfcfg)
     ET.SubElement(cfgfile, "FileName").text = rfcfg_filename
 
     ET.SubElement(sequence, "ColumnType").text = column_type
@@ -137,23 +223,82 @@ def create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method,
     ET.SubElement(sequence, "PlateName").text = plate_name
 
     ET.SubElement(sequence, "CalibrationMethod").text = cal_method
+    return(rfbatch)
 
+def create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method, column_type, sequence_name, plate_name, cal_method):
+    """Creates a RF batch .rfbat file
 
-    output = prettify(rfbatch)
-    with open(rfbat_filename, 'w') as output_file:
-        output_file.write(output)
+    :param rfmap_filename: Path to input RF .rfmap file
+    :type rfmap_filename: str
+    :param rfcfg_filename: Path to input RF method .rfcfg file
+    :type rfcfg_filename: str
+    :param rfbat_filename: Path to output RF batch .rfbat file
+    :type rfcfg_filename: str
+    :param ms_method: Path to input Agilent .m MS acquisition method file
+    :type ms_method: str
+    :param column_type: Column type for RF injection (note for BLAZE mode, can be any value without effect)
+    :type column_type: str
+    :param sequence_name: Name of experimental sequence
+    :type sequence_name: str
+    :param plate_name: Name of plate to use
+    :type plate_name: str
+    :param cal_method: Calibration method to write into the .rfbat file (will not affect anything at runtime but will be recorded in file for future use)
+    :type cal_method: str
+    """
+    rfcfg_data = ET.parse(rfcfg_filename).getroot()
+    rfmap_data = ET.parse(rfmap_filename).getroot()
+    rfmap_injections = [x.text for x in rfmap_data.find('Sequences').findall('.//string')]
+    rfbatch = build_rfbat(rfcfg_data, rfmap_injections, rfmap_filename, rfcfg_filename, rfbat_filename, ms_method, column_type, sequence_name, plate_name, cal_method)
+    write_xml_file(rfbatch, rfbat_filename)
+
+def pack_rfbat_files(rfbat_files, out_rfbat):
+    """Packs the plates of several .rfbat files into a single multi-plate .rfbat file so the RapidFire runs them back-to-back in one batch.
+    Each plate keeps its own plate map, method parameters, MS method, and barcode (uniqueName) and plates are numbered in the given order. 
+    The plate map files are copied next to the output .rfbat file
+
+    :param rfbat_files: Paths to input .rfbat files, in the desired plate order
+    :type rfbat_files: list
+    :param out_rfbat: Path to output multi-plate .rfbat file
+    :type out_rfbat: str
+    :return: Path to output .rfbat file
+    :rtype: str
+    """
+    out_dir = os.path.dirname(os.path.abspath(out_rfbat))
+    os.makedirs(out_dir, exist_ok = True)
+    rfbatch = None
+    n_plates = 0
+    for rfbat_file in rfbat_files:
+        root = ET.parse(rfbat_file).getroot()
+        batch_plates = root.findall("Plates/BatchPlate")
+        if rfbatch is None:
+            rfbatch = root
+            # Namespace declarations are dropped when parsing
+            rfbatch.set('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
+            rfbatch.set('xmlns:xsd', 'http://www.w3.org/2001/XMLSchema')
+            rfbatch.find("FileName").text = out_rfbat
+            plates = rfbatch.find("Plates")
+            for batch_plate in batch_plates:
+                plates.remove(batch_plate)
+        for batch_plate in batch_plates:
+            n_plates += 1
+            for plate_num in batch_plate.iterfind("Sequences/Sequence/PlateNum"):
+                plate_num.text = str(n_plates)
+            shutil.copy2(os.path.join(os.path.dirname(rfbat_file), batch_plate.find("MappingFile").text), out_dir)
+            plates.append(batch_plate)
+    write_xml_file(rfbatch, out_rfbat)
+    return(out_rfbat)
 
 def get_set_val(g, key):
     """Helper method for getting a dictionary value at key while checking all values in g[key] are the same
 
-    :param g: Input dictionary
-    :type g: dict
+    :param g: Input dictionary, DataFrame, or list of injections (see autonoms.utils_experiment.Injection)
+    :type g: dict or list
     :param key: Key value
     :type key: str
     :return:
     :rtype: object
     """
-    s = set(g[f'{key}'].values)
+    s = set([x[f'{key}'] for x in g] if isinstance(g, list) else g[f'{key}'].values)
     if len(s) != 1:
         sys.exit(f"Error - all values should be identical for key {key}, but got value set = {s}")
     return(s.pop())
@@ -161,62 +306,38 @@ def get_set_val(g, key):
 def create_rfcfg_file(in_xlsx, out_rfcfg, sheet_name = "rf_params"):
     """Creates a RF .rfcfg file from an input experiment definition file
 
-    :param in_xlsx: Path to input experiment definition file
-    :type in_xlsx: str
+    :param in_xlsx: Experiment definition or path to input experiment definition file
+    :type in_xlsx: `autonoms.utils_experiment.Experiment` or str
     :param out_rfcfg: Path to output RF method .rfcfg file
     :type out_rfcfg: str
     :param sheet_name: Sheet name in in_xlsx corresponding to the RF method params, defaults to "rf_params"
     :type sheet_name: str, optional
     """
-    types_d = {"CycleNames" : "string", "CycleDurations" : "int", 
-               "Pump1Composition" : "double", "Pump2Composition" : "double", 
-               "Pump3Composition" : "double" }
-    df = pd.read_excel(in_xlsx, sheet_name = sheet_name)
-    # Create the XML structure
-    root = ET.Element("RFConfig")
-    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    root.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
-    bool_params = ["StandByAfterRun","UsePlateHandler","UseBcodeScanner",
-                   "MSStandbyAfterRun","Pump1Active","Pump2Active",
-                   "Pump3Active","Pump4Active"]
-    bool_d = {'0' : 'false', '1' : 'true'}
-    for i, row in df.iterrows():
-        row = [x for x in row.values.astype(str) if x != 'nan']
-        param = row[0]
-        values = row[1 : ]
-        if param in bool_params:
-            values = [bool_d[x] for x in values]
-        if not values:
-            continue
-        if len(values) == 1:
-            elem = ET.SubElement(root, param)
-            elem.text = values[0]
-        else:
-            parent = ET.SubElement(root, param)
-            for value in values:
-                # elem = ET.SubElement(parent, "double" if "." in value else "int")
-                elem = ET.SubElement(parent, types_d[param])
-                elem.text = value
-    # Generate the XML string
-    xml_string = ET.tostring(root, encoding="utf-8", method="xml").decode("utf-8")
-    xml_string = '<?xml version="1.0" encoding="utf-8"?>\n' + xml_string
-
-    with open(out_rfcfg, 'w') as f:
-        print(prettify(root), file = f)
+    experiment = load_experiment(in_xlsx, rf_sheet = sheet_name)
+    write_xml_file(build_rfcfg(experiment.rf_params), out_rfcfg)
 
 def get_cal_method_xlsx(in_xlsx, sequence_name, sample_sheet = "samples"):
     """Gets the MS method name to use as the calibration method name from input experiment definition file
 
-    :param in_xlsx: Path to input experiment definition file
-    :type in_xlsx: str
+    :param in_xlsx: Experiment definition or path to input experiment definition file
+    :type in_xlsx: `autonoms.utils_experiment.Experiment` or str
     :param sequence_name: Name of sequence in experiment definition file to check
     :type sequence_name: str
     :param sample_sheet: Sample sheet name to check in experiment definition file, default "samples"
     :type sample_sheet: str, optional
     """
-    df = pd.read_excel(in_xlsx, sheet_name = sample_sheet)
-    df = df[df['Sequence'] == sequence_name]
-    ms_method = get_set_val(df, "6560_Method")
+    experiment = load_experiment(in_xlsx, sample_sheet = sample_sheet)
+    ms_method = get_set_val(experiment.sequence_injections(sequence_name), "6560_Method")
+    return(cal_method_name(ms_method))
+
+def cal_method_name(ms_method):
+    """Gets the calibration method name corresponding to an MS method
+
+    :param ms_method: Path to Agilent .m MS acquisition method file
+    :type ms_method: str
+    :return: Path to calibration .m method file
+    :rtype: str
+    """
     ms_mfile = os.path.basename(ms_method)
     cal_mfile = ms_mfile.replace('.m', '_calB.m')
     cal_method = os.path.join(os.path.dirname(ms_method), cal_mfile)
@@ -260,35 +381,61 @@ def get_rfcfg_file_rfbat(rfbat_file):
     sys.exit(f"Error - could not find a rfcfg file in {rfbat_file}")
 
 
-def create_sequences(in_xlsx, out_dir, sample_sheet = "samples", rf_sheet = "rf_params"):
-    """Takes input experiment definition file, creates RF instrument files and output directories
+def write_sequence_files(rfcfg, sequence_name, injections, out_dir):
+    """Writes the RF instrument files (.rfcfg, .rfmap, and .rfbat) of a single sequence
 
-    :param in_xlsx: Path to input experiment definition file
-    :type in_xlsx: str
+    :param rfcfg: RF method xml element shared by all sequences (see build_rfcfg)
+    :type rfcfg: class: `xml.etree.ElementTree.Element`
+    :param sequence_name: Name of experimental sequence
+    :type sequence_name: str
+    :param injections: Injections of the sequence (see autonoms.utils_experiment.Injection)
+    :type injections: list
+    :param out_dir: Directory to write the instrument files to
+    :type out_dir: str
+    :return: Tuple of sequence name and paths to the .rfbat, .rfmap, and .rfcfg files
+    :rtype: tuple
+    """
+    rfcfg_filename = os.path.join(out_dir, f"{sequence_name}.rfcfg")
+    rfmap_filename = os.path.join(out_dir, f"{sequence_name}.rfmap")
+    rfbat_filename = os.path.join(out_dir, f"{sequence_name}.rfbat")
+    wells = [x.well for x in injections]
+    plate_type = get_set_val(injections, "Plate_Type")
+    ms_method = get_set_val(injections, "6560_Method")
+    column_type = get_set_val(injections, "Column_Type")
+    write_xml_file(rfcfg, rfcfg_filename)
+    create_rfmap_xml(wells, output_file = rfmap_filename, plate_type = plate_type)
+    rfbatch = build_rfbat(rfcfg, wells, rfmap_filename, rfcfg_filename, rfbat_filename, ms_method, column_type, sequence_name, sequence_name, cal_method_name(ms_method))
+    write_xml_file(rfbatch, rfbat_filename)
+    print(rfbat_filename)
+    return((sequence_name, rfbat_filename, rfmap_filename, rfcfg_filename))
+
+def create_sequences(in_xlsx, out_dir, sample_sheet = "samples", rf_sheet = "rf_params", sequence_subdirs = False, max_workers = 1):
+    """Takes input experiment definition file, creates RF instrument files and output directories. The RF method is built once
+    and shared by all sequences, and every instrument file is written directly from memory
+
+    :param in_xlsx: Experiment definition or path to input experiment definition file
+    :type in_xlsx: `autonoms.utils_experiment.Experiment` or str
     :param out_dir: Path to experiment output directory
     :type out_dir: str
     :param sample_sheet: Name of sheet in experiment definition xlsx file containing sequences/injections, defaults to "samples"
     :type sample_sheet: str, optional
     :param rf_sheet: Name of sheet in experiment definition xlsx file containing RF method parameters, defaults to "rf_params"
     :type rf_sheet: str, optional
+    :param sequence_subdirs: Write the instrument files of each sequence into its own out_dir/<sequence name> directory, defaults to False
+    :type sequence_subdirs: bool, optional
+    :param max_workers: Number of sequences to write in parallel, defaults to 1
+    :type max_workers: int, optional
+    :return: List of tuples of sequence name and paths to the .rfbat, .rfmap, and .rfcfg files, one for each sequence
+    :rtype: list
     """
-    df = pd.read_excel(in_xlsx, sheet_name = sample_sheet)
+    experiment = load_experiment(in_xlsx, sample_sheet = sample_sheet, rf_sheet = rf_sheet)
     os.makedirs(f"{out_dir}", exist_ok = True)
-    sequence_files = []
-    for sequence_name, g in df.groupby("Sequence", sort = False):
-        rfcfg_filename = os.path.join(out_dir, f"{sequence_name}.rfcfg")
-        create_rfcfg_file(in_xlsx, rfcfg_filename, sheet_name = rf_sheet)
-        sequences = g['Well'].values
-        rfmap_filename = os.path.join(out_dir, f"{sequence_name}.rfmap")
-        plate_type = get_set_val(g, "Plate_Type")
-        _ = create_rfmap_xml(sequences, plate_type= plate_type, output_file = rfmap_filename)
-        ms_method = get_set_val(g, "6560_Method")
-        cal_method = get_cal_method_xlsx(in_xlsx, sequence_name, sample_sheet = sample_sheet)
-        column_type = get_set_val(g, "Column_Type")
-        rfbat_filename = os.path.join(out_dir, f"{sequence_name}.rfbat")
-        plate_name = sequence_name
-        create_rfbat_file(rfmap_filename, rfcfg_filename, rfbat_filename, ms_method, column_type, sequence_name, plate_name, cal_method)
-        print(rfbat_filename)
-        sequence_files.append((sequence_name, rfbat_filename, rfmap_filename, rfcfg_filename))
+    rfcfg = build_rfcfg(experiment.rf_params)
+    def write_sequence(item):
+        sequence_name, injections = item
+        sequence_dir = os.path.join(out_dir, sequence_name) if sequence_subdirs else out_dir
+        os.makedirs(sequence_dir, exist_ok = True)
+        return(write_sequence_files(rfcfg, sequence_name, injections, sequence_dir))
+    with ThreadPoolExecutor(max_workers = max(int(max_workers), 1)) as executor:
+        sequence_files = list(executor.map(write_sequence, experiment.sequences().items()))
     return(sequence_files)
-        
\ No newline at end of file
@@ -4,78 +4,94 @@
 import sys
 import os
 import time
-if sys.platform.startswith('win'):
-    # Import only if running on Windows
-    from pywinauto import Application
-    from pywinauto import Desktop
-    from pywinauto.controls.uia_controls import UIAElementInfo
 import re
-import shutil
-from pathlib import Path
+import threading
+import xml.etree.ElementTree as ET
 import datetime
+from collections import namedtuple
+from autonoms.agilent_methods.rf_run_index import get_run_index
+from autonoms.agilent_methods.splitterExtract import read_rfdb_sequences, correct_injection_offset
+from autonoms.agilent_methods.utils_automation import get_window, UIWindow, ElementNotFoundError
+from autonoms.utils_wait import wait_until, wait_or_exit, WaitTimeoutError
+from autonoms.utils_transfer import get_transfer_engine
 ################################################################################################
 # Functions for individual actions in the RapidFire UI
 ################################################################################################
+# Title of the RapidFire UI main window, used to connect to the application
+RF_APP_TITLE_RE = ".*RapidFire : .*"
+
+def find_window(**criteria):
+    """Looks up a window of the RapidFire UI application (see autonoms.agilent_methods.utils_automation.get_window) 
+
+    :return: The window, None if there is no matching window
+    :rtype: `autonoms.agilent_methods.utils_automation.UIWindow`
+    """
+    try:
+        return(get_window(RF_APP_TITLE_RE, **criteria))
+    except ElementNotFoundError:
+        return(None)
+
 def initialize_app(search_str = "RapidFire :"):
-    """Finds the (open) RapidFire UI application and returns its handles
+    """Finds the (open) RapidFire UI application and returns its handles. The connection and window are kept between calls 
+    (see autonoms.agilent_methods.utils_automation), so repeated calls do not reconnect to the application
 
     :param search_str: Identifying application text to search for, defaults to "RapidFire :"
     :type search_str: str, optional
-    :return: Respectively the pywinauto application and pywinauto window corresponding to RapidFire UI
+    :return: Respectively the application and the window (`autonoms.agilent_methods.utils_automation.UIWindow`) corresponding to RapidFire UI
     :rtype: tuple
     """
-    app = Application(backend = 'uia').connect(title_re = f".*RapidFire : .*")
-    window = app.window(title_re = f".*{search_str}.*")
-    if not window:
+    try:
+        window = get_window(RF_APP_TITLE_RE, title_re = f".*{search_str}.*")
+    except ElementNotFoundError:
         sys.exit("error - couldnt find RapidFire ui window")
-    return(app, window)
+    return(window.app, window)
 
 def load_rf_method(window, rfcfg_file):
     """Loads a RF method (.rfcfg)
 
-    :param window: pywinauto window corresponding to the RapidFire UI
-    :type window: `pywinauto.application.Application`
+    :param window: Window corresponding to the RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     """
     # e.g. rfcfg_file = M:\\Projects\\Default\\Data\\Rapidfire\\methods\\BLAZE_B-C_5000_125.rfcfg
-    file_menu_item = window.child_window(title ="File", control_type = "MenuItem")
+    file_menu_item = window.element(title = "File", control_type = "MenuItem")
     # file_menu_item.set_focus()
     file_menu_item.click_input()
 
-    load_rf_method = window.child_window(title = "Load RF Method", control_type = "MenuItem")
+    load_rf_method = window.element(title = "Load RF Method", control_type = "MenuItem")
     # load_rf_method.set_focus()
     load_rf_method.click_input()
 
-    file_name_input = window.child_window(title_re = f".*File name:", class_name = "Edit")
+    file_name_input = window.element(title_re = f".*File name:", class_name = "Edit")
     # file_name_input.set_focus()
     file_name_input.set_edit_text("")
     file_name_input.type_keys(f"{rfcfg_file}")
-    open_button = window.child_window(title = "Open", class_name = "Button")
+    open_button = window.element(title = "Open", class_name = "Button")
     # open_button.set_focus()
     open_button.click_input()
 
 def load_rf_batch(window, rfbat_file):
     """Loads a RF Batch (.rfbat)
 
-    :param window: pywinauto window corresponding to the RapidFire UI
-    :type window: `pywinauto.application.Application`
+    :param window: Window corresponding to the RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param rfbat_file: Path to .rfbat file (on RapidFire drive)
     :type rfbat_file: str
     """
     # e.g. rfbat_file = '''M:\\Projects\\Default\\Data\\Rapidfire\\batches\\RapidFireMaintenance.rfbat'''
-    file_menu_item = window.child_window(title ="File", control_type = "MenuItem")
+    file_menu_item = window.element(title = "File", control_type = "MenuItem")
     # file_menu_item.set_focus()
     file_menu_item.click_input()
 
 
-    load_rf_batch = [x for x in file_menu_item.descendants() if "Load RF Batch" in x.window_text()][0]
+    load_rf_batch = window.element({"title" : "File", "control_type" : "MenuItem"}, text_contains = "Load RF Batch")
     # load_rf_batch.set_focus()
     load_rf_batch.click_input()
 
-    file_name_input = window.child_window(title_re = f".*File name:", class_name = "Edit")
+    file_name_input = window.element(title_re = f".*File name:", class_name = "Edit")
     # file_name_input.set_focus()
     file_name_input.set_edit_text("")
     file_name_input.type_keys(f"{rfbat_file}")
-    open_button = window.child_window(title = "Open", class_name = "Button")
+    open_button = window.element(title = "Open", class_name = "Button")
     # open_button.set_focus()
     open_button.click_input()
 
@@ -83,12 +99,12 @@ def load_rf_batch(window, rfbat_file):
 def check_vac_pressure(window, level_check = -50):
     """Ensures the RF pump vacuum pressure is below a certain threshold level (meaning that the pump is on and functioning)
 
-    :param window: pywinauto window corresponding to the RapidFire UI
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to the RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param level_check: Pressure level (in kPa) above which error gets thrown (-60 kPa or below means pump is in good condition), defaults to -50
     :type level_check: float, optional
     """
-    vac_text = window.child_window(auto_id = "vacTxt")
+    vac_text = window.element(auto_id = "vacTxt")
     vac_pressure = float(vac_text.get_value())
     if vac_pressure > level_check:
         sys.exit(f'Vacuum pressure is {vac_pressure}, is the vacuum on?')
@@ -97,84 +113,149 @@ def check_vac_pressure(window, level_check = -50):
 def open_log_view(window, app):
     """Opens the RapidFire System Log window
 
-    :param window: pywinauto window corresponding to RapidFire UI
-    :type window: `pywinauto.application.WindowSpecification`
-    :param app: pywinauto application corresponding to RapidFire UI
-    :type app: `pywinauto.application.Application`
-    :return: The pywinauto window object corresponding to the RF log window
-    :rtype: `pywinauto.Application.WindowSpecification`
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param app: Application handle corresponding to RapidFire UI
+    :type app: object
+    :return: The window corresponding to the RF log window, None if it did not appear
+    :rtype: `autonoms.agilent_methods.utils_automation.UIWindow`
     """
-    system_tools_menu = window.child_window(title = "System Tools", control_type = "MenuItem")
+    system_tools_menu = window.element(title = "System Tools", control_type = "MenuItem")
     # system_tools_menu.set_focus()
     system_tools_menu.click_input()
-    view_log_button = [x for x in system_tools_menu.descendants() if "View Log" in x.window_text()][0]
+    view_log_button = window.element({"title" : "System Tools", "control_type" : "MenuItem"}, text_contains = "View Log")
     # view_log_button.set_focus()
     view_log_button.click_input()
-    time.sleep(1)
-    log_window = app.window(title_re = f".*RapidFire Log.*")
+    try:
+        log_window = wait_until(lambda : find_window(title_re = f".*RapidFire Log.*"), 10, description = "RapidFire log window")
+    except WaitTimeoutError:
+        print("Warning - the RapidFire Log window did not appear")
+        log_window = None
     return(log_window)
 
 def set_run_mode(window, mode):
     """Sets the RF run mode (between plates and sequences)
 
-    :param window: pywinauto window corresponding to RapidFire UI
-    :type window: `pywinauto.Application.WindowSpecification`
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :mode: Desired run mode
     :type mode: str
     """
     mode_d = {'Sequences' : "admeModeBtn", "Plates" : "htsModeBtn"}
     if mode not in mode_d.keys():
         sys.exit(f"error - mode {mode} not found in available modes")
-    radio = window.child_window(auto_id = mode_d[mode])
+    radio = window.element(auto_id = mode_d[mode])
     # radio.set_focus()
     radio.click_input()
 
 def press_start_button(window):
     """Presses the start (run) button
 
-    :param window: pywinauto window corresponding to RapidFire UI
-    :type window: `pywinauto.Application.WindowSpecification`
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     """
-    run_button = window.child_window(auto_id = "runBtn")
+    run_button = window.element(auto_id = "runBtn")
     # run_button.set_focus()
     run_button.click_input()
 
 def start_run(window, app, plate_timeout = 180):
     """Sets the RF run mode (between plates and sequences)
        
-    :param window: pywinauto window corresponding to RapidFire UI
-    :type window: `pywinauto.application.WindowSpecification`
-    :param app: pywinauto application corresponding to RapidFire UI
-    :type app: `pywinauto.application.Application`
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param app: Application handle corresponding to RapidFire UI
+    :type app: object
     :param plate_timeout: Seconds to wait for plate run window to appear before erroring, defaults to 180
     :type plate_timeout: float, optional
     """
     check_vac_pressure(window)
     press_start_button(window)
-    plate_window = app.window(auto_id = "NewPlatePrompt")
     try:
         # Wait for the plate selection window to become visible
-        plate_window.wait('visible', timeout = plate_timeout)  
-    except TimeoutError:
-        sys.exit(f"Error - The plate run window did not appear within {timeout} seconds.")
+        plate_window = UIWindow(window.backend, app, window.backend.wait_window(app, plate_timeout, auto_id = "NewPlatePrompt"))
+    except ElementNotFoundError:
+        sys.exit(f"Error - The plate run window did not appear within {plate_timeout} seconds.")
+    play_plate(window, app, plate_window)
+
+def play_plate(window, app, plate_window, close_timeout = 60):
+    """Confirms a plate run window and waits for it to close
+
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param app: Application handle corresponding to RapidFire UI
+    :type app: object
+    :param plate_window: Plate run (NewPlatePrompt) window
+    :type plate_window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param close_timeout: Seconds to wait for the plate run window to close, defaults to 60
+    :type close_timeout: float, optional
+    """
     # plate_window.set_focus()
-    play_button = plate_window.child_window(auto_id = "playBtn")
+    play_button = plate_window.find(auto_id = "playBtn")
     # play_button.set_focus()
     play_button.click_input()
+    def prompt_closed():
+        try:
+            window.backend.top_window(app, auto_id = "NewPlatePrompt")
+        except ElementNotFoundError:
+            return(True)
+        return(False)
+    wait_or_exit(prompt_closed, close_timeout, description = "RapidFire plate run window to close")
+
+def count_rfbat_plates(rfbat_file):
+    """Counts the plates of a RF batch .rfbat file
+
+    :param rfbat_file: Path to .rfbat file
+    :type rfbat_file: str
+    :return: Number of plates in the batch
+    :rtype: int
+    """
+    plates = ET.parse(rfbat_file).getroot().find("Plates")
+    if plates is None or len(plates) == 0:
+        sys.exit(f"Error - couldnt find any plates in the batch file {rfbat_file}")
+    return(len(plates))
+
+def answer_plate_prompts(window, app, n_prompts, stop_event, poll_seconds = 5):
+    """Confirms the plate run windows the RapidFire shows before each further plate of a multi-plate batch (start_run confirms the first one). 
+    Meant to run in a background thread while the batch is monitored
+
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param app: Application handle corresponding to RapidFire UI
+    :type app: object
+    :param n_prompts: Number of plate run windows to confirm (the number of plates in the batch minus one)
+    :type n_prompts: int
+    :param stop_event: Stop waiting for plate run windows once this event is set (e.g. when the batch closed)
+    :type stop_event: `threading.Event`
+    :param poll_seconds: Seconds to wait for a plate run window before checking stop_event, defaults to 5
+    :type poll_seconds: float, optional
+    :return: Number of confirmed plate run windows
+    :rtype: int
+    """
+    n_answered = 0
+    while n_answered < n_prompts and not stop_event.is_set():
+        try:
+            plate_window = UIWindow(window.backend, app, window.backend.wait_window(app, poll_seconds, auto_id = "NewPlatePrompt"))
+        except ElementNotFoundError:
+            continue
+        play_plate(window, app, plate_window)
+        n_answered += 1
+        print(f"Started plate {n_answered + 1} of {n_prompts + 1} of the batch")
+    return(n_answered)
 
 
 def stop_run(window):
     """Stops a run 
 
-    :param window: pywinauto window corresponding to RapidFire UI
-    :type window: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
     """
     # Press the stop run botton and confirm run abortion
-    stop_button = window.child_window(auto_id = "stopBtn")
+    stop_button = window.element(auto_id = "stopBtn")
     # stop_button.set_focus()
     stop_button.click_input()
-    time.sleep(1)
-    yes_button = window.child_window(auto_id = "button1")
+    # The confirmation dialog is only shown once, so its button is not cached
+    wait_or_exit(lambda : window.exists(auto_id = "button1"), 10, description = "RapidFire stop run confirmation")
+    yes_button = window.find(auto_id = "button1")
     # yes_button.set_focus()
     yes_button.click_input()
 
@@ -196,7 +277,8 @@ def get_rf_output_dir(rf_cfg_file):
     return(sd)
 
 def find_latest_dir(base_path, sequence_name = None, start_year = 2021, path_convert = None):
-    """Gets the latest directory in the RapidFire data file tree
+    """Gets the latest directory in the RapidFire data file tree. Run directories are looked up in a persistent index of the 
+    file tree (see autonoms.agilent_methods.rf_run_index) which only re-scans directories that changed since the last lookup
 
     :param base_path: Path to base RapidFire data directory
     :type base_bath: str
@@ -212,53 +294,10 @@ def find_latest_dir(base_path, sequence_name = None, start_year = 2021, path_con
     if path_convert:
         for old_s, new_s in path_convert.items():
             base_path = base_path.replace(old_s, new_s)
-
-    base_path = Path(base_path)
-    latest_dir = None
-    latest_date = None
-
-    months = ['January', 'February', 'March', 'April', 'May', 'June', 
-              'July', 'August', 'September', 'October', 'November', 'December']
-
-
-    for year in range(start_year, datetime.datetime.now().year+1):  # Adjust the range as needed
-        for month in range(0, 12):  # All possible months
-            for day in range(1, 32):  # All possible days
-                try:
-                    dir_path = base_path / str(year) / months[month] / str(day)
-                    if dir_path.exists() and dir_path.is_dir():
-                        dir_date = datetime.datetime(year, month, day)
-                        # Get a list of all directories in the date_path
-                        dir_list = [os.path.join(dir_path, d) for d in os.listdir(dir_path) if os.path.isdir(os.path.join(dir_path, d))]
-                        
-                        # Sort the directories by creation time
-                        dir_list.sort(key=lambda d: os.path.getmtime(d), reverse=True)
-                        if sequence_name:
-                            dir_list_temp = []
-                            for dir_temp in dir_list:
-                                # print(dir_temp)
-                                rfdb_file = os.path.join(dir_temp, "RFDatabase.xml")
-                                if not os.path.exists(rfdb_file):
-                                    continue
-                                with open(rfdb_file, 'r') as f:
-                                    lines = f.read()
-                                if f"Barcode>{sequence_name}<" in lines:
-                                    dir_list_temp.append(dir_temp)
-                            dir_list = dir_list_temp
-                        if len(dir_list) > 0:
-                            dir_newest = dir_list[0]
-                            mtime = os.path.getmtime(dir_newest)
-                            dir_modified = mtime
-                            if latest_date is None or dir_modified > latest_date:
-                                latest_dir = dir_newest
-                                latest_date = mtime
-                except ValueError:
-                    # Ignore invalid dates, like February 30
-                    pass
-    return latest_dir
+    return(get_run_index(base_path, start_year = start_year).find_latest(sequence_name = sequence_name))
 
 def copy_last_run_output(out_dir, rf_cfg_file, overwrite = True):
-    """Copies the newest RF run data to a new directory
+    """Copies the newest RF run data to a new directory with the shared transfer engine (see autonoms.utils_transfer.TransferEngine)
 
     :param out_dir: Path to output directory
     :type out_dir: str
@@ -272,51 +311,49 @@ def copy_last_run_output(out_dir, rf_cfg_file, overwrite = True):
 
     if os.path.exists(out_dir):
         if overwrite:
-            print(f"{out_dir} exists, removing to overwrite")
+            print(f"{out_dir} exists, it will be replaced")
             os.chmod(out_dir, 0o777)
-            shutil.rmtree(out_dir)
         else:
             sys.exit(f'{out_dir} exists, please set overwrite = True to overwrite')
     print(rf_sequence_data_dir)
     print(out_dir)
     # os.chmod(rf_data_dir, 0o777)
-    shutil.copytree(rf_sequence_data_dir, out_dir)
+    get_transfer_engine().transfer(rf_sequence_data_dir, out_dir, overwrite = overwrite)
 
 
 def open_splitter_view(window, app):
     """Opens the file splitter dialogue in the RF UI
 
-    :param window: pywinauto window corresponding to RapidFire UI
-    :type window: `pywinauto.application.WindowSpecification`
-    :param app: pywinauto application corresponding to RapidFire UI
-    :type app: `pywinauto.application.Application`
-    :return: pywinauto window corresponding to the file splitter dialogue
-    :rtype: `pywinauto.application.WindowSpecification`
+    :param window: Window corresponding to RapidFire UI
+    :type window: `autonoms.agilent_methods.utils_automation.UIWindow`
+    :param app: Application handle corresponding to RapidFire UI
+    :type app: object
+    :return: Window corresponding to the file splitter dialogue
+    :rtype: `autonoms.agilent_methods.utils_automation.UIWindow`
     """
-    file_menu_item = window.child_window(title = "File", control_type = "MenuItem")
+    file_menu_item = window.element(title = "File", control_type = "MenuItem")
     # file_menu_item.set_focus()
     file_menu_item.click_input()
 
-    open_splitter_button = [x for x in file_menu_item.descendants() if "Convert MS Data" in x.window_text()][0]
+    open_splitter_button = window.element({"title" : "File", "control_type" : "MenuItem"}, text_contains = "Convert MS Data")
     # open_splitter_button.set_focus()
     open_splitter_button.click_input()
-    time.sleep(1)
 
-    splitter_window = [x for x in app.windows() if "Convert MS Data" in x.texts()][0]
+    splitter_window = wait_or_exit(lambda : find_window(text = "Convert MS Data"), 10, description = "RapidFire file splitter window")
     return(splitter_window)
 
 def set_splitter_autoconvert(splitter_window, state):
     """Sets the file splitter dialogue state for the auto conversion option
 
-    :param splitter_window: pywinauto window corresponding to the file splitter dialogue
-    :type splitter_window: `pywinauto.application.WindowSpecification`
+    :param splitter_window: Window corresponding to the file splitter dialogue
+    :type splitter_window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param state: desired auto conversion setting
     :type state: bool
     """
     if state not in [True, False]:
         sys.exit(f"Error unrecognized auto split state {state}")
     state = int(state)
-    autoconvert_button = [x for x in splitter_window.children() if x.automation_id() == "autoConvertCheckBox"][0]
+    autoconvert_button = splitter_window.element(auto_id = "autoConvertCheckBox", children_only = True)
     if autoconvert_button.get_toggle_state() != state:
         autoconvert_button.toggle()
     return(0)
@@ -325,34 +362,339 @@ def set_splitter_autoconvert(splitter_window, state):
 def run_split(splitter_window, split_dir, multiple_injections = True):
     """Runs file splitting through the file splitter dialogue
 
-    :param splitter_window: pywinauto window corresponding to the file splitter dialogue
-    :type splitter_window: `pywinauto.application.WindowSpecification`
+    :param splitter_window: Window corresponding to the file splitter dialogue
+    :type splitter_window: `autonoms.agilent_methods.utils_automation.UIWindow`
     :param split_dir: Path to directory containing RF sequence output to split. Output split files will be placed here as well
     :type split_dir: str
     :param multiple_injections: Run multiple splits at once in parallel, defaults to True
     :type multiple_injections: bool, optional
     """
 
-    data_path_box = [x for x in splitter_window.children() if x.automation_id() == "dataPathTextBox"][0]
+    data_path_box = splitter_window.element(auto_id = "dataPathTextBox", children_only = True)
     # data_path_box.set_focus()
     data_path_box.set_edit_text("")
     data_path_box.type_keys(f"{split_dir}")
 
-    output_path_box = [x for x in splitter_window.children() if x.automation_id() == "exportPathTextBox"][0]
+    output_path_box = splitter_window.element(auto_id = "exportPathTextBox", children_only = True)
     # output_path_box.set_focus()
     output_path_box.set_edit_text("")
     output_path_box.type_keys(f"{split_dir}")
 
     if multiple_injections:
-        multiple_inj_button = [x for x in splitter_window.children() if "multipleInj" in x.automation_id()][0]
+        multiple_inj_button = splitter_window.element(auto_id_contains = "multipleInj", children_only = True)
         if multiple_inj_button.get_toggle_state() == 0:
             multiple_inj_button.toggle()
 
-    convert_button = [x for x in splitter_window.children() if x.automation_id() == "exportButton"][0]
+    convert_button = splitter_window.element(auto_id = "exportButton", children_only = True)
     # convert_button.set_focus()
     convert_button.click_input()
     return(0)
 
+################################################################################################
+# Run monitoring
+################################################################################################
+# batch.log lines start with a timestamp followed by the log message
+BATCH_LOG_LINE_PATTERN = re.compile(r"^\s*(?P<timestamp>\d{1,4}[/-]\d{1,2}[/-]\d{1,4}[ T]\d{1,2}:\d{2}:\d{2}(?:\.\d+)?(?:\s*[AP]M)?)\s*[-:,|]?\s*(?P<message>.*)$", re.IGNORECASE)
+BATCH_LOG_TIME_FORMATS = ["%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y %I:%M:%S.%f %p", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S.%f", 
+                          "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f"]
+# An injection message names the injected well, e.g. "Injecting well B12"
+BATCH_LOG_INJECTION_PATTERN = re.compile(r"\binject\w*\W+(?:(?:from|well|sample)\W+)*(?P<well>[A-Z]{1,2}\d{1,2})\b", re.IGNORECASE)
+BATCH_LOG_CLOSED_TEXT = "batch.log closed"
+BATCH_LOG_ERROR_PATTERN = re.compile(r"\b(?:error|exception|fail(?:ed|ure)?|abort(?:ed)?)\b", re.IGNORECASE)
+# Structured batch.log event (see LogFollower)
+BatchLogEvent = namedtuple("BatchLogEvent", ["kind", "timestamp", "minutes", "well", "start_minutes", "message"])
+
+def parse_batch_log_line(line):
+    """Splits a RapidFire batch.log line into its timestamp and message
+
+    :param line: Line from batch.log
+    :type line: str
+    :return: Tuple of (timestamp, message) where timestamp is None if the line has no recognizable timestamp
+    :rtype: tuple
+    """
+    m = BATCH_LOG_LINE_PATTERN.match(line)
+    if not m:
+        return((None, line.strip()))
+    timestamp_s = " ".join(m.group("timestamp").split())
+    for time_format in BATCH_LOG_TIME_FORMATS:
+        try:
+            return((datetime.datetime.strptime(timestamp_s, time_format), m.group("message").strip()))
+        except ValueError:
+            pass
+    return((None, line.strip()))
+
+class LogFollower:
+    """Incrementally follows a RapidFire batch.log, either while it is being written or after the run has finished (e.g. a local copy). 
+    The file offset is kept between reads so every byte is only read once, and new lines are parsed into BatchLogEvent events:
+
+    - injection_started: the injection of well started at minutes
+    - injection_finished: the injection of well, started at start_minutes, finished at minutes (when the next injection started or the batch closed)
+    - error: an error was logged
+    - batch_closed: the batch finished, no events follow
+
+    Times are in minutes relative to the first timestamped line
+
+    :param log_file: Path to batch.log file
+    :type log_file: str
+    :param stop_text: Text marking the last line of the log, defaults to "batch.log closed"
+    :type stop_text: str, optional
+    """
+    def __init__(self, log_file, stop_text = BATCH_LOG_CLOSED_TEXT):
+        self.log_file = log_file
+        self.stop_text = stop_text
+        self.offset = 0
+        self.partial = b""
+        self.start_timestamp = None
+        self.last_minutes = None
+        self.open_injection = None
+        self.closed = False
+
+    def read_lines(self):
+        """Reads the lines appended to the log since the last read. An incomplete last line is kept until the rest of it is written 
+        (unless it contains the stop text)
+
+        :return: List of lines (without line endings), empty if the log file does not exist yet
+        :rtype: list
+        """
+        if not os.path.exists(self.log_file):
+            return([])
+        with open(self.log_file, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read()
+            self.offset = f.tell()
+        lines = (self.partial + chunk).split(b"\n")
+        self.partial = lines.pop()
+        if self.stop_text.encode("utf-8") in self.partial:
+            lines.append(self.partial)
+            self.partial = b""
+        return([x.decode("utf-8", errors = "replace").rstrip("\r") for x in lines])
+
+    def parse_line(self, line):
+        """Parses a log line into events
+
+        :param line: Line from batch.log
+        :type line: str
+        :return: List of BatchLogEvent events
+        :rtype: list
+        """
+        events = []
+        timestamp, message = parse_batch_log_line(line)
+        minutes = None
+        if timestamp is not None:
+            if self.start_timestamp is None:
+                self.start_timestamp = timestamp
+            minutes = (timestamp - self.start_timestamp).total_seconds() / 60
+            self.last_minutes = minutes
+        end_minutes = minutes if minutes is not None else self.last_minutes
+        injection_match = BATCH_LOG_INJECTION_PATTERN.search(message) if timestamp is not None else None
+        closed = self.stop_text in line
+        if (injection_match or closed) and self.open_injection is not None:
+            well, start_minutes = self.open_injection
+            events.append(BatchLogEvent("injection_finished", timestamp, end_minutes, well, start_minutes, message))
+            self.open_injection = None
+        if injection_match:
+            well = injection_match.group("well").upper()
+            self.open_injection = (well, minutes)
+            events.append(BatchLogEvent("injection_started", timestamp, minutes, well, minutes, message))
+        elif BATCH_LOG_ERROR_PATTERN.search(message):
+            events.append(BatchLogEvent("error", timestamp, end_minutes, None, None, message))
+        if closed:
+            self.closed = True
+            events.append(BatchLogEvent("batch_closed", timestamp, end_minutes, None, None, message))
+        return(events)
+
+    def poll(self):
+        """Reads and parses the lines appended to the log since the last read without waiting
+
+        :return: List of BatchLogEvent events
+        :rtype: list
+        """
+        events = []
+        for line in self.read_lines():
+            if self.closed:
+                break
+            events.extend(self.parse_line(line))
+        return(events)
+
+    def events(self, timeout_seconds, poll_seconds = 1, stop_event = None):
+        """Yields events as the log is written. Waits for the log file to appear and stops after the batch_closed event, 
+        once timeout_seconds have passed, or once stop_event is set (check the closed attribute to tell these apart)
+
+        :param timeout_seconds: Seconds to wait for the batch to close
+        :type timeout_seconds: float
+        :param poll_seconds: Seconds to wait between checks for new lines, defaults to 1
+        :type poll_seconds: float, optional
+        :param stop_event: If provided, stop following the log once this event is set, defaults to None
+        :type stop_event: `threading.Event`, optional
+        :return: Generator of BatchLogEvent events
+        :rtype: generator
+        """
+        start_time = time.time()
+        abort = stop_event.is_set if stop_event is not None else None
+        while not self.closed:
+            try:
+                events = wait_until(self.poll, max(timeout_seconds - (time.time() - start_time), 0), description = "batch.log events", 
+                                    abort = abort, max_interval_seconds = poll_seconds)
+            except WaitTimeoutError:
+                return
+            if events is None:
+                return
+            for event in events:
+                yield(event)
+
+def format_batch_log_event(event):
+    """Formats a batch.log event for printing
+
+    :param event: batch.log event
+    :type event: `BatchLogEvent`
+    :return: Event description
+    :rtype: str
+    """
+    out_s = f"[{event.minutes:.2f} min] " if event.minutes is not None else ""
+    out_s += event.kind.replace("_", " ")
+    if event.well:
+        out_s += f" {event.well}"
+    if event.kind == "error":
+        out_s += f": {event.message}"
+    return(out_s)
+
+# Columns of batch.rftime read by stream_injection_windows
+RFTIME_COLUMNS = ["Barcode", "Sequence", "Well", "Start", "End"]
+
+def find_sequence_d_file(data_dir, sequence_name):
+    """Looks up the sequence .d file of a plate in the RFDatabase.xml of a running batch (see splitterExtract.get_sequence_d_file), 
+    without erroring if the file or the plate is not (yet) listed
+
+    :param data_dir: Path to RF directory containing run output files
+    :type data_dir: str
+    :param sequence_name: Name (barcode) of the plate
+    :type sequence_name: str
+    :return: Sequence .d file name, e.g. sequence1.d, None (after printing a warning) if it could not be found
+    :rtype: str
+    """
+    rfdb_file = os.path.join(data_dir, "RFDatabase.xml")
+    try:
+        sequences = set(s for (barcode, well, index), s in read_rfdb_sequences(rfdb_file).items() if barcode == sequence_name)
+    except (OSError, ET.ParseError):
+        sequences = set()
+    if len(sequences) != 1:
+        print(f"Warning - could not find a single sequence .d file for plate {sequence_name} in {rfdb_file} (got sequence set = {sequences}), not streaming injection windows")
+        return(None)
+    return(f"sequence{sequences.pop()}.d")
+
+def stream_injection_windows(data_dir, sequence_name, timeout_seconds, poll_seconds = 1):
+    """Follows the batch.rftime of a running batch and yields the split window of each injection of a plate as soon as it can be computed. 
+    Injection times are read from batch.rftime, which is written as the injections happen and gives them in the time base of the sequence .d 
+    file of their plate. The windows are computed as by splitterExtract.get_splits on the file splitter output of the finished run: the 
+    effective range of an injection (the injection cycle following it) is shifted back by the interval to the next injection 
+    (see splitterExtract.correct_injection_offset), so a window is yielded once the next injection of the plate has finished, and the last 
+    window of the plate once the next plate starts or the batch closes. 
+    The batch.rftime format read here (a tab-separated header with Barcode, Sequence, Well, Start, and End columns, one line per injection) and the 
+    effective range model (the injection cycle following the injection, from End to 2 * End - Start) are assumptions that have not yet been checked against 
+    the output of a real RapidFire run. If the batch.rftime header lacks these columns or the sequence .d file of the plate cannot be found in RFDatabase.xml, 
+    a warning is printed and no windows are yielded, so the caller can fall back to the post-run file splitter
+
+    :param data_dir: Path to RF directory containing run output files
+    :type data_dir: str
+    :param sequence_name: Name (barcode) of the plate whose injections to split
+    :type sequence_name: str
+    :param timeout_seconds: Seconds to wait before erroring
+    :type timeout_seconds: float
+    :param poll_seconds: Seconds to wait between checks for new injections, defaults to 1
+    :type poll_seconds: float, optional
+    :return: Generator of split tuples (sequence .d file basename, output .d file name, start time, end time) in the same format as splitterExtract.get_splits, 
+        empty if the batch closed without writing a batch.rftime or the batch.rftime or RFDatabase.xml could not be read
+    :rtype: generator
+    """
+    start_time = time.time()
+    batch_log = LogFollower(os.path.join(data_dir, "batch.log"))
+    rftime_file = os.path.join(data_dir, "batch.rftime")
+    def rftime_or_closed():
+        batch_log.poll()
+        return(os.path.exists(rftime_file) or batch_log.closed)
+    wait_or_exit(rftime_or_closed, timeout_seconds, description = f"batch.rftime in {data_dir}", max_interval_seconds = poll_seconds)
+    if not os.path.exists(rftime_file):
+        print(f"Warning - the batch in {data_dir} closed without writing a batch.rftime, no injection windows to stream")
+        return
+    rftime = LogFollower(rftime_file)
+    columns = None
+    d_file_base = None
+    n_injections = 0
+    previous = None
+    interval = 0
+    while True:
+        def new_lines():
+            batch_log.poll()
+            closed = batch_log.closed
+            # Lines are read after checking for the end of the batch, so that no injection written before it is missed
+            lines = rftime.read_lines()
+            return((lines, closed) if lines or closed else None)
+        try:
+            lines, closed = wait_until(new_lines, max(timeout_seconds - (time.time() - start_time), 0), description = "batch.rftime injections", 
+                                       max_interval_seconds = poll_seconds)
+        except WaitTimeoutError:
+            sys.exit(f"Error - timed out after {timeout_seconds} seconds waiting for the batch in {data_dir} to finish")
+        for line in lines:
+            fields = line.split("\t")
+            if columns is None:
+                columns = {x : i for i, x in enumerate(fields)}
+                missing_columns = [x for x in RFTIME_COLUMNS if x not in columns]
+                if missing_columns:
+                    print(f"Warning - {rftime_file} has no {', '.join(missing_columns)} column(s) in its header {fields}, not streaming injection windows")
+                    return
+                continue
+            if len(fields) != len(columns):
+                continue
+            n_injections += 1
+            if fields[columns["Barcode"]] == sequence_name and d_file_base is None:
+                # Plates of a multi-plate batch are acquired into separate sequence .d files
+                d_file_base = find_sequence_d_file(data_dir, sequence_name)
+                if d_file_base is None:
+                    return
+            if fields[columns["Barcode"]] != sequence_name or f"sequence{fields[columns['Sequence']]}.d" != d_file_base:
+                if previous is not None:
+                    # The next plate started, closing the last window of this plate
+                    yield((d_file_base, previous[0], *correct_injection_offset(previous[1], interval)))
+                    return
+                continue
+            start, end = float(fields[columns["Start"]]), float(fields[columns["End"]])
+            effective_range = (end, 2 * end - start)
+            if previous is not None:
+                interval = effective_range[0] - previous[1][0]
+                yield((d_file_base, previous[0], *correct_injection_offset(previous[1], interval)))
+            previous = (f"Inj{n_injections:05d}-{sequence_name}-{fields[columns['Well']]}.d", effective_range)
+        if closed:
+            break
+    if previous is not None:
+        yield((d_file_base, previous[0], *correct_injection_offset(previous[1], interval)))
+
+def monitor_batch(data_dir, timeout_seconds, event_callback = None, cancel_event = None):
+    """Follows the batch.log of a running batch until the batch closes, printing its events (see LogFollower)
+
+    :param data_dir: Path to RF directory containing run output files
+    :type data_dir: str
+    :param timeout_seconds: Seconds to wait for the batch to close before erroring
+    :type timeout_seconds: float
+    :param event_callback: If provided, called as event_callback(kind, minutes, well, message) for every batch.log event, defaults to None
+    :type event_callback: function, optional
+    :param cancel_event: If provided, stop following the log once this event is set, defaults to None
+    :type cancel_event: `threading.Event`, optional
+    :return: True if the batch closed, False if cancel_event was set first (the batch should then be stopped)
+    :rtype: bool
+    """
+    print(f"Monitoring the batch.log file in directory {data_dir}...")
+    follower = LogFollower(os.path.join(data_dir, "batch.log"))
+    for event in follower.events(timeout_seconds, stop_event = cancel_event):
+        print(format_batch_log_event(event))
+        if event_callback is not None:
+            # Only plain values are passed so the callback can be a function on the calling (rpyc client) computer
+            event_callback(event.kind, event.minutes, event.well, event.message)
+    if cancel_event is not None and cancel_event.is_set() and not follower.closed:
+        return(False)
+    if not follower.closed:
+        sys.exit(f"Error - the batch.log in {data_dir} was not closed within {timeout_seconds} seconds")
+    return(True)
+
 ################################################################################################
 # Multi-step workflows
 ################################################################################################
@@ -369,6 +711,10 @@ def remote_run_rfbat(test = False, *args, **kwargs):
         :type rfbat_file: str
         :param timeout_seconds: Seconds to wait before erroring
         :type timeout_seconds: float
+        :param event_callback: If provided, called as event_callback(kind, minutes, well, message) for every batch.log event (see LogFollower) while the run progresses
+        :type event_callback: function, optional
+        :param cancel_event: If provided, the run is stopped once this event is set (see rf_jobs.JobManager)
+        :type cancel_event: `threading.Event`, optional
         :return: Path to directory containing run output files
         :rtype: str
     """
@@ -389,18 +735,18 @@ def remote_run_rfbat(test = False, *args, **kwargs):
     data_dir = find_latest_dir(rf_base_data_dir, path_convert = {'D:\\' : "M:\\"})
     if test:
         return(data_dir)
-    print(f"Monitoring the batch.log file in directory {data_dir}...")
-    log_file = os.path.join(data_dir, "batch.log")
-    start_time = time.time()
-    log_lines = ""
-    print("Waiting for batch.log file to appear...")
-    while not os.path.exists(log_file) and ( (time.time() - start_time) < kwargs['timeout_seconds']):
-        time.sleep(1)
-    print(f"...monitoring batch.log file...")
-    while ("batch.log closed" not in log_lines) and ( (time.time() - start_time) < kwargs['timeout_seconds']):
-        with open(log_file, 'r') as f:
-            log_lines = f.read()
-        time.sleep(1)
+    # The RapidFire asks for confirmation before every plate of a multi-plate batch, which is answered while the batch is monitored
+    prompts_stop = threading.Event()
+    prompts_thread = threading.Thread(target = answer_plate_prompts, args = (window, app, count_rfbat_plates(kwargs['rfbat_file']) - 1, prompts_stop), daemon = True)
+    prompts_thread.start()
+    try:
+        completed = monitor_batch(data_dir, kwargs['timeout_seconds'], event_callback = kwargs.get('event_callback'), cancel_event = kwargs.get('cancel_event'))
+    finally:
+        prompts_stop.set()
+        prompts_thread.join()
+    if not completed:
+        print(f"Run cancelled, stopping the batch in {data_dir}")
+        stop_run(window)
     return(data_dir)
 
 def remote_file_split(test = False, *args, **kwargs):
@@ -412,20 +758,25 @@ def remote_file_split(test = False, *args, **kwargs):
     :type data_dir: str
     :param timeout_seconds: Seconds to wait before erroring
     :type timeout_seconds: float
+    :param cancel_event: If provided, stop waiting for the splitter once this event is set (see rf_jobs.JobManager)
+    :type cancel_event: `threading.Event`, optional
     """
     data_dir = kwargs['data_dir']
+    cancel_event = kwargs.get('cancel_event')
+    def cancelled():
+        return(cancel_event is not None and cancel_event.is_set())
     app, window = initialize_app()
     splitter_window = open_splitter_view(window, app)
     set_splitter_autoconvert(splitter_window, False)
     run_split(splitter_window, split_dir = data_dir)
-    progress_text = [x for x in splitter_window.children() if x.automation_id() == "exportProgressLabel"][0]
+    progress_text = splitter_window.element(auto_id = "exportProgressLabel", children_only = True)
     print(f"Waiting for file splitting to start...")
     start_time = time.time()
-    while ( "plate" not in [x.lower() for x in progress_text.texts()] ) and ( "Completed Successfully" not in progress_text.texts() ) and ( (time.time() - start_time) < kwargs['timeout_seconds']):
-        time.sleep(1)
+    wait_or_exit(lambda : ( "plate" in [x.lower() for x in progress_text.texts()] ) or ( "Completed Successfully" in progress_text.texts() ), 
+                 kwargs['timeout_seconds'], description = "file splitting to start", abort = cancelled)
     print(f"..monitoring splitter progress...")
-    while ( "Completed Successfully" not in progress_text.texts() ) and ( (time.time() - start_time) < kwargs['timeout_seconds']):
-        time.sleep(1)
+    wait_or_exit(lambda : "Completed Successfully" in progress_text.texts(), max(kwargs['timeout_seconds'] - (time.time() - start_time), 0), 
+                 description = "file splitting to complete", abort = cancelled)
     return(0)
     
 
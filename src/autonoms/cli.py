@@ -0,0 +1,69 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Command-line entry point for autonoms-run. Heavy dependencies (pandas, prefect, rpyc, deimos)
+# are only imported once the arguments have been validated, so --help and argument errors
+# return immediately.
+################################################################################################
+import os
+import argparse
+################################################################################################
+
+def get_parser():
+    """Builds the autonoms-run argument parser
+
+    :return: Argument parser
+    :rtype: `argparse.ArgumentParser`
+    """
+    parser = argparse.ArgumentParser(prog = "autonoms-run", description = "Run an AutonoMS experiment")
+    parser.add_argument('-i', '--input_excel_file', required = True, help = "Experiment definition file (.xlsx workbook, .toml, or .csv/.parquet samples table)")
+    parser.add_argument('-c', '--configs_toml', required = True)
+    parser.add_argument('-o', '--output_dir', required = True)
+    parser.add_argument('-n', '--no_checks', action = 'store_true')
+    parser.add_argument('-t', '--test', action = "store_true")
+    parser.add_argument('-p', '--pipeline', action = "store_true", help = "Process each sequence in the background while the next sequence acquires")
+    parser.add_argument('-s', '--stream', action = "store_true", help = "Split and demultiplex injections while their plate is still running")
+    parser.add_argument('-r', '--resume', action = "store_true", help = "Resume an interrupted run from the run manifest in the output directory")
+    parser.add_argument('--simulate', action = "store_true", help = "Run against simulated RapidFire and 6560 instruments instead of the instrument computers")
+    return(parser)
+
+def get_args(argv = None):
+    """Helper function for initializing arguments on command line invocation
+
+    :param argv: Command line arguments, defaults to sys.argv
+    :type argv: list, optional
+    :return: Parameter arguments
+    :rtype: Namespace
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    for fname in [args.input_excel_file, args.configs_toml]:
+        if not os.path.isfile(fname):
+            parser.error(f"file not found: {fname}")
+    args.input_excel_file = os.path.abspath(args.input_excel_file)
+    args.output_dir = os.path.abspath(args.output_dir)
+
+    # Get executable locations from toml config file and data analysis parameters from experiment file. The experiment
+    # definition is parsed once here and the resulting model is passed to all tasks
+    import toml
+    from autonoms.utils_experiment import load_experiment
+    execs_d = toml.load(args.configs_toml)
+    experiment_cache_dir = os.path.join(execs_d["cache_dir"], "experiments") if execs_d.get("cache_dir") else None
+    args.experiment = load_experiment(args.input_excel_file, cache_dir = experiment_cache_dir)
+    for k, v in {**execs_d, **args.experiment.data_analysis}.items():
+        setattr(args, k, v)
+
+    return(args)
+
+def main(argv = None):
+    """Runs the main autono-ms workflow from the command-line
+
+    :param argv: Command line arguments, defaults to sys.argv
+    :type argv: list, optional
+    """
+    args = get_args(argv)
+    from autonoms.workflow_control import main_flow
+    main_flow(args)
+
+if __name__ == "__main__":
+    main()
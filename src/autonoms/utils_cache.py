@@ -0,0 +1,298 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+################################################################################################
+
+################################################################################################
+# Input fingerprints
+################################################################################################
+def list_tree(path):
+    """Lists the files of a file or directory tree together with their sizes and modification times
+
+    :param path: Path to a file or directory
+    :type path: str
+    :return: Sorted list of (relative path, size, mtime in ns) tuples, relative path is "" for a single file
+    :rtype: list
+    """
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return([("", st.st_size, st.st_mtime_ns)])
+    out_files = []
+    for root, dirs, files in os.walk(path):
+        for fname in files:
+            full_name = os.path.join(root, fname)
+            st = os.stat(full_name)
+            rel_name = os.path.relpath(full_name, path).replace(os.sep, "/")
+            out_files.append((rel_name, st.st_size, st.st_mtime_ns))
+    out_files.sort()
+    return(out_files)
+
+def fingerprint_path(path, block_bytes = 1 << 20):
+    """Computes a content fingerprint of a file or directory tree from the relative path, size, and full content of every file. Files are
+    read in blocks, so memory use does not depend on their size. Modification times are not part of the fingerprint, so copies of the same
+    data have the same fingerprint
+
+    :param path: Path to a file or directory
+    :type path: str
+    :param block_bytes: Number of bytes read and hashed at a time, defaults to 1 MiB
+    :type block_bytes: int, optional
+    :return: Hex digest fingerprint
+    :rtype: str
+    """
+    h = hashlib.sha256()
+    for rel_name, size, _ in list_tree(path):
+        h.update(f"{rel_name}\0{size}\0".encode("utf-8"))
+        full_name = os.path.join(path, rel_name) if rel_name else path
+        with open(full_name, 'rb') as f:
+            for buffer in iter(lambda : f.read(block_bytes), b""):
+                h.update(buffer)
+    return(h.hexdigest())
+
+def link_or_copy(src, dst):
+    """Places a file or directory tree at dst using hardlinks where possible and falling back to copying
+
+    :param src: Path to source file or directory
+    :type src: str
+    :param dst: Path to destination (must not exist)
+    :type dst: str
+    """
+    def link_file(s, d):
+        try:
+            os.link(s, d)
+        except OSError:
+            shutil.copy2(s, d)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function = link_file)
+    else:
+        link_file(src, dst)
+
+def remove_path(path):
+    """Removes a file or directory tree if it exists
+
+    :param path: Path to remove
+    :type path: str
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+################################################################################################
+# Artifact cache
+################################################################################################
+class ArtifactCache:
+    """A size-bounded, content-addressed cache of post-processing outputs. Entries are keyed on the fingerprints of a stage's input files plus
+    the exact stage parameters and hold the stage's output file/directory and (optionally) a small JSON-serializable return value.
+    Entries are evicted least-recently-used first once the cache grows beyond max_bytes. Lookups and stores of different keys run
+    concurrently (each key has its own lock), and entry sizes and last use times are kept in memory, read from disk once per cache object.
+
+    :param cache_dir: Path to cache directory (ideally on the same drive as the data so that entries can be hardlinked)
+    :type cache_dir: str
+    :param max_bytes: Maximum total size of cached artifacts in bytes, defaults to 100 GB
+    :type max_bytes: int, optional
+    """
+    def __init__(self, cache_dir, max_bytes = 100 * 1024 ** 3):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self._fingerprints = {}
+        self._path_locks = {}
+        self._key_locks = {}
+        self._index = None
+        os.makedirs(self.cache_dir, exist_ok = True)
+
+    def fingerprint(self, path):
+        """Fingerprints an input path, reusing the previous fingerprint if none of its files changed size or modification time. Hashing
+        the full content of a large .d file takes a while, so each input is hashed once per run of the workflow, and concurrent callers
+        fingerprinting the same path wait for a single hash instead of each hashing the path
+
+        :param path: Path to input file or directory
+        :type path: str
+        :return: Hex digest fingerprint
+        :rtype: str
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+        with path_lock:
+            signature = hashlib.sha256(repr(list_tree(path)).encode("utf-8")).hexdigest()
+            with self.lock:
+                memo = self._fingerprints.get(path)
+            if memo and memo[0] == signature:
+                return(memo[1])
+            fp = fingerprint_path(path)
+            with self.lock:
+                self._fingerprints[path] = (signature, fp)
+        return(fp)
+
+    def make_key(self, stage, input_paths, params):
+        """Builds the cache key for a stage run
+
+        :param stage: Name of the processing stage (e.g. "demultiplex")
+        :type stage: str
+        :param input_paths: Paths of the input files/directories of the stage
+        :type input_paths: list
+        :param params: Parameters that change the stage output
+        :type params: dict
+        :return: Cache key
+        :rtype: str
+        """
+        key_d = {"stage" : stage,
+                 "inputs" : [self.fingerprint(x) for x in input_paths],
+                 "params" : {k : str(v) for k, v in params.items()}}
+        return(hashlib.sha256(json.dumps(key_d, sort_keys = True).encode("utf-8")).hexdigest())
+
+    def entry_dir(self, key):
+        """Path to the cache entry directory for a key
+
+        :param key: Cache key
+        :type key: str
+        :return: Path to entry directory
+        :rtype: str
+        """
+        return(os.path.join(self.cache_dir, key[ : 2], key))
+
+    def _key_lock(self, key):
+        with self.lock:
+            return(self._key_locks.setdefault(key, threading.Lock()))
+
+    def _load_index(self):
+        # Dictionary of key : (size, last used) pairs of all entries, must be called with self.lock held
+        if self._index is None:
+            self._index = {os.path.basename(entry_dir) : (meta.get("size", 0), meta.get("last_used", 0)) for entry_dir, meta in self.entries()}
+        return(self._index)
+
+    def _read_meta(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, "meta.json"), 'r') as f:
+                return(json.load(f))
+        except (OSError, ValueError):
+            return(None)
+
+    def _write_meta(self, entry_dir, meta):
+        temp_file = os.path.join(entry_dir, "meta.json.tmp")
+        with open(temp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_file, os.path.join(entry_dir, "meta.json"))
+
+    def get(self, key, out_path = None):
+        """Looks up a cache entry and, on a hit, places its artifact at out_path
+
+        :param key: Cache key from make_key
+        :type key: str
+        :param out_path: Path at which to place the cached artifact (replaced if it exists), defaults to None
+        :type out_path: str, optional
+        :return: The entry's metadata (the stage return value is under "value") or None on a cache miss
+        :rtype: dict
+        """
+        with self._key_lock(key):
+            entry_dir = self.entry_dir(key)
+            meta = self._read_meta(entry_dir)
+            if meta is None:
+                return(None)
+            artifact = os.path.join(entry_dir, "artifact")
+            if out_path and meta.get("has_artifact"):
+                if not os.path.exists(artifact):
+                    return(None)
+                remove_path(out_path)
+                os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok = True)
+                link_or_copy(artifact, out_path)
+            meta["last_used"] = time.time()
+            self._write_meta(entry_dir, meta)
+        with self.lock:
+            self._load_index()[key] = (meta.get("size", 0), meta["last_used"])
+        print(f"Cache hit for {meta['stage']} ({key[ : 12]})" + (f" -> {out_path}" if out_path else ""))
+        return(meta)
+
+    def put(self, key, stage, artifact_path = None, value = None):
+        """Stores a stage output in the cache and evicts old entries if the cache is over its size limit
+
+        :param key: Cache key from make_key
+        :type key: str
+        :param stage: Name of the processing stage
+        :type stage: str
+        :param artifact_path: Path to the output file/directory to store, defaults to None
+        :type artifact_path: str, optional
+        :param value: JSON-serializable stage return value to store, defaults to None
+        :type value: object, optional
+        """
+        entry_dir = self.entry_dir(key)
+        temp_dir = f"{entry_dir}.tmp{os.getpid()}_{threading.get_ident()}"
+        remove_path(temp_dir)
+        os.makedirs(temp_dir)
+        size = 0
+        if artifact_path:
+            link_or_copy(artifact_path, os.path.join(temp_dir, "artifact"))
+            size = sum(x[1] for x in list_tree(artifact_path))
+        now = time.time()
+        meta = {"stage" : stage, "created" : now, "last_used" : now, "size" : size,
+                "has_artifact" : artifact_path is not None, "value" : value}
+        self._write_meta(temp_dir, meta)
+        with self._key_lock(key):
+            remove_path(entry_dir)
+            os.replace(temp_dir, entry_dir)
+        with self.lock:
+            self._load_index()[key] = (size, now)
+        self.evict()
+
+    def entries(self, stale_temp_seconds = 3600):
+        """Lists the cache entries. Temporary entry directories left behind by an interrupted put (<key>.tmp<pid>_<thread id>) are not
+        listed, and are removed if they were written by another process and have not been modified for stale_temp_seconds
+
+        :param stale_temp_seconds: Age in seconds after which temporary entry directories of other processes are removed, defaults to 3600
+        :type stale_temp_seconds: float, optional
+        :return: List of (entry directory, metadata) tuples
+        :rtype: list
+        """
+        out_entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                if ".tmp" in key:
+                    try:
+                        stale = not key.split(".tmp", 1)[1].startswith(f"{os.getpid()}_") and time.time() - os.path.getmtime(entry_dir) > stale_temp_seconds
+                        if stale:
+                            remove_path(entry_dir)
+                    except OSError:
+                        pass
+                    continue
+                meta = self._read_meta(entry_dir)
+                if meta is not None:
+                    out_entries.append((entry_dir, meta))
+        return(out_entries)
+
+    def evict(self):
+        """Removes least-recently-used entries until the total cached size is at most max_bytes. Entries which are being read or written
+        by another thread are skipped
+
+        :return: Number of evicted entries
+        :rtype: int
+        """
+        with self.lock:
+            index = self._load_index()
+            total_size = sum(x[0] for x in index.values())
+            n_evicted = 0
+            for key in sorted(index, key = lambda x : index[x][1]):
+                if total_size <= self.max_bytes:
+                    break
+                key_lock = self._key_lock(key)
+                if not key_lock.acquire(blocking = False):
+                    continue
+                try:
+                    remove_path(self.entry_dir(key))
+                finally:
+                    key_lock.release()
+                total_size -= index.pop(key)[0]
+                n_evicted += 1
+        if n_evicted:
+            print(f"Evicted {n_evicted} cache entries, cache size is now {total_size / 1024 ** 3:.2f} GB")
+        return(n_evicted)
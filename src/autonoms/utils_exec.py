@@ -0,0 +1,232 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from collections import namedtuple, deque
+from autonoms.utils_trace import get_tracer
+################################################################################################
+
+# Resources a single run of an external tool is expected to occupy
+ToolResources = namedtuple("ToolResources", ["cores", "ram_gb", "io_slots"])
+
+# Default resource classes of the external executables called by the workflow
+TOOL_RESOURCES = {
+    "pnnl_preprocessor" : ToolResources(cores = 4, ram_gb = 8, io_slots = 1),
+    "mh_splitter" : ToolResources(cores = 1, ram_gb = 2, io_slots = 1),
+    "msconvert" : ToolResources(cores = 1, ram_gb = 2, io_slots = 1),
+    "skyline" : ToolResources(cores = 4, ram_gb = 8, io_slots = 1),
+    "start_mh_rf" : ToolResources(cores = 0, ram_gb = 0, io_slots = 0),
+}
+
+# Outcome of a finished job
+JobResult = namedtuple("JobResult", ["tool", "job_name", "returncode", "wait_seconds", "run_seconds", "timed_out", "stdout_file", "stderr_file"])
+
+################################################################################################
+# Tool executor
+################################################################################################
+class ToolExecutor:
+    """Runs external executables subject to a shared budget of CPU cores, memory, and concurrent disk I/O slots. Every tool has a
+    resource class (see TOOL_RESOURCES) and a job is only started once enough of each resource is free. Jobs are admitted in the order in
+    which they were submitted so that large jobs are not starved by a stream of small ones. A job asking for more than the whole budget is
+    run on its own. The stdout/stderr of every job is written to per-job log files and queue wait and run times are recorded for every job
+    (and traced with the shared tracer, see autonoms.utils_trace).
+
+    :param cores: Number of CPU cores available to external tools, defaults to the number of CPUs
+    :type cores: int, optional
+    :param ram_gb: Memory (GB) available to external tools, defaults to None (memory is not limited)
+    :type ram_gb: float, optional
+    :param io_slots: Number of disk I/O heavy jobs allowed at once, defaults to 2
+    :type io_slots: int, optional
+    :param tool_resources: Resource classes overriding the TOOL_RESOURCES defaults, given as tool : ToolResources or tool : dict pairs, defaults to None
+    :type tool_resources: dict, optional
+    :param timeout_seconds: Default timeout for jobs not given their own, defaults to None
+    :type timeout_seconds: float, optional
+    """
+    def __init__(self, cores = None, ram_gb = None, io_slots = 2, tool_resources = None, timeout_seconds = None):
+        self.capacity = ToolResources(cores = cores or os.cpu_count() or 1,
+                                      ram_gb = float("inf") if ram_gb is None else float(ram_gb),
+                                      io_slots = io_slots)
+        self.tool_resources = dict(TOOL_RESOURCES)
+        for tool, resources in (tool_resources or {}).items():
+            if isinstance(resources, dict):
+                resources = self.tool_resources.get(tool, ToolResources(1, 0, 0))._replace(**resources)
+            self.tool_resources[tool] = ToolResources(*resources)
+        self.timeout_seconds = timeout_seconds
+        self.condition = threading.Condition()
+        self.in_use = ToolResources(0, 0, 0)
+        self.queue = deque()
+        self.job_results = []
+
+    def resources(self, tool):
+        """Gets the resource class of a tool, clamped to the executor capacity
+
+        :param tool: Tool name
+        :type tool: str
+        :return: Resources a job of the tool occupies
+        :rtype: `ToolResources`
+        """
+        if tool not in self.tool_resources:
+            sys.exit(f"Error - no resource class for tool {tool}, must be one of {list(self.tool_resources.keys())}")
+        return(ToolResources(*[min(x, c) for x, c in zip(self.tool_resources[tool], self.capacity)]))
+
+    def _fits(self, request):
+        return(all(used + x <= c for used, x, c in zip(self.in_use, request, self.capacity)))
+
+    def _acquire(self, request):
+        ticket = object()
+        with self.condition:
+            self.queue.append(ticket)
+            while not (self.queue[0] is ticket and self._fits(request)):
+                self.condition.wait()
+            self.queue.popleft()
+            self.in_use = ToolResources(*[used + x for used, x in zip(self.in_use, request)])
+            self.condition.notify_all()
+
+    def _release(self, request):
+        with self.condition:
+            self.in_use = ToolResources(*[used - x for used, x in zip(self.in_use, request)])
+            self.condition.notify_all()
+
+    def _kill(self, proc):
+        if os.name == "nt":
+            # Kill the whole process tree, tools launched through a shell or .lnk/.bat file run as children
+            subprocess.call(["taskkill", "/F", "/T", "/PID", str(proc.pid)], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        else:
+            proc.kill()
+        proc.wait()
+
+    def run(self, tool, arg_list, job_name = None, log_dir = None, timeout_seconds = None, shell = False, cwd = None, labels = None, check = True):
+        """Runs an external tool once its resources are available and waits for it to finish
+
+        :param tool: Tool name, used to look up the resource class
+        :type tool: str
+        :param arg_list: Command line arguments, starting with the executable
+        :type arg_list: list
+        :param job_name: Name of the job used in log file names and job statistics, defaults to the tool name
+        :type job_name: str, optional
+        :param log_dir: Directory in which to write the job stdout/stderr logs, defaults to None (output is not captured)
+        :type log_dir: str, optional
+        :param timeout_seconds: Seconds after which the job is killed, defaults to the executor timeout
+        :type timeout_seconds: float, optional
+        :param shell: Run the command through the shell, defaults to False
+        :type shell: bool, optional
+        :param cwd: Working directory for the job, defaults to None
+        :type cwd: str, optional
+        :param labels: Trace labels (e.g. sequence and well) in addition to those of the enclosing span, defaults to None
+        :type labels: dict, optional
+        :param check: Exit with an error if the job returns a nonzero return code, defaults to True. Callers which inspect the return code
+            themselves pass False
+        :type check: bool, optional
+        :raises TimeoutError: If the job was killed after exceeding its timeout
+        :return: The job result
+        :rtype: `JobResult`
+        """
+        job_name = job_name or tool
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        request = self.resources(tool)
+        stdout_file, stderr_file = None, None
+        if log_dir:
+            os.makedirs(log_dir, exist_ok = True)
+            stdout_file = os.path.join(log_dir, f"{job_name}_stdout.txt")
+            stderr_file = os.path.join(log_dir, f"{job_name}_stderr.txt")
+        queued = time.time()
+        self._acquire(request)
+        started = time.time()
+        timed_out = False
+        try:
+            with open(stdout_file or os.devnull, 'wb') as out_f, open(stderr_file or os.devnull, 'wb') as err_f:
+                proc = subprocess.Popen(arg_list, stdout = out_f if stdout_file else None, stderr = err_f if stderr_file else None,
+                                        shell = shell, cwd = cwd)
+                try:
+                    returncode = proc.wait(timeout = timeout_seconds)
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+                    self._kill(proc)
+                    returncode = proc.returncode
+        finally:
+            self._release(request)
+        finished = time.time()
+        result = JobResult(tool = tool, job_name = job_name, returncode = returncode, wait_seconds = started - queued, run_seconds = finished - started,
+                           timed_out = timed_out, stdout_file = stdout_file, stderr_file = stderr_file)
+        with self.condition:
+            self.job_results.append(result)
+        tracer = get_tracer()
+        span_labels = {**tracer.current_labels(), **(labels or {}), "job" : job_name, "returncode" : returncode}
+        tracer.record(f"{tool} queued", queued, started, category = "queue", labels = span_labels)
+        tracer.record(tool, started, finished, category = "tool", labels = span_labels)
+        print(f"{tool} job {job_name} finished with return code {returncode} (queued {result.wait_seconds:.1f} s, ran {result.run_seconds:.1f} s)")
+        if timed_out:
+            raise TimeoutError(f"{tool} job {job_name} was killed after exceeding its timeout of {timeout_seconds} seconds")
+        if check and returncode != 0:
+            sys.exit(f"Error - {tool} job {job_name} failed with return code {returncode}" + (f", see {stderr_file}" if stderr_file else ""))
+        return(result)
+
+    def stats(self):
+        """Summarizes queue wait and run times of the finished jobs per tool
+
+        :return: Dictionary of tool : summary dictionary pairs
+        :rtype: dict
+        """
+        with self.condition:
+            job_results = list(self.job_results)
+        out_stats = {}
+        for tool in sorted(set(x.tool for x in job_results)):
+            tool_results = [x for x in job_results if x.tool == tool]
+            out_stats[tool] = {"jobs" : len(tool_results),
+                               "failed" : sum(1 for x in tool_results if x.returncode != 0),
+                               "timed_out" : sum(1 for x in tool_results if x.timed_out),
+                               "total_wait_seconds" : sum(x.wait_seconds for x in tool_results),
+                               "max_wait_seconds" : max(x.wait_seconds for x in tool_results),
+                               "total_run_seconds" : sum(x.run_seconds for x in tool_results),
+                               "max_run_seconds" : max(x.run_seconds for x in tool_results)}
+        return(out_stats)
+
+    def write_stats(self, out_file):
+        """Writes the per-tool summary and every job result to a .json file and prints the summary
+
+        :param out_file: Path to output .json file
+        :type out_file: str
+        """
+        out_stats = self.stats()
+        with self.condition:
+            jobs = [x._asdict() for x in self.job_results]
+        with open(out_file, 'w') as f:
+            json.dump({"tools" : out_stats, "jobs" : jobs}, f, indent = 2)
+        for tool, tool_stats in out_stats.items():
+            print(f"{tool}: {tool_stats['jobs']} jobs ({tool_stats['failed']} failed), "
+                  f"wait {tool_stats['total_wait_seconds']:.1f} s total / {tool_stats['max_wait_seconds']:.1f} s max, "
+                  f"run {tool_stats['total_run_seconds']:.1f} s total / {tool_stats['max_run_seconds']:.1f} s max")
+
+################################################################################################
+# Shared executor
+################################################################################################
+_executor = None
+_executor_lock = threading.Lock()
+
+def configure_executor(**kwargs):
+    """Replaces the shared executor used by the workflow tasks with one built from the given ToolExecutor arguments
+
+    :return: The new shared executor
+    :rtype: `ToolExecutor`
+    """
+    global _executor
+    with _executor_lock:
+        _executor = ToolExecutor(**kwargs)
+    return(_executor)
+
+def get_executor():
+    """Gets the shared executor used by the workflow tasks, creating one with default settings if none was configured
+
+    :return: The shared executor
+    :rtype: `ToolExecutor`
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ToolExecutor()
+        return(_executor)
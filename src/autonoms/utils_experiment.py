@@ -0,0 +1,253 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+import os
+import sys
+import json
+import math
+import hashlib
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+################################################################################################
+
+# Experiment definition sample sheet columns and the corresponding Injection attributes
+SAMPLE_COLUMNS = {"Well" : "well", "Description" : "description", "Sequence" : "sequence", "Sample_Number" : "sample_number",
+                  "Replicate_Number" : "replicate_number", "Sample_Type" : "sample_type", "6560_Method" : "ms_method",
+                  "Plate_Type" : "plate_type", "Column_Type" : "column_type", "Notes" : "notes"}
+
+################################################################################################
+# Experiment model
+################################################################################################
+@dataclass
+class Injection:
+    """A single injection (row of the samples sheet) of an experiment definition. Columns can also be accessed by their
+    sheet names, e.g. injection["Sample_Type"]. Columns not listed in SAMPLE_COLUMNS are kept in extra
+    """
+    well : str
+    sequence : str
+    sample_type : Optional[str] = None
+    ms_method : Optional[str] = None
+    plate_type : Optional[str] = None
+    column_type : Optional[str] = None
+    description : Optional[str] = None
+    sample_number : Optional[object] = None
+    replicate_number : Optional[object] = None
+    notes : Optional[str] = None
+    extra : Dict[str, object] = field(default_factory = dict)
+
+    def __getitem__(self, column):
+        if column in SAMPLE_COLUMNS:
+            return(getattr(self, SAMPLE_COLUMNS[column]))
+        return(self.extra[column])
+
+@dataclass
+class Experiment:
+    """An experiment definition: its injections (samples sheet), RapidFire method parameters (rf_params sheet), and data analysis
+    parameters (data_analysis sheet). Built by load_experiment and shared by all tasks of a run instead of re-reading the definition file
+
+    :param source_file: Path to the experiment definition file
+    :type source_file: str
+    :param file_hash: Content hash of the experiment definition file(s)
+    :type file_hash: str
+    :param injections: Injections in the order in which they appear in the definition
+    :type injections: list
+    :param rf_params: RapidFire method parameter rows, each a list of strings starting with the parameter name
+    :type rf_params: list
+    :param data_analysis: Dictionary of data analysis parameter : value pairs
+    :type data_analysis: dict
+    """
+    source_file : str
+    file_hash : str
+    injections : List[Injection]
+    rf_params : List[List[str]]
+    data_analysis : Dict[str, object]
+
+    def sequence_names(self):
+        """Lists the sequence names in order of first appearance
+
+        :return: List of sequence names
+        :rtype: list
+        """
+        return(list(dict.fromkeys(x.sequence for x in self.injections)))
+
+    def sequences(self):
+        """Groups the injections by sequence
+
+        :return: Dictionary of sequence name : list of injections pairs, in order of first appearance
+        :rtype: dict
+        """
+        out_sequences = {}
+        for injection in self.injections:
+            out_sequences.setdefault(injection.sequence, []).append(injection)
+        return(out_sequences)
+
+    def sequence_injections(self, sequence_name):
+        """Gets the injections of a sequence
+
+        :param sequence_name: Sequence name
+        :type sequence_name: str
+        :return: List of injections
+        :rtype: list
+        """
+        return([x for x in self.injections if x.sequence == sequence_name])
+
+    def to_dict(self):
+        return(asdict(self))
+
+    @classmethod
+    def from_dict(cls, d):
+        d = dict(d)
+        d["injections"] = [Injection(**x) for x in d["injections"]]
+        return(cls(**d))
+
+################################################################################################
+# Parsing
+################################################################################################
+def clean_value(value):
+    """Converts a table cell to a plain Python value, with empty cells as None
+    """
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return(None)
+    return(value)
+
+def injections_from_records(records):
+    """Builds injections from samples sheet rows
+
+    :param records: List of dictionaries of column : value pairs
+    :type records: list
+    :return: List of injections
+    :rtype: list
+    """
+    injections = []
+    for record in records:
+        kwargs = {"extra" : {}}
+        for column, value in record.items():
+            value = clean_value(value)
+            if column in SAMPLE_COLUMNS:
+                kwargs[SAMPLE_COLUMNS[column]] = value
+            else:
+                kwargs["extra"][str(column)] = value
+        if kwargs.get("well") is None or kwargs.get("sequence") is None:
+            continue
+        kwargs["sequence"] = str(kwargs["sequence"])
+        injections.append(Injection(**kwargs))
+    return(injections)
+
+def rf_params_from_df(df):
+    # Parameters are the first cell of each row, followed by one or more values, empty cells are skipped
+    rows = []
+    for i, row in df.iterrows():
+        row = [x for x in row.values.astype(str) if x != 'nan']
+        if row:
+            rows.append(row)
+    return(rows)
+
+def rf_params_from_dict(d):
+    def to_str(x):
+        if isinstance(x, bool):
+            return("1" if x else "0")
+        return(str(x))
+    return([[str(k)] + [to_str(x) for x in (v if isinstance(v, list) else [v])] for k, v in d.items()])
+
+def table_files(source_file):
+    """Gets the files of a CSV/Parquet experiment definition: the samples table plus <name>_rf_params and <name>_data_analysis tables next to it
+
+    :param source_file: Path to the samples table
+    :type source_file: str
+    :return: Dictionary of table : path pairs
+    :rtype: dict
+    """
+    stem, ext = os.path.splitext(source_file)
+    return({"samples" : source_file, "rf_params" : f"{stem}_rf_params{ext}", "data_analysis" : f"{stem}_data_analysis{ext}"})
+
+def hash_files(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda : f.read(1 << 20), b""):
+                h.update(chunk)
+    return(h.hexdigest())
+
+def parse_experiment(source_file, file_hash, sample_sheet = "samples", rf_sheet = "rf_params", analysis_sheet = "data_analysis"):
+    """Parses an experiment definition file (.xlsx workbook, .toml file, or .csv/.parquet tables)
+
+    :param source_file: Path to experiment definition file
+    :type source_file: str
+    :param file_hash: Content hash of the definition file(s)
+    :type file_hash: str
+    :return: The parsed experiment
+    :rtype: `Experiment`
+    """
+    ext = os.path.splitext(source_file)[1].lower()
+    if ext == ".toml":
+        import toml
+        d = toml.load(source_file)
+        return(Experiment(source_file = source_file, file_hash = file_hash, injections = injections_from_records(d.get(sample_sheet, [])),
+                          rf_params = rf_params_from_dict(d.get(rf_sheet, {})), data_analysis = dict(d.get(analysis_sheet, {}))))
+    import pandas as pd
+    if ext in [".xlsx", ".xlsm", ".xls"]:
+        # All sheets are read in a single pass over the workbook
+        sheets = pd.read_excel(source_file, sheet_name = [sample_sheet, rf_sheet, analysis_sheet])
+        df_samples, df_rf, df_analysis = sheets[sample_sheet], sheets[rf_sheet], sheets[analysis_sheet]
+    elif ext in [".csv", ".parquet"]:
+        read_table = pd.read_csv if ext == ".csv" else pd.read_parquet
+        files = table_files(source_file)
+        df_samples, df_rf, df_analysis = [read_table(files[x]) for x in ["samples", "rf_params", "data_analysis"]]
+    else:
+        sys.exit(f"Error - unrecognized experiment definition file type {ext}, must be .xlsx, .csv, .parquet, or .toml")
+    data_analysis = {k : clean_value(v) for k, v in df_analysis.set_index("Parameter")["Value"].to_dict().items()}
+    return(Experiment(source_file = source_file, file_hash = file_hash, injections = injections_from_records(df_samples.to_dict("records")),
+                      rf_params = rf_params_from_df(df_rf), data_analysis = data_analysis))
+
+_experiments = {}
+_experiments_lock = threading.Lock()
+
+def load_experiment(source, sample_sheet = "samples", rf_sheet = "rf_params", analysis_sheet = "data_analysis", cache_dir = None):
+    """Loads an experiment definition. Parsed experiments are cached in memory (and on disk if cache_dir is provided) by the content hash
+    of the definition file, so each definition is only parsed once. Experiments passed in are returned unchanged
+
+    :param source: Path to experiment definition file (.xlsx, .toml, .csv, or .parquet) or an already loaded experiment
+    :type source: str or `Experiment`
+    :param sample_sheet: Name of the sheet containing sequences/injections, defaults to "samples"
+    :type sample_sheet: str, optional
+    :param rf_sheet: Name of the sheet containing RF method parameters, defaults to "rf_params"
+    :type rf_sheet: str, optional
+    :param analysis_sheet: Name of the sheet containing data analysis parameters, defaults to "data_analysis"
+    :type analysis_sheet: str, optional
+    :param cache_dir: If provided, directory in which parsed experiments are stored as .json files, defaults to None
+    :type cache_dir: str, optional
+    :return: The experiment
+    :rtype: `Experiment`
+    """
+    if isinstance(source, Experiment):
+        return(source)
+    source_file = os.path.abspath(source)
+    if os.path.splitext(source_file)[1].lower() in [".csv", ".parquet"]:
+        hashed_files = list(table_files(source_file).values())
+    else:
+        hashed_files = [source_file]
+    file_hash = hash_files(hashed_files)
+    key = hashlib.sha256(json.dumps([file_hash, sample_sheet, rf_sheet, analysis_sheet]).encode("utf-8")).hexdigest()
+    with _experiments_lock:
+        if key in _experiments:
+            return(_experiments[key])
+    cache_file = os.path.join(cache_dir, f"experiment_{key}.json") if cache_dir else None
+    experiment = None
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, 'r') as f:
+            experiment = Experiment.from_dict(json.load(f))
+        experiment.source_file = source_file
+    if experiment is None:
+        experiment = parse_experiment(source_file, file_hash, sample_sheet = sample_sheet, rf_sheet = rf_sheet, analysis_sheet = analysis_sheet)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok = True)
+            with open(f"{cache_file}.tmp", 'w') as f:
+                json.dump(experiment.to_dict(), f, default = str)
+            os.replace(f"{cache_file}.tmp", cache_file)
+    with _experiments_lock:
+        _experiments[key] = experiment
+    return(experiment)
@@ -0,0 +1,128 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+import os
+import sys
+import json
+import time
+import threading
+################################################################################################
+
+# Per-sequence stages in the order in which they are completed
+STAGES = ["prepared", "acquired", "split", "demuxed", "calibrated", "analyzed"]
+
+################################################################################################
+# Run manifest
+################################################################################################
+class RunManifest:
+    """Durable record of the progress of an experiment run. For every sequence the manifest stores the last completed stage (one of STAGES)
+    and the artifacts (file paths and other JSON-serializable values) produced so far. The manifest is rewritten atomically after every
+    update so that an interrupted run can be resumed from it.
+
+    :param manifest_file: Path to manifest .json file
+    :type manifest_file: str
+    :param resume: Load the existing manifest file if there is one, otherwise start a new manifest, defaults to False
+    :type resume: bool, optional
+    """
+    def __init__(self, manifest_file, resume = False):
+        self.manifest_file = manifest_file
+        self.lock = threading.RLock()
+        self.data = {"created" : time.time(), "sequence_order" : [], "sequences" : {}}
+        if resume and os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self.data = json.load(f)
+            print(f"Resuming run from manifest {manifest_file}")
+            for sequence_name in self.data["sequence_order"]:
+                print(f"\t{sequence_name} : {self.stage(sequence_name)}")
+
+    def save(self):
+        """Atomically writes the manifest to its file
+        """
+        with self.lock:
+            self.data["updated"] = time.time()
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifest_file)), exist_ok = True)
+            temp_file = f"{self.manifest_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.data, f, indent = 2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.manifest_file)
+
+    def _sequence(self, sequence_name):
+        sequences = self.data["sequences"]
+        if sequence_name not in sequences:
+            sequences[sequence_name] = {"stage" : None, "artifacts" : {}, "history" : []}
+            self.data["sequence_order"].append(sequence_name)
+        return(sequences[sequence_name])
+
+    def sequences(self):
+        """Lists the sequences recorded in the manifest
+
+        :return: Sequence names in the order in which they were first recorded
+        :rtype: list
+        """
+        with self.lock:
+            return(list(self.data["sequence_order"]))
+
+    def stage(self, sequence_name):
+        """Gets the last completed stage of a sequence
+
+        :param sequence_name: Name of sequence
+        :type sequence_name: str
+        :return: Last completed stage or None if the sequence has not completed any stage
+        :rtype: str
+        """
+        with self.lock:
+            if sequence_name not in self.data["sequences"]:
+                return(None)
+            return(self.data["sequences"][sequence_name]["stage"])
+
+    def completed(self, sequence_name, stage):
+        """Checks whether a sequence has completed a given stage
+
+        :param sequence_name: Name of sequence
+        :type sequence_name: str
+        :param stage: Stage name (one of STAGES)
+        :type stage: str
+        :return: True if the sequence has completed the stage (or any later stage)
+        :rtype: bool
+        """
+        if stage not in STAGES:
+            sys.exit(f"Error - unrecognized run stage {stage}")
+        current_stage = self.stage(sequence_name)
+        if current_stage is None:
+            return(False)
+        return(STAGES.index(current_stage) >= STAGES.index(stage))
+
+    def artifacts(self, sequence_name):
+        """Gets the recorded artifacts of a sequence
+
+        :param sequence_name: Name of sequence
+        :type sequence_name: str
+        :return: Dictionary of artifact name : value pairs
+        :rtype: dict
+        """
+        with self.lock:
+            if sequence_name not in self.data["sequences"]:
+                return({})
+            return(dict(self.data["sequences"][sequence_name]["artifacts"]))
+
+    def update(self, sequence_name, stage = None, **artifacts):
+        """Records artifacts for a sequence and, if provided, marks a stage as completed. Stages never move backwards,
+        so re-running an earlier stage of a resumed sequence keeps its later progress. The manifest is saved afterwards
+
+        :param sequence_name: Name of sequence
+        :type sequence_name: str
+        :param stage: Completed stage (one of STAGES), defaults to None
+        :type stage: str, optional
+        """
+        if stage is not None and stage not in STAGES:
+            sys.exit(f"Error - unrecognized run stage {stage}")
+        with self.lock:
+            sequence_d = self._sequence(sequence_name)
+            sequence_d["artifacts"].update(artifacts)
+            if stage is not None:
+                sequence_d["history"].append((stage, time.time()))
+                if sequence_d["stage"] is None or STAGES.index(stage) > STAGES.index(sequence_d["stage"]):
+                    sequence_d["stage"] = stage
+            self.save()
@@ -0,0 +1,252 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Persistent rpyc connections to the services running on the instrument computers (e.g. the
+# RapidFire service, see agilent_methods/rf_rpyc_server.py). Connections are kept open between
+# calls, checked before reuse, reopened when they were dropped, and pinged in the background
+# while idle so that the instrument computer or the network does not close them.
+################################################################################################
+import time
+import threading
+from contextlib import contextmanager
+################################################################################################
+
+# Errors after which a connection is considered broken and is not returned to the pool
+CONNECTION_ERRORS = (EOFError, ConnectionError, TimeoutError)
+
+class ConnectionPool:
+    """Pool of persistent rpyc connections. Connections are keyed by host, port, and request timeout and are handed to one caller at a time.
+    A connection idle for longer than health_check_seconds is pinged before it is reused and replaced if the ping fails. Idle connections are
+    pinged every keepalive_seconds by a background thread and closed once they have been idle for max_idle_seconds
+
+    :param max_idle: Maximum number of idle connections kept per host and port, defaults to 2
+    :type max_idle: int, optional
+    :param keepalive_seconds: Seconds between pings of idle connections, defaults to 60 (None or 0 disables the keepalive thread)
+    :type keepalive_seconds: float, optional
+    :param health_check_seconds: Connections idle for longer than this are pinged before they are reused, defaults to 10
+    :type health_check_seconds: float, optional
+    :param ping_timeout_seconds: Seconds to wait for a ping reply, defaults to 5
+    :type ping_timeout_seconds: float, optional
+    :param connect_retries: Number of times a failed connection attempt is retried, defaults to 3
+    :type connect_retries: int, optional
+    :param retry_seconds: Seconds to wait between connection attempts, defaults to 2
+    :type retry_seconds: float, optional
+    :param max_idle_seconds: Idle connections are closed after this many seconds, defaults to None (kept open)
+    :type max_idle_seconds: float, optional
+    """
+    def __init__(self, max_idle = 2, keepalive_seconds = 60, health_check_seconds = 10, ping_timeout_seconds = 5, connect_retries = 3,
+                 retry_seconds = 2, max_idle_seconds = None):
+        self.max_idle = max_idle
+        self.keepalive_seconds = keepalive_seconds
+        self.health_check_seconds = health_check_seconds
+        self.ping_timeout_seconds = ping_timeout_seconds
+        self.connect_retries = connect_retries
+        self.retry_seconds = retry_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.stop_event = threading.Event()
+        self.keepalive_thread = None
+        self.stats = {"connects" : 0, "reuses" : 0, "reconnects" : 0}
+
+    def _connect(self, key):
+        import rpyc
+        host, port, sync_request_timeout = key
+        for attempt in range(self.connect_retries + 1):
+            try:
+                connection = rpyc.connect(host, port, config = {"sync_request_timeout" : sync_request_timeout}, keepalive = True)
+            except OSError as e:
+                if attempt == self.connect_retries:
+                    raise
+                print(f"Warning - could not connect to {host}:{port} ({e}), retrying in {self.retry_seconds} seconds")
+                time.sleep(self.retry_seconds)
+                continue
+            with self.lock:
+                self.stats["connects"] += 1
+            return(connection)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def is_alive(self, connection):
+        """Checks a connection by pinging the other side
+
+        :param connection: rpyc connection
+        :type connection: `rpyc.core.protocol.Connection`
+        :return: True if the connection is open and answered the ping
+        :rtype: bool
+        """
+        if connection.closed:
+            return(False)
+        try:
+            connection.ping(timeout = self.ping_timeout_seconds)
+            return(True)
+        except Exception:
+            return(False)
+
+    def _ensure_keepalive(self):
+        if not self.keepalive_seconds:
+            return
+        with self.lock:
+            if self.keepalive_thread is not None and self.keepalive_thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.keepalive_thread = threading.Thread(target = self._keepalive_loop, daemon = True, name = "rpyc_keepalive")
+            self.keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self.stop_event.wait(self.keepalive_seconds):
+            self.keepalive()
+
+    def keepalive(self):
+        """Pings the idle connections which have not been used for keepalive_seconds, dropping the ones which do not answer
+        or have been idle for longer than max_idle_seconds
+        """
+        now = time.time()
+        with self.lock:
+            checked = []
+            for key, entries in self.idle.items():
+                due = [x for x in entries if now - x[1] >= (self.keepalive_seconds or 0)]
+                self.idle[key] = [x for x in entries if x not in due]
+                checked.extend((key, x) for x in due)
+        for key, (connection, last_used) in checked:
+            if (self.max_idle_seconds is not None and now - last_used > self.max_idle_seconds) or not self.is_alive(connection):
+                self._close(connection)
+                continue
+            with self.lock:
+                # Pings do not count as use, so max_idle_seconds still applies
+                self.idle.setdefault(key, []).append((connection, last_used))
+
+    def acquire(self, host, port, sync_request_timeout = 30):
+        """Gets an open connection from the pool, or a new one if there is no usable idle connection
+
+        :param host: Host name or IP address
+        :type host: str
+        :param port: Port number
+        :type port: int
+        :param sync_request_timeout: Timeout seconds for rpyc requests, defaults to 30
+        :type sync_request_timeout: float, optional
+        :return: rpyc connection, to be handed back with release
+        :rtype: `rpyc.core.protocol.Connection`
+        """
+        key = (host, port, sync_request_timeout)
+        while True:
+            with self.lock:
+                entries = self.idle.get(key)
+                entry = entries.pop() if entries else None
+            if entry is None:
+                break
+            connection, last_used = entry
+            if (not connection.closed and time.time() - last_used < self.health_check_seconds) or self.is_alive(connection):
+                with self.lock:
+                    self.stats["reuses"] += 1
+                return(connection)
+            print(f"Warning - connection to {host}:{port} was lost, reconnecting")
+            with self.lock:
+                self.stats["reconnects"] += 1
+            self._close(connection)
+        self._ensure_keepalive()
+        return(self._connect(key))
+
+    def release(self, connection, host, port, sync_request_timeout = 30, broken = False):
+        """Hands a connection back to the pool
+
+        :param connection: rpyc connection from acquire
+        :type connection: `rpyc.core.protocol.Connection`
+        :param broken: Close the connection instead of keeping it, defaults to False
+        :type broken: bool, optional
+        """
+        key = (host, port, sync_request_timeout)
+        with self.lock:
+            entries = self.idle.setdefault(key, [])
+            if not (broken or connection.closed or len(entries) >= self.max_idle):
+                entries.append((connection, time.time()))
+                return
+        self._close(connection)
+
+    @contextmanager
+    def connection(self, host, port, sync_request_timeout = 30):
+        """Context manager giving a pooled connection, which is handed back to the pool afterwards (or closed if it broke)
+
+        :param host: Host name or IP address
+        :type host: str
+        :param port: Port number
+        :type port: int
+        :param sync_request_timeout: Timeout seconds for rpyc requests, defaults to 30
+        :type sync_request_timeout: float, optional
+        """
+        connection = self.acquire(host, port, sync_request_timeout = sync_request_timeout)
+        broken = False
+        try:
+            yield(connection)
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(connection, host, port, sync_request_timeout = sync_request_timeout, broken = broken)
+
+    def call(self, host, port, function_name, args = (), kwargs = None, sync_request_timeout = 30):
+        """Calls a function through the call_function method of the service on the other side of a pooled connection.
+        Calls are not retried, as the remote function may have run before the connection was lost
+
+        :param host: Host name or IP address
+        :type host: str
+        :param port: Port number
+        :type port: int
+        :param function_name: Name of the function to call
+        :type function_name: str
+        :param args: Positional function arguments, defaults to ()
+        :type args: tuple, optional
+        :param kwargs: Keyword function arguments, defaults to None
+        :type kwargs: dict, optional
+        :param sync_request_timeout: Timeout seconds for rpyc requests, defaults to 30
+        :type sync_request_timeout: float, optional
+        :return: Result from function call
+        :rtype: object
+        """
+        with self.connection(host, port, sync_request_timeout = sync_request_timeout) as connection:
+            return(connection.root.call_function(function_name, *args, **(kwargs or {})))
+
+    def close(self):
+        """Stops the keepalive thread and closes all idle connections
+        """
+        self.stop_event.set()
+        with self.lock:
+            entries = [entry for key_entries in self.idle.values() for entry in key_entries]
+            self.idle = {}
+        for connection, _ in entries:
+            self._close(connection)
+
+################################################################################################
+# Shared pool
+################################################################################################
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure_connection_pool(**kwargs):
+    """Replaces the shared connection pool used by the workflow tasks with one built from the given ConnectionPool arguments
+
+    :return: The new shared connection pool
+    :rtype: `ConnectionPool`
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(**kwargs)
+    return(_pool)
+
+def get_connection_pool():
+    """Gets the shared connection pool used by the workflow tasks, creating one with default settings if none was configured
+
+    :return: The shared connection pool
+    :rtype: `ConnectionPool`
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return(_pool)
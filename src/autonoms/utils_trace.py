@@ -0,0 +1,174 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+import os
+import re
+import json
+import time
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
+################################################################################################
+
+# Trace lanes (shown as processes in the trace viewer) for instrument and workstation activity
+LANES = {"instrument" : 1, "workstation" : 2}
+
+# Injection file names look like Inj00001-<sequence>-<well>.d
+INJECTION_NAME_PATTERN = re.compile(r"^Inj\d+-(?P<sequence>.+)-(?P<well>[A-Z]{1,2}\d{1,2})(?:[_.].*)?$", re.IGNORECASE)
+
+_current_labels = contextvars.ContextVar("autonoms_trace_labels", default = {})
+
+def path_labels(path):
+    """Gets trace labels from a file path. Injection files are labeled with their sequence and well, other files
+    and directories (e.g. sequence directories or .rfbat files) with their name as the sequence
+
+    :param path: Path to injection file, sequence directory, or sequence instrument file
+    :type path: str
+    :return: Dictionary of labels
+    :rtype: dict
+    """
+    name = os.path.basename(os.path.normpath(str(path)))
+    m = INJECTION_NAME_PATTERN.match(name)
+    if m:
+        return({"sequence" : m.group("sequence"), "well" : m.group("well")})
+    return({"sequence" : os.path.splitext(name)[0]})
+
+################################################################################################
+# Tracer
+################################################################################################
+class Tracer:
+    """Thread-safe recorder of timed spans which can be exported in the Chrome trace event format (loadable in chrome://tracing
+    and Perfetto). Every span has a name, a lane (instrument or workstation), and labels such as the sequence and well it belongs to.
+    Spans opened inside another span in the same thread or context inherit the labels of the outer span.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.thread_names = {}
+
+    def record(self, name, start, end, lane = "workstation", category = "task", labels = None):
+        """Records a finished span
+
+        :param name: Span name
+        :type name: str
+        :param start: Epoch start time in seconds
+        :type start: float
+        :param end: Epoch end time in seconds
+        :type end: float
+        :param lane: Lane, one of LANES, defaults to "workstation"
+        :type lane: str, optional
+        :param category: Span category, defaults to "task"
+        :type category: str, optional
+        :param labels: Span labels, defaults to None
+        :type labels: dict, optional
+        """
+        thread = threading.current_thread()
+        event = {"name" : name, "cat" : category, "ph" : "X", "ts" : start * 1e6, "dur" : (end - start) * 1e6,
+                 "pid" : LANES.get(lane, LANES["workstation"]), "tid" : thread.ident, "args" : dict(labels or {})}
+        with self.lock:
+            self.thread_names[thread.ident] = thread.name
+            self.events.append(event)
+
+    def current_labels(self):
+        """Gets the labels of the innermost open span in the current thread or context
+
+        :return: Dictionary of labels
+        :rtype: dict
+        """
+        return(dict(_current_labels.get()))
+
+    @contextlib.contextmanager
+    def span(self, name, lane = "workstation", category = "task", **labels):
+        """Context manager recording a span around its body
+
+        :param name: Span name
+        :type name: str
+        :param lane: Lane, one of LANES, defaults to "workstation"
+        :type lane: str, optional
+        :param category: Span category, defaults to "task"
+        :type category: str, optional
+        """
+        span_labels = {**_current_labels.get(), **{k : v for k, v in labels.items() if v is not None}}
+        token = _current_labels.set(span_labels)
+        start = time.time()
+        try:
+            yield span_labels
+        finally:
+            end = time.time()
+            _current_labels.reset(token)
+            self.record(name, start, end, lane = lane, category = category, labels = span_labels)
+
+    def trace_events(self, sequence = None):
+        """Gets the recorded spans in Chrome trace event format
+
+        :param sequence: If provided, only return spans labeled with this sequence, defaults to None
+        :type sequence: str, optional
+        :return: List of trace events, including lane and thread name metadata events
+        :rtype: list
+        """
+        with self.lock:
+            events = [x for x in self.events if sequence is None or x["args"].get("sequence") == sequence]
+            thread_names = dict(self.thread_names)
+        meta_events = [{"name" : "process_name", "ph" : "M", "pid" : pid, "args" : {"name" : lane}} for lane, pid in LANES.items()]
+        for pid, tid in sorted(set((x["pid"], x["tid"]) for x in events)):
+            meta_events.append({"name" : "thread_name", "ph" : "M", "pid" : pid, "tid" : tid, "args" : {"name" : thread_names.get(tid, str(tid))}})
+        return(meta_events + sorted(events, key = lambda x : x["ts"]))
+
+    def write(self, out_file, sequence = None):
+        """Writes the recorded spans to a Chrome trace .json file
+
+        :param out_file: Path to output .json file
+        :type out_file: str
+        :param sequence: If provided, only write spans labeled with this sequence, defaults to None
+        :type sequence: str, optional
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok = True)
+        temp_file = f"{out_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump({"traceEvents" : self.trace_events(sequence = sequence), "displayTimeUnit" : "ms"}, f)
+        os.replace(temp_file, out_file)
+        print(f"Wrote trace to {out_file}")
+
+################################################################################################
+# Shared tracer
+################################################################################################
+_tracer = Tracer()
+
+def get_tracer():
+    """Gets the shared tracer
+
+    :return: The shared tracer
+    :rtype: `Tracer`
+    """
+    return(_tracer)
+
+def traced(name = None, lane = "workstation", labels = None):
+    """Decorator recording a span with the shared tracer for every call of a function. Place it below Prefect's @task/@flow decorators
+
+    :param name: Span name, defaults to the function name
+    :type name: str, optional
+    :param lane: Lane, one of LANES, defaults to "workstation"
+    :type lane: str, optional
+    :param labels: Either the name of a path argument to take labels from (see path_labels) or a function returning labels given the call arguments as a dictionary, defaults to None
+    :type labels: str or function, optional
+    :return: Decorator
+    :rtype: function
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            span_labels = {}
+            if labels is not None:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                if callable(labels):
+                    span_labels = labels(bound.arguments)
+                elif bound.arguments.get(labels) is not None:
+                    span_labels = path_labels(bound.arguments[labels])
+            with _tracer.span(name or fn.__name__, lane = lane, **span_labels):
+                return(fn(*args, **kwargs))
+        return(wrapper)
+    return(decorator)
@@ -0,0 +1,492 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Data transfer and placement. The transfer engine copies files and directory trees (e.g. .d
+# files between the RapidFire and 6560 computers over the shared drive) with several threads,
+# verifies every chunk by checksum, resumes interrupted transfers from a journal, and publishes
+# a finished copy atomically. Raw data trees (e.g. RapidFire sequence .d files) are placed into
+# sequence directories with a strategy chosen per deployment: hardlinks/reflinks avoid copying
+# on the same filesystem, parallel_copy makes an independent copy with the transfer engine, and a
+# reference file records the source location without moving any data (the data is not archived).
+################################################################################################
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from autonoms.utils_cache import list_tree, remove_path
+from autonoms.utils_trace import get_tracer, path_labels
+################################################################################################
+
+PLACEMENT_STRATEGIES = ["auto", "link", "reference", "copy", "parallel_copy"]
+
+REFERENCE_SUFFIX = ".reference.json"
+
+# Linux ioctl request for a copy-on-write clone of a whole file (btrfs, XFS)
+FICLONE = 0x40049409
+
+################################################################################################
+# File placement
+################################################################################################
+def same_filesystem(src, dst):
+    """Checks whether a destination path would be on the same filesystem (device) as a source path
+
+    :param src: Path to existing source file or directory
+    :type src: str
+    :param dst: Destination path (need not exist, its closest existing parent directory is checked)
+    :type dst: str
+    :return: True if both paths are on the same device
+    :rtype: bool
+    """
+    parent = os.path.dirname(os.path.abspath(dst))
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    return(os.stat(src).st_dev == os.stat(parent).st_dev)
+
+def reflink_file(src, dst):
+    """Creates a copy-on-write clone of a file, erroring with OSError if the platform or filesystem does not support it
+
+    :param src: Path to source file
+    :type src: str
+    :param dst: Path to destination file (must not exist)
+    :type dst: str
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(src, 'rb') as src_f, open(dst, 'xb') as dst_f:
+        try:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        except OSError:
+            dst_f.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def link_file(src, dst):
+    """Places a file at dst as a reflink if possible, otherwise as a hardlink, falling back to copying
+
+    :param src: Path to source file
+    :type src: str
+    :param dst: Path to destination file (must not exist)
+    :type dst: str
+    :return: How the file was placed, one of "reflink", "hardlink", or "copy"
+    :rtype: str
+    """
+    try:
+        reflink_file(src, dst)
+        return("reflink")
+    except OSError:
+        pass
+    try:
+        os.link(src, dst)
+        return("hardlink")
+    except OSError:
+        shutil.copy2(src, dst)
+        return("copy")
+
+def link_tree(src, dst):
+    """Places a directory tree at dst with every file reflinked or hardlinked (see link_file)
+
+    :param src: Path to source directory
+    :type src: str
+    :param dst: Path to destination directory (must not exist)
+    :type dst: str
+    :return: Dictionary of placement method : number of files pairs
+    :rtype: dict
+    """
+    methods = {}
+    def place(s, d):
+        method = link_file(s, d)
+        methods[method] = methods.get(method, 0) + 1
+    shutil.copytree(src, dst, copy_function = place)
+    return(methods)
+
+################################################################################################
+# Transfer engine
+################################################################################################
+class TransferJournal:
+    """Record of the verified chunks of an unfinished transfer, kept next to the destination so an interrupted transfer can be resumed.
+    A journal only applies to the source file listing (paths, sizes, and modification times) and chunk size it was created for
+
+    :param journal_file: Path to journal .json file
+    :type journal_file: str
+    :param source: Path to transfer source
+    :type source: str
+    :param files: Source file listing (see autonoms.utils_cache.list_tree)
+    :type files: list
+    :param chunk_bytes: Chunk size of the transfer
+    :type chunk_bytes: int
+    """
+    def __init__(self, journal_file, source, files, chunk_bytes):
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.data = {"source" : source, "files" : [list(x) for x in files], "chunk_bytes" : chunk_bytes, "chunks" : {}}
+        self.resumed = False
+        try:
+            with open(journal_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if all(data.get(k) == self.data[k] for k in ["source", "files", "chunk_bytes"]):
+            self.data = data
+            self.resumed = True
+
+    def digest(self, rel_name, i_chunk):
+        with self.lock:
+            return(self.data["chunks"].get(rel_name, {}).get(str(i_chunk)))
+
+    def mark(self, rel_name, i_chunk, digest):
+        """Records a copied and verified chunk and rewrites the journal file
+
+        :param rel_name: Relative path of the file in the transfer
+        :type rel_name: str
+        :param i_chunk: Chunk index
+        :type i_chunk: int
+        :param digest: sha256 hex digest of the chunk
+        :type digest: str
+        """
+        with self.lock:
+            self.data["chunks"].setdefault(rel_name, {})[str(i_chunk)] = digest
+            temp_file = f"{self.journal_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(temp_file, self.journal_file)
+
+    def remove(self):
+        remove_path(self.journal_file)
+
+TransferStats = namedtuple("TransferStats", ["src", "dst", "files", "total_bytes", "copied_bytes", "resumed_bytes", "seconds", "complete"])
+
+class TransferEngine:
+    """Copies files and directory trees (e.g. between the RapidFire and 6560 computers over the shared drive) with several threads. Files are copied 
+    in chunks into a partial destination (dst + ".partial"), every chunk is verified by comparing the sha256 of the written data with that of the 
+    source data and recorded in a journal (dst + ".transfer.json"), and the finished copy is published by renaming it to dst. An interrupted or 
+    failed transfer leaves no data at dst; repeating it resumes from the verified chunks of the journal
+
+    :param max_workers: Number of copying threads per transfer, defaults to 4
+    :type max_workers: int, optional
+    :param chunk_bytes: Size of the chunks in which files are copied, defaults to 64 MiB
+    :type chunk_bytes: int, optional
+    :param verify: Re-read and checksum every written chunk, defaults to True
+    :type verify: bool, optional
+    :param retries: Number of times a failed chunk is retried before the transfer fails, defaults to 3
+    :type retries: int, optional
+    :param buffer_bytes: Size of individual reads and writes, defaults to 1 MiB
+    :type buffer_bytes: int, optional
+    """
+    def __init__(self, max_workers = 4, chunk_bytes = 64 << 20, verify = True, retries = 3, buffer_bytes = 1 << 20):
+        self.max_workers = max(int(max_workers), 1)
+        self.chunk_bytes = int(chunk_bytes)
+        self.verify = verify
+        self.retries = retries
+        self.buffer_bytes = buffer_bytes
+        self.lock = threading.Lock()
+        self.history = []
+
+    def hash_range(self, path, offset, length):
+        """Computes the sha256 of a byte range of a file
+
+        :return: Hex digest
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                buffer = f.read(min(self.buffer_bytes, remaining))
+                if not buffer:
+                    break
+                h.update(buffer)
+                remaining -= len(buffer)
+        return(h.hexdigest())
+
+    def copy_range(self, src_file, dst_file, offset, length):
+        """Copies a byte range between two existing files
+
+        :return: sha256 hex digest of the copied source data
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        with open(src_file, 'rb') as src_f, open(dst_file, 'r+b') as dst_f:
+            src_f.seek(offset)
+            dst_f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                buffer = src_f.read(min(self.buffer_bytes, remaining))
+                if not buffer:
+                    raise OSError(f"{src_file} ended before byte {offset + length}")
+                h.update(buffer)
+                dst_f.write(buffer)
+                remaining -= len(buffer)
+            if not self.verify:
+                # Unverified chunks are trusted when resuming, so they must be on disk before they are journaled
+                dst_f.flush()
+                os.fsync(dst_f.fileno())
+        return(h.hexdigest())
+
+    def _transfer_chunk(self, journal, rel_name, src_file, dst_file, i_chunk, offset, length, cancel_event):
+        # Returns (copied bytes, resumed bytes) for one chunk
+        if cancel_event is not None and cancel_event.is_set():
+            return((0, 0))
+        digest = journal.digest(rel_name, i_chunk)
+        if digest is not None and (not self.verify or self.hash_range(dst_file, offset, length) == digest):
+            return((0, length))
+        for i_try in range(self.retries + 1):
+            try:
+                digest = self.copy_range(src_file, dst_file, offset, length)
+                if self.verify and self.hash_range(dst_file, offset, length) != digest:
+                    raise OSError(f"checksum mismatch in {dst_file} at byte {offset}")
+                journal.mark(rel_name, i_chunk, digest)
+                return((length, 0))
+            except OSError as e:
+                if i_try == self.retries:
+                    raise
+                print(f"Warning - copying {src_file} at byte {offset} failed ({e}), retrying")
+                time.sleep(min(2 ** i_try, 30))
+
+    def transfer(self, src, dst, overwrite = True, cancel_event = None):
+        """Copies a file or directory tree to dst, resuming a previous interrupted transfer between the same paths
+
+        :param src: Path to source file or directory
+        :type src: str
+        :param dst: Path to destination
+        :type dst: str
+        :param overwrite: Replace an existing dst, defaults to True
+        :type overwrite: bool, optional
+        :param cancel_event: If provided, `threading.Event` which stops the transfer (keeping its journal for resuming) when set, defaults to None
+        :type cancel_event: `threading.Event`, optional
+        :return: Transfer statistics (complete is False if the transfer was cancelled)
+        :rtype: `TransferStats`
+        """
+        src, dst = os.path.abspath(src), os.path.abspath(dst)
+        if os.path.lexists(dst) and not overwrite:
+            sys.exit(f"Error - {dst} exists, please set overwrite = True to overwrite")
+        partial, journal_file = f"{dst}.partial", f"{dst}.transfer.json"
+        start = time.time()
+        files = list_tree(src)
+        journal = TransferJournal(journal_file, src, files, self.chunk_bytes)
+        if not journal.resumed:
+            remove_path(partial)
+        if os.path.isdir(src):
+            for root, dirs, _ in os.walk(src):
+                os.makedirs(os.path.join(partial, os.path.relpath(root, src)), exist_ok = True)
+        else:
+            os.makedirs(os.path.dirname(partial), exist_ok = True)
+        chunks = []
+        for rel_name, size, _ in files:
+            src_file = os.path.join(src, rel_name) if rel_name else src
+            dst_file = os.path.join(partial, rel_name) if rel_name else partial
+            with open(dst_file, 'r+b' if os.path.isfile(dst_file) else 'wb') as f:
+                f.truncate(size)
+            chunks.extend((rel_name, src_file, dst_file, i, offset, min(self.chunk_bytes, size - offset)) 
+                          for i, offset in enumerate(range(0, size, self.chunk_bytes)))
+        with get_tracer().span("transfer", category = "io", **path_labels(dst)):
+            with ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+                futures = [pool.submit(self._transfer_chunk, journal, *x, cancel_event) for x in chunks]
+                try:
+                    results = [x.result() for x in futures]
+                except OSError as e:
+                    sys.exit(f"Error - transfer of {src} to {dst} failed ({e}), repeat the transfer to resume it")
+            complete = cancel_event is None or not cancel_event.is_set()
+            if complete:
+                if list_tree(src) != files:
+                    journal.remove()
+                    sys.exit(f"Error - {src} changed during its transfer to {dst}")
+                for rel_name, _, _ in files:
+                    shutil.copystat(os.path.join(src, rel_name) if rel_name else src, os.path.join(partial, rel_name) if rel_name else partial)
+                remove_path(dst)
+                os.replace(partial, dst)
+                journal.remove()
+        seconds = time.time() - start
+        stats = TransferStats(src, dst, len(files), sum(x[1] for x in files), sum(x[0] for x in results), sum(x[1] for x in results), seconds, complete)
+        with self.lock:
+            self.history.append(stats)
+        print(f"{'Transferred' if complete else 'Stopped transfer of'} {src} to {dst}: {stats.files} files, {stats.total_bytes / 1024 ** 2:.1f} MB "
+              f"({stats.resumed_bytes / 1024 ** 2:.1f} MB resumed) in {seconds:.1f} seconds ({stats.copied_bytes / 1024 ** 2 / max(seconds, 1e-6):.1f} MB/s)")
+        return(stats)
+
+    def move(self, src, dst, overwrite = True):
+        """Moves a file or directory tree to dst, renaming it if both are on the same filesystem and otherwise transferring it and removing the source
+
+        :param src: Path to source file or directory
+        :type src: str
+        :param dst: Path to destination
+        :type dst: str
+        :param overwrite: Replace an existing dst, defaults to True
+        :type overwrite: bool, optional
+        :return: Transfer statistics, None if src was renamed
+        :rtype: `TransferStats`
+        """
+        if os.path.lexists(dst) and not overwrite:
+            sys.exit(f"Error - {dst} exists, please set overwrite = True to overwrite")
+        if same_filesystem(src, dst):
+            remove_path(dst)
+            os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok = True)
+            os.replace(src, dst)
+            return(None)
+        stats = self.transfer(src, dst, overwrite = overwrite)
+        remove_path(src)
+        return(stats)
+
+    def summary(self):
+        """Totals of the finished transfers
+
+        :return: Dictionary with the number of transfers and files, total, copied, and resumed bytes, seconds, and copy throughput in MB/s
+        :rtype: dict
+        """
+        with self.lock:
+            history = list(self.history)
+        out_stats = {"transfers" : len(history)}
+        for k in ["files", "total_bytes", "copied_bytes", "resumed_bytes", "seconds"]:
+            out_stats[k] = sum(getattr(x, k) for x in history)
+        out_stats["mb_per_second"] = out_stats["copied_bytes"] / 1024 ** 2 / out_stats["seconds"] if out_stats["seconds"] else 0.0
+        return(out_stats)
+
+    def write_stats(self, out_file):
+        """Writes the transfer totals and the statistics of every transfer to a .json file
+
+        :param out_file: Path to output .json file
+        :type out_file: str
+        """
+        with self.lock:
+            transfers = [x._asdict() for x in self.history]
+        os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok = True)
+        with open(out_file, 'w') as f:
+            json.dump({"summary" : self.summary(), "transfers" : transfers}, f, indent = 1)
+
+################################################################################################
+# Shared transfer engine
+################################################################################################
+_transfer_engine = None
+_transfer_engine_lock = threading.Lock()
+
+def configure_transfer_engine(**kwargs):
+    """Replaces the shared transfer engine with one built from the given TransferEngine arguments
+
+    :return: The new shared transfer engine
+    :rtype: `TransferEngine`
+    """
+    global _transfer_engine
+    with _transfer_engine_lock:
+        _transfer_engine = TransferEngine(**kwargs)
+    return(_transfer_engine)
+
+def get_transfer_engine():
+    """Gets the shared transfer engine, creating one with default settings if none was configured
+
+    :return: The shared transfer engine
+    :rtype: `TransferEngine`
+    """
+    global _transfer_engine
+    with _transfer_engine_lock:
+        if _transfer_engine is None:
+            _transfer_engine = TransferEngine()
+        return(_transfer_engine)
+
+################################################################################################
+# Reference files
+################################################################################################
+def reference_file(path):
+    """Path to the reference file placed instead of a data tree with the reference strategy
+
+    :param path: Placement destination path
+    :type path: str
+    :return: Path to reference .json file
+    :rtype: str
+    """
+    return(f"{path}{REFERENCE_SUFFIX}")
+
+def write_reference(src, dst):
+    """Records the location and file listing of a source tree in a reference file next to dst instead of placing any data
+
+    :param src: Path to source file or directory
+    :type src: str
+    :param dst: Placement destination path
+    :type dst: str
+    :return: Path to written reference file
+    :rtype: str
+    """
+    out_file = reference_file(dst)
+    reference = {"source" : os.path.abspath(src), "created" : time.time(), "files" : list_tree(src)}
+    temp_file = f"{out_file}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(reference, f, indent = 1)
+    os.replace(temp_file, out_file)
+    return(out_file)
+
+def resolve_placed(path):
+    """Resolves a placed data path to the location of its data. A path placed with the reference strategy resolves to the referenced source,
+    erroring if the source no longer matches its recorded file listing
+
+    :param path: Placement destination path
+    :type path: str
+    :return: Path to the data (path itself unless it was placed as a reference)
+    :rtype: str
+    """
+    if os.path.exists(path) or not os.path.exists(reference_file(path)):
+        return(path)
+    with open(reference_file(path), 'r') as f:
+        reference = json.load(f)
+    source = reference["source"]
+    if not os.path.exists(source) or [list(x) for x in list_tree(source)] != reference["files"]:
+        sys.exit(f"Error - data referenced by {reference_file(path)} at {source} is missing or has changed")
+    return(source)
+
+################################################################################################
+# Placement
+################################################################################################
+def place_tree(src, dst, strategy = "auto"):
+    """Places a raw data file or directory tree at dst, replacing any previous placement
+
+    Strategies:
+        * link - reflink or hardlink every file (see link_file), copying files which cannot be linked
+        * reference - write a reference file (dst + REFERENCE_SUFFIX) recording the source location instead of placing data (see resolve_placed)
+        * copy - plain recursive copy
+        * parallel_copy - verified multithreaded copy with the shared transfer engine (see TransferEngine)
+        * auto - link if src and dst are on the same filesystem, parallel_copy otherwise, so dst always holds an independent copy of the data
+
+    :param src: Path to source file or directory
+    :type src: str
+    :param dst: Destination path
+    :type dst: str
+    :param strategy: Placement strategy (one of PLACEMENT_STRATEGIES), defaults to "auto"
+    :type strategy: str, optional
+    :return: Path to the placed data (dst, or the reference file for the reference strategy)
+    :rtype: str
+    """
+    if strategy not in PLACEMENT_STRATEGIES:
+        sys.exit(f"Error - unknown raw data placement strategy {strategy}, must be one of {PLACEMENT_STRATEGIES}")
+    if strategy == "auto":
+        strategy = "link" if same_filesystem(src, dst) else "parallel_copy"
+    remove_path(dst)
+    remove_path(reference_file(dst))
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok = True)
+    start = time.time()
+    placed = dst
+    if strategy == "reference":
+        placed = write_reference(src, dst)
+        details = f"reference to {src}"
+    elif strategy == "link":
+        if os.path.isdir(src):
+            methods = link_tree(src, dst)
+        else:
+            methods = {link_file(src, dst) : 1}
+        details = ", ".join(f"{n} {method}" for method, n in sorted(methods.items()))
+    elif strategy == "parallel_copy":
+        stats = get_transfer_engine().transfer(src, dst)
+        details = f"{stats.total_bytes / 1024 ** 2:.1f} MB copied"
+    elif os.path.isdir(src):
+        shutil.copytree(src, dst)
+        details = "copied"
+    else:
+        shutil.copy2(src, dst)
+        details = "copied"
+    print(f"Placed {src} at {placed} ({strategy}: {details}) in {time.time() - start:.1f} seconds")
+    return(placed)
@@ -0,0 +1,188 @@
+################################################################################################
+# gk@reder.io
+################################################################################################
+# Polling waits for instrument state changes. A wait checks its condition immediately and then
+# with intervals growing from a short first interval (so fast transitions are picked up with
+# little dead time) up to a maximum interval (so long waits do not poll the instrument UI more
+# than needed). Every wait is recorded with the shared tracer and in the shared wait statistics.
+################################################################################################
+import os
+import sys
+import json
+import time
+import inspect
+import threading
+from autonoms.utils_trace import get_tracer
+################################################################################################
+
+class WaitTimeoutError(TimeoutError):
+    """Raised when a wait does not reach its condition within its timeout
+
+    :param description: Description of the awaited condition
+    :type description: str
+    :param timeout_seconds: Timeout of the wait
+    :type timeout_seconds: float
+    :param elapsed_seconds: Seconds waited
+    :type elapsed_seconds: float
+    """
+    def __init__(self, description, timeout_seconds, elapsed_seconds):
+        self.description = description
+        self.timeout_seconds = timeout_seconds
+        self.elapsed_seconds = elapsed_seconds
+        super().__init__(f"Timed out after {elapsed_seconds:.1f} seconds (timeout {timeout_seconds} seconds) waiting for {description}")
+
+class WaitStats:
+    """Thread-safe statistics of finished waits (number, outcome, polls, and total and maximum wait times) by description
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, description, outcome, elapsed_seconds, polls):
+        """Records a finished wait
+
+        :param description: Description of the awaited condition
+        :type description: str
+        :param outcome: One of "met", "aborted", or "timeout"
+        :type outcome: str
+        :param elapsed_seconds: Seconds waited
+        :type elapsed_seconds: float
+        :param polls: Number of times the condition was checked
+        :type polls: int
+        """
+        with self.lock:
+            d = self.stats.setdefault(description, {"waits" : 0, "met" : 0, "aborted" : 0, "timeout" : 0, "polls" : 0,
+                                                    "total_seconds" : 0.0, "max_seconds" : 0.0})
+            d["waits"] += 1
+            d[outcome] += 1
+            d["polls"] += polls
+            d["total_seconds"] += elapsed_seconds
+            d["max_seconds"] = max(d["max_seconds"], elapsed_seconds)
+
+    def summary(self):
+        with self.lock:
+            return({k : dict(v) for k, v in self.stats.items()})
+
+    def write(self, out_file):
+        """Writes the wait statistics to a .json file
+
+        :param out_file: Path to output .json file
+        :type out_file: str
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok = True)
+        with open(out_file, 'w') as f:
+            json.dump(self.summary(), f, indent = 1)
+
+_wait_stats = WaitStats()
+
+def get_wait_stats():
+    """Gets the shared wait statistics
+
+    :return: The shared wait statistics
+    :rtype: `WaitStats`
+    """
+    return(_wait_stats)
+
+class _Wait:
+    # Shared bookkeeping of wait_until and wait_until_async
+    def __init__(self, description, timeout_seconds, initial_seconds, max_interval_seconds, backoff):
+        self.description = description
+        self.timeout_seconds = timeout_seconds
+        self.interval = initial_seconds
+        self.max_interval_seconds = max_interval_seconds
+        self.backoff = backoff
+        self.start = time.time()
+        self.polls = 0
+
+    def next_sleep(self):
+        # Seconds to sleep before the next check, None once the timeout has passed
+        elapsed = time.time() - self.start
+        if self.timeout_seconds is not None and elapsed >= self.timeout_seconds:
+            return(None)
+        sleep_seconds = self.interval
+        if self.timeout_seconds is not None:
+            sleep_seconds = min(sleep_seconds, self.timeout_seconds - elapsed)
+        self.interval = min(self.interval * self.backoff, self.max_interval_seconds)
+        return(sleep_seconds)
+
+    def finish(self, outcome):
+        end = time.time()
+        get_wait_stats().record(self.description, outcome, end - self.start, self.polls)
+        get_tracer().record(f"wait {self.description}", self.start, end, lane = "instrument", category = "wait",
+                            labels = {**get_tracer().current_labels(), "outcome" : outcome, "polls" : self.polls})
+        if outcome == "timeout":
+            raise WaitTimeoutError(self.description, self.timeout_seconds, end - self.start)
+
+def wait_until(predicate, timeout_seconds, description = "condition", abort = None, initial_seconds = 0.05, max_interval_seconds = 1, backoff = 1.5):
+    """Waits for a condition. The condition is checked immediately and then with intervals growing by the factor backoff from initial_seconds
+    up to max_interval_seconds
+
+    :param predicate: Function checking the condition, the wait ends once it returns a truthy value
+    :type predicate: function
+    :param timeout_seconds: Seconds to wait before raising WaitTimeoutError (None waits indefinitely)
+    :type timeout_seconds: float
+    :param description: Description of the condition for statistics, traces, and errors, defaults to "condition"
+    :type description: str, optional
+    :param abort: If provided, function checked before the condition, the wait ends early (returning None) once it returns a truthy value, defaults to None
+    :type abort: function, optional
+    :param initial_seconds: First interval between checks, defaults to 0.05
+    :type initial_seconds: float, optional
+    :param max_interval_seconds: Maximum interval between checks, defaults to 1
+    :type max_interval_seconds: float, optional
+    :param backoff: Factor by which the interval grows after every check, defaults to 1.5
+    :type backoff: float, optional
+    :return: Value returned by predicate, None if the wait was aborted
+    :rtype: object
+    """
+    wait = _Wait(description, timeout_seconds, initial_seconds, max_interval_seconds, backoff)
+    while True:
+        if abort is not None and abort():
+            wait.finish("aborted")
+            return(None)
+        wait.polls += 1
+        value = predicate()
+        if value:
+            wait.finish("met")
+            return(value)
+        sleep_seconds = wait.next_sleep()
+        if sleep_seconds is None:
+            wait.finish("timeout")
+        time.sleep(sleep_seconds)
+
+async def wait_until_async(predicate, timeout_seconds, description = "condition", abort = None, initial_seconds = 0.05, max_interval_seconds = 1, backoff = 1.5):
+    """asyncio version of wait_until, sleeping with asyncio.sleep. predicate and abort may be plain functions or coroutine functions
+
+    :return: Value returned by predicate, None if the wait was aborted
+    :rtype: object
+    """
+    import asyncio
+    async def call(function):
+        value = function()
+        if inspect.isawaitable(value):
+            value = await value
+        return(value)
+    wait = _Wait(description, timeout_seconds, initial_seconds, max_interval_seconds, backoff)
+    while True:
+        if abort is not None and await call(abort):
+            wait.finish("aborted")
+            return(None)
+        wait.polls += 1
+        value = await call(predicate)
+        if value:
+            wait.finish("met")
+            return(value)
+        sleep_seconds = wait.next_sleep()
+        if sleep_seconds is None:
+            wait.finish("timeout")
+        await asyncio.sleep(sleep_seconds)
+
+def wait_or_exit(predicate, timeout_seconds, description = "condition", **kwargs):
+    """Runs wait_until, exiting with an error message on timeout as the workflow functions do for other errors
+
+    :return: Value returned by predicate, None if the wait was aborted
+    :rtype: object
+    """
+    try:
+        return(wait_until(predicate, timeout_seconds, description = description, **kwargs))
+    except WaitTimeoutError as e:
+        sys.exit(f"Error - {e}")
@@ -2,56 +2,91 @@
 # gk@reder.io
 ################################################################################################
 import os
-import glob
-import toml
+import time
 import shutil
-import rpyc
 import sys
-import subprocess
-import pandas as pd
-import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from prefect import flow, task, Flow, Task
 from prefect.client import get_client
-from prefect.task_runners import SequentialTaskRunner
+from prefect.task_runners import SequentialTaskRunner, ConcurrentTaskRunner
 import autonoms.agilent_methods.utils_plates as pu
 import autonoms.agilent_methods.utils_6560 as msu
 import autonoms.agilent_methods.utils_rapidFire as rfu
-from autonoms.agilent_methods.splitterExtract import get_splits
+from autonoms.agilent_methods.splitterExtract import get_splits, get_sequence_d_file
 from autonoms.agilent_methods.CCSCal import ccs_cal
+from autonoms.utils_cache import ArtifactCache, remove_path
+from autonoms.utils_manifest import RunManifest
+from autonoms.utils_transfer import place_tree, configure_transfer_engine, get_transfer_engine
+from autonoms.utils_exec import configure_executor, get_executor
+from autonoms.utils_experiment import load_experiment
+from autonoms.utils_rpyc import configure_connection_pool
+from autonoms.agilent_methods.rf_jobs import RemoteJob
+from autonoms.agilent_methods.instrument_simulation import configure_simulation, get_simulation
+from autonoms.utils_trace import get_tracer, traced, path_labels
+from autonoms.utils_wait import wait_or_exit, get_wait_stats
 ################################################################################################
 # Prefect Tasks
 ################################################################################################
+def job_log_dir(data_file):
+    """Gets the directory for external tool logs of a data file in a sequence (the logs directory of the sequence directory)
+
+    :param data_file: Path to a data file in a subdirectory (e.g. injections) of a sequence directory
+    :type data_file: str
+    :return: Path to log directory
+    :rtype: str
+    """
+    return(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(data_file))), "logs"))
+
+def job_succeeded(result, out_path):
+    """Checks that an external tool job finished without error and wrote its output, i.e. that the output may be stored in the artifact cache
+
+    :param result: Job result
+    :type result: `autonoms.utils_exec.JobResult`
+    :param out_path: Path to the output file or directory of the job
+    :type out_path: str
+    :return: True if the job returned 0 within its timeout and out_path exists
+    :rtype: bool
+    """
+    return(result.returncode == 0 and not result.timed_out and os.path.exists(out_path))
+
+def rf_call_labels(arguments):
+    """Gets trace labels for an rf_call task run from its arguments
+
+    :param arguments: Dictionary of rf_call arguments
+    :type arguments: dict
+    :return: Dictionary of labels
+    :rtype: dict
+    """
+    labels = {"function" : arguments["rf_function"]}
+    if arguments["kwargs"].get("rfbat_file"):
+        labels.update(path_labels(arguments["kwargs"]["rfbat_file"]))
+    return(labels)
+
 @task
-def create_rf_sequences(input_excel_file, output_dir):
+@traced()
+def create_rf_sequences(input_excel_file, output_dir, max_workers = 1):
     """Creates instrument files and output directories given experiment definition file
 
-    :param input_excel_file: Input .xlsx file following experiment definition template
-    :type input_excel_file: str
+    :param input_excel_file: Experiment definition or input .xlsx file following experiment definition template
+    :type input_excel_file: `autonoms.utils_experiment.Experiment` or str
     :param output_dir: Desired top output directory
     :type output_dir: str
+    :param max_workers: Number of sequences whose instrument files are written in parallel, defaults to 1
+    :type max_workers: int, optional
     :return: A list of tuples where each tuple corresponds to a sequence in the original input_excel_file
     :rtype: list
     """
-    sequence_files = pu.create_sequences(input_excel_file, output_dir)
+    # Instrument files are written directly into the sequence directories
+    sequence_files = pu.create_sequences(input_excel_file, output_dir, sequence_subdirs = True, max_workers = max_workers)
     out_files = []
-    rfbat_files = []
-    sequence_dirs = []
     for sequence_name, rfbat_filename, rfmap_filename, rfcfg_filename in sequence_files:
         sequence_dir = os.path.join(output_dir, sequence_name)
-        os.makedirs(sequence_dir, exist_ok = True)
-        for fname in [rfbat_filename, rfmap_filename, rfcfg_filename]:
-            bname = os.path.basename(fname)
-            oname = os.path.join(sequence_dir, bname)
-            os.replace(fname, oname)
-        rfbat_filename_full = os.path.join(sequence_dir, os.path.basename(rfbat_filename)) 
-        rfcfg_filename_full = os.path.join(sequence_dir, os.path.basename(rfcfg_filename)) 
-        rfmap_filename_full = os.path.join(sequence_dir, os.path.basename(rfmap_filename)) 
-        rfbat_files.append(rfbat_filename_full)
-        sequence_dirs.append(sequence_dir)
-        out_files.append((sequence_dir, rfbat_filename_full, rfcfg_filename_full, rfmap_filename_full))
+        out_files.append((sequence_dir, rfbat_filename, rfcfg_filename, rfmap_filename))
     return(out_files)
 
 @task(name = "run_6560_calibrant", tags = ["instrument_run"])
+@traced(lane = "instrument", labels = lambda x : path_labels(x["seq_files_tuple"][0]))
 def run_6560_calibrant(seq_files_tuple, test = False):
     """Runs a Calibrant line (bottle B) run on the 6560 and saves the output
 
@@ -67,7 +102,10 @@ def run_6560_calibrant(seq_files_tuple, test = False):
     rfbat_file = seq_files_tuple[1]
     output_calibration_file = os.path.join(sequence_dir, f"{sequence_name}_IM_calibration.d")
     ms_cal_method = pu.get_cal_method_rfbat(rfbat_file)
-    if not test:
+    simulation = get_simulation()
+    if simulation is not None:
+        simulation.mass_hunter.run_calibration_B(ms_cal_method, output_calibration_file)
+    elif not test:
         mh_app, mh_window = msu.initialize_app()
         msu.run_calibration_B(ms_cal_method, output_calibration_file, manual_stop = True)
     else:
@@ -76,9 +114,28 @@ def run_6560_calibrant(seq_files_tuple, test = False):
     return(output_calibration_file)
  
 
+def pnnl_output_file(out_dir, d_file):
+    """Identifies the demultiplexed .d file written by PNNL Preprocessor for an input .d file. The output is named after the input 
+    (<name>.DeMP.d, or <name>.d for some versions) and must be the only such .d file in out_dir
+
+    :param out_dir: PNNL Preprocessor output directory
+    :type out_dir: str
+    :param d_file: Path to input multiplexed .d file
+    :type d_file: str
+    :return: Path to demultiplexed .d file
+    :rtype: str
+    """
+    d_file_stem = os.path.splitext(os.path.basename(d_file))[0].lower()
+    candidates = [x for x in os.listdir(out_dir) if x.lower() in [f"{d_file_stem}.demp.d", f"{d_file_stem}.d"]]
+    if len(candidates) != 1:
+        sys.exit(f"Error - expected one PNNL Preprocessor output for {d_file} in {out_dir}, found {sorted(os.listdir(out_dir))}")
+    return(os.path.join(out_dir, candidates[0]))
+
 @task(tags = ['postprocessing'])
-def demultiplex(d_file, pnnl_exe_path, overwrite = True, test = False, demux_MA = 3, demux_mInt = 20, demux_min_percent = 97):
-    """Runs IM-MS .d file demultiplexing using PNNL Preprocessor
+@traced(labels = "d_file")
+def demultiplex(d_file, pnnl_exe_path, overwrite = True, test = False, demux_MA = 3, demux_mInt = 20, demux_min_percent = 97, cache = None, scratch_dir = None):
+    """Runs IM-MS .d file demultiplexing using PNNL Preprocessor. PNNL Preprocessor writes into a uniquely named directory in scratch_dir 
+    and its output is then published next to the input .d file in a single step (see autonoms.utils_transfer.TransferEngine.move)
     
     :param d_file: Path to input multiplexed .d file
     :type d_file: str
@@ -94,43 +151,46 @@ def demultiplex(d_file, pnnl_exe_path, overwrite = True, test = False, demux_MA
     :type demux_mInt: int, optional
     :param demux_min_percent: Corresponds to PNNL -demuxSignal flag, minimum percentage of signal points required for inclusion in demultiplexed data (must be within range [50-100]), defaults to 97
     :type demux_min_percent: float, optional
+    :param cache: If provided, artifact cache to look up and store the demultiplexed output in, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
+    :param scratch_dir: Directory (ideally on a fast local drive) in which PNNL Preprocessor writes its output, defaults to None (the directory of d_file)
+    :type scratch_dir: str, optional
     :return: Path to the resulting demultiplexed .d file
     :rtype: str
     """
-    d_file_prefix = os.path.basename(d_file).lower().replace(".d", "")
-    d_file_dir = os.path.dirname(d_file)
-    temp_out_dir = os.path.join(d_file_dir, f"{d_file_prefix}_temp_pnnl")
-    os.makedirs(temp_out_dir, exist_ok = True)
-    cmd = f'''{pnnl_exe_path} -demux=True -demuxMA={demux_MA} -demuxSignal={demux_min_percent} -mInt={demux_mInt} -frameComp=1 -compMode=Every -overwrite={overwrite} -out={temp_out_dir} -dataset="{d_file}"'''
-    cmd_subprocess = [f"{pnnl_exe_path}", "-demux=True", f"-demuxMA={demux_MA}", 
-                      f"-demuxSignal={demux_min_percent}", f"-mInt={demux_mInt}", "-frameComp=1",
-                      "-compMode=Every", f"-overwrite={overwrite}", f"-out={temp_out_dir}", f'-dataset={d_file}']
-    print(f"demultiplexing {d_file}")
-    print(cmd_subprocess)
+    d_file_prefix = os.path.splitext(os.path.basename(d_file))[0]
     opref = os.path.splitext(d_file)[0]
     oname_final = opref + "_demultiplexed.d"
+    print(f"demultiplexing {d_file}")
     if test:
         print('testing...not running command')
         return(oname_final)
-    subprocess.run(cmd_subprocess)
-    pnnl_out_files = glob.glob(os.path.join(temp_out_dir, "*.d"))
-    newest_pnnl_file = max(pnnl_out_files, key = os.path.getmtime)
-    oname = os.path.join(d_file_dir, os.path.basename(newest_pnnl_file))
-    for fname in [oname, oname_final]:
-        if os.path.exists(fname):
-            if overwrite:
-                shutil.rmtree(fname)
-            else:
-                sys.exist(f"Erorr - the file {fname} exists, please set ovewrite = True to force overwrite")    
-    shutil.move(newest_pnnl_file, oname)
-    shutil.rmtree(temp_out_dir)
-    if os.path.exists(oname_final):
-        shutil.rmtree(oname_final)
-    os.rename(oname, oname_final)
+    if os.path.exists(oname_final) and not overwrite:
+        sys.exit(f"Error - the file {oname_final} exists, please set overwrite = True to force overwrite")
+    if cache:
+        cache_key = cache.make_key("demultiplex", [d_file], {"demux_MA" : demux_MA, "demux_mInt" : demux_mInt, "demux_min_percent" : demux_min_percent,
+                                                            "pnnl_exe" : os.path.basename(pnnl_exe_path)})
+        if cache.get(cache_key, oname_final):
+            return(oname_final)
+    scratch_dir = scratch_dir or os.path.dirname(os.path.abspath(d_file))
+    os.makedirs(scratch_dir, exist_ok = True)
+    temp_out_dir = tempfile.mkdtemp(prefix = f"{d_file_prefix}_pnnl_", dir = scratch_dir)
+    try:
+        cmd_subprocess = [f"{pnnl_exe_path}", "-demux=True", f"-demuxMA={demux_MA}", 
+                          f"-demuxSignal={demux_min_percent}", f"-mInt={demux_mInt}", "-frameComp=1",
+                          "-compMode=Every", f"-overwrite={overwrite}", f"-out={temp_out_dir}", f'-dataset={d_file}']
+        print(cmd_subprocess)
+        result = get_executor().run("pnnl_preprocessor", cmd_subprocess, job_name = f"{d_file_prefix}_demultiplex", log_dir = job_log_dir(d_file))
+        get_transfer_engine().move(pnnl_output_file(temp_out_dir, d_file), oname_final, overwrite = overwrite)
+    finally:
+        remove_path(temp_out_dir)
+    if cache and job_succeeded(result, oname_final):
+        cache.put(cache_key, "demultiplex", artifact_path = oname_final)
     return(oname_final)
 
 @task(tags = ['postprocessing'])
-def ccs_calibration(mzml_file, d_file, tuneIons_file):
+@traced(labels = "d_file")
+def ccs_calibration(mzml_file, d_file, tuneIons_file, cache = None):
     """Run CCS calibration given input standards ion file (.mzML), data file (.d), and known CCS values of standards
 
     :param mzml_file: Path to .mzML IM-MS file containing standards to calibrate with
@@ -139,19 +199,34 @@ def ccs_calibration(mzml_file, d_file, tuneIons_file):
     :type d_file: str
     :param tuneIons_file: Path to .csv file containing standards' m/z values and CCS values
     :type tuneIons_file: str
+    :param cache: If provided, artifact cache to look up and store the calibration in, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
     :return: The string content of the xml IM-MS CCS calibration file required for .d file calibration
     :rtype: str
     """
     print(f"Running CCS calibration on file {mzml_file} with output file {d_file}")
     print(f"tune ions file is {tuneIons_file}")
-    ccs_override_string = ccs_cal(mzml_file, tuneIons_file)
+    cache_meta = None
+    if cache:
+        cache_key = cache.make_key("ccs_calibration", [mzml_file, tuneIons_file], {})
+        cache_meta = cache.get(cache_key)
+    if cache_meta:
+        ccs_override_string = cache_meta["value"]
+    else:
+        ccs_override_string = ccs_cal(mzml_file, tuneIons_file)
+        if cache:
+            cache.put(cache_key, "ccs_calibration", value = ccs_override_string)
     print(f"Override String = {ccs_override_string}")
-    with open(os.path.join(d_file, "AcqData", 'OverrideImsCal.xml'), 'w') as f:
+    override_file = os.path.join(d_file, "AcqData", 'OverrideImsCal.xml')
+    # Never write through an existing file, it may be hardlinked to a cached artifact
+    remove_path(override_file)
+    with open(override_file, 'w') as f:
             print(ccs_override_string, file = f)
     return(ccs_override_string)
 
 
 @task(tags = ['postprocessing'])
+@traced(labels = "uncalibrated_d_file")
 def copy_ccs_calibration(uncalibrated_d_file, calibrated_d_file):
     """Copies the CCS calibration file from one .d file to another
     
@@ -163,47 +238,67 @@ def copy_ccs_calibration(uncalibrated_d_file, calibrated_d_file):
     print(f"Copying ccs calibration file from {calibrated_d_file} to {uncalibrated_d_file}")
     ccs_cal_file = os.path.join(calibrated_d_file, "AcqData", "OverrideImsCal.xml")
     copy_dir = os.path.join(uncalibrated_d_file, "AcqData")
+    remove_path(os.path.join(copy_dir, "OverrideImsCal.xml"))
     shutil.copy2(ccs_cal_file, copy_dir)
 
 @task(name = "rf_call", tags = ["instrument_run"])
+@traced(lane = "instrument", labels = rf_call_labels)
 def rf_call(rf_ip, rf_function, sync_timeout_request = 50000, rf_port = 18861, *args,  **kwargs):
     """Calls a function from the utils_rapidFire module using the rpyc server running on the RapidFire computer. 
-    Function is executed on the RapidFire computer itself. Function arguments are passed through *args and **kwargs
+    Function is executed on the RapidFire computer itself. Function arguments are passed through *args and **kwargs. The call is submitted
+    as a job to the RapidFire service (see autonoms.agilent_methods.rf_jobs) and polled until it finishes, so no connection is held open
+    while it runs. An event_callback keyword argument is called locally with the progress events of the job
 
     :param rf_ip: IP address of the RapidFire computer on the local network
     :type rf_ip: str
     :param rf_function: Name of function from utils_rapidFire to call. Function arguments passed through *args and **kwargs
     :type rf_function: str
-    :param sync_timeout_request: Timeout seconds for rpyc function passing, defaults to 50000
+    :param sync_timeout_request: Timeout seconds for the job to finish, defaults to 50000
     :type sync_timeout_request: float, optional
     :param rf_port: Port number on which the rpyc server is accessible, defaults to 18861 
     :type rf_port: int, optional
     :result: Result from function call
     :rtype: object
     """
-    rpyc_configs = {"sync_request_timeout" : sync_timeout_request}
-    connection = rpyc.connect(rf_ip, rf_port, config = rpyc_configs)
-    try:
-        rf_service = connection.root
-        result = rf_service.call_function(rf_function, *args, **kwargs)
-        return(result)
-    finally:
-        connection.close()  
+    event_callback = kwargs.pop("event_callback", None)
+    job = RemoteJob.submit(rf_ip, rf_port, rf_function, args = args, kwargs = kwargs, event_callback = event_callback)
+    print(f"Submitted {rf_function} to the RapidFire computer as job {job.job_id}")
+    result = job.wait(timeout_seconds = sync_timeout_request)
+    return(result)
  
+def report_rf_event(kind, minutes, well, message):
+    """Prints a batch.log event streamed from the RapidFire computer while a plate runs (see utils_rapidFire.LogFollower)
+
+    :param kind: Event kind, one of injection_started, injection_finished, error, batch_closed
+    :type kind: str
+    :param minutes: Minutes since the start of the batch
+    :type minutes: float
+    :param well: Injected well (None for error and batch_closed events)
+    :type well: str
+    :param message: batch.log message
+    :type message: str
+    """
+    print(rfu.format_batch_log_event(rfu.BatchLogEvent(kind, None, minutes, well, None, message)))
+
 @task
+@traced(lane = "instrument")
 def start_rf_ms_connection(start_mh_rf_path):
     """Ensures the 6560 and RapidFire are connected to each other for data acquisition using the Agilent connection executable
 
     :param start_mh_rf_path: Path to Agilent 6560-RF connection executable
     :type start_mh_rf_path: str
     """
+    if get_simulation() is not None:
+        print("Instruments are simulated, skipping mh_rf connection")
+        return
     print("Starting mh_rf connection...")
     print(start_mh_rf_path)
     print("")
-    subprocess.call([start_mh_rf_path], shell = True)
+    get_executor().run("start_mh_rf", [start_mh_rf_path], shell = True, check = False)
 
 @task(tags = ['postprocessing'])
-def split_d_file(split_tuple, raw_data_dir, out_dir, mh_splitter_exe):
+@traced(labels = lambda x : path_labels(x["split_tuple"][1]))
+def split_d_file(split_tuple, raw_data_dir, out_dir, mh_splitter_exe, cache = None):
     """Splits a .d file from an entire RF-6560 sequence run and produces a .d file correspoding to the specified injection times
 
     :param split_tuple: Tuple containing the basename of the sequence .d file, desired output .d file name, and start/end times
@@ -214,6 +309,8 @@ def split_d_file(split_tuple, raw_data_dir, out_dir, mh_splitter_exe):
     :type out_dir: str
     :param mh_splitter_exe: Path to Agilent file splitter utility executable
     :type mh_splitter_exe: str
+    :param cache: If provided, artifact cache to look up and store the split file in, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
     :return: Path to split .d file
     :rtype: str
     """
@@ -221,16 +318,23 @@ def split_d_file(split_tuple, raw_data_dir, out_dir, mh_splitter_exe):
     print(split_tuple)
     in_d_file = os.path.join(raw_data_dir, in_d_file_base)
     out_d_file = os.path.join(out_dir, out_d_file_base)
-    out_log_file = os.path.join(out_dir, "splitter_log.txt")
+    # One log per injection so that splits running in parallel don't write to the same file
+    out_log_file = os.path.join(out_dir, f"{os.path.splitext(out_d_file_base)[0]}_splitter_log.txt")
     arg_list = [mh_splitter_exe, in_d_file, out_d_file, f"{start_time}", f"{end_time}", "0", "0", out_log_file]
     print(arg_list)
-    # subprocess.run(arg_list)
-    res = subprocess.Popen(arg_list)
-    res.wait()
+    if cache:
+        cache_key = cache.make_key("split_d_file", [in_d_file], {"start_time" : start_time, "end_time" : end_time,
+                                                                 "mh_splitter_exe" : os.path.basename(mh_splitter_exe)})
+        if cache.get(cache_key, out_d_file):
+            return(out_d_file)
+    result = get_executor().run("mh_splitter", arg_list, job_name = f"{os.path.splitext(out_d_file_base)[0]}_split", log_dir = job_log_dir(out_d_file))
+    if cache and job_succeeded(result, out_d_file):
+        cache.put(cache_key, "split_d_file", artifact_path = out_d_file)
     return(out_d_file)
 
 @task(tags = ['postprocessing'])
-def msconvert(d_file, msconvert_exe):
+@traced(labels = "d_file")
+def msconvert(d_file, msconvert_exe, cache = None):
     """Splits a .d file from an entire RF-6560 sequence run and produces a .d file corresponding to the specified injection times
 
     :param split_tuple: Tuple containing the basename of the sequence .d file, desired output .d file name, and start/end times
@@ -248,10 +352,17 @@ def msconvert(d_file, msconvert_exe):
     out_file = os.path.splitext(d_file)[0] + ".mzML"
     arg_list = [msconvert_exe, d_file, "-o", out_dir]
     print(arg_list)
-    subprocess.call(arg_list)
+    if cache:
+        cache_key = cache.make_key("msconvert", [d_file], {"msconvert_exe" : os.path.basename(msconvert_exe)})
+        if cache.get(cache_key, out_file):
+            return(out_file)
+    result = get_executor().run("msconvert", arg_list, job_name = f"{os.path.splitext(os.path.basename(d_file))[0]}_msconvert", log_dir = job_log_dir(d_file))
+    if cache and job_succeeded(result, out_file):
+        cache.put(cache_key, "msconvert", artifact_path = out_file)
     return(out_file)
 
 @task
+@traced(labels = "fname")
 def rm_tree(fname):
     """Utility function for removing multiple files in parallel via Prefect
 
@@ -264,12 +375,12 @@ def rm_tree(fname):
     return(fname)
 
 @task
-def nearest_tune(df_sequence, well_file):
+def nearest_tune(sequence_injections, well_file):
     """In a given experimental sequence, assign each non-TUNE sample row to its nearest TUNE injection for the purposes of CCS calibration. 
     Currently, nearest TUNE must occur before a given injection and the first injection of every sequence must be a TUNE injection.
 
-    :param df_sequence: DataFrame corresponding to an experimental sequence
-    :type df_sequence: `pandas.core.frame.DataFrame`
+    :param sequence_injections: Injections of an experimental sequence
+    :type sequence_injections: list
     :param well_file: Dictionary containing pairs well : output-filename for each well in the experimental sequence
     :type well_file: dict
     :return: List of tuples where each tuple matches an output injection filename to its nearest TUNE well
@@ -278,7 +389,7 @@ def nearest_tune(df_sequence, well_file):
     last_tune_well = None  # Initially there's no TUNE well
     pairs = []  # List to store the result pairs
     # Iterate over rows
-    for idx, row in df_sequence.iterrows():
+    for row in sequence_injections:
         # If this row is a TUNE row, update last_tune_well
         if row['Sample_Type'] == 'TUNE':
             last_tune_well = row['Well']
@@ -290,60 +401,117 @@ def nearest_tune(df_sequence, well_file):
     pairs = [tuple(well_file[y] for y in x) for x in pairs]
     return pairs
 
+def wait_first_completed(in_flight, poll_seconds = 0.05):
+    """Waits until any one of a number of in-flight Prefect task runs has finished
+
+    :param in_flight: Dictionary of index : `prefect.futures.PrefectFuture` pairs
+    :type in_flight: dict
+    :param poll_seconds: Seconds to wait on each future before checking the next one, defaults to 0.05
+    :type poll_seconds: float, optional
+    :return: Index of a finished task run
+    :rtype: int
+    """
+    while True:
+        for index, future in in_flight.items():
+            if future.wait(timeout = poll_seconds) is not None:
+                return(index)
+
+def bounded_map(prefect_task, items, *args, max_workers = 1, timeout_seconds = None, unpack_items = False, **kwargs):
+    """Submits a Prefect task once for every item with at most max_workers task runs in flight at a time. A new item is 
+    submitted as soon as any in-flight run has finished, so the amount of outstanding work stays bounded without a slow run 
+    holding back the others. Results are returned in the same order as items. With a SequentialTaskRunner this behaves like .map
+
+    :param prefect_task: Prefect task to run, called as prefect_task(item, *args, **kwargs) (or prefect_task(*item, *args, **kwargs) if unpack_items)
+    :type prefect_task: `prefect.Task`
+    :param items: Items to run the task on
+    :type items: list
+    :param max_workers: Maximum number of task runs in flight at once, defaults to 1
+    :type max_workers: int, optional
+    :param timeout_seconds: If provided, per-task run timeout in seconds, defaults to None
+    :type timeout_seconds: float, optional
+    :param unpack_items: Treat each item as a tuple of leading positional task arguments, defaults to False
+    :type unpack_items: bool, optional
+    :return: List of task results, one for each item
+    :rtype: list
+    """
+    if timeout_seconds:
+        prefect_task = prefect_task.with_options(timeout_seconds = timeout_seconds)
+    max_workers = max(int(max_workers), 1)
+    in_flight = {}
+    results = {}
+    for i_item, item in enumerate(items):
+        while len(in_flight) >= max_workers:
+            i_done = wait_first_completed(in_flight)
+            results[i_done] = in_flight.pop(i_done).result()
+        item_args = tuple(item) if unpack_items else (item, )
+        in_flight[i_item] = prefect_task.submit(*item_args, *args, **kwargs)
+    for i_item, future in in_flight.items():
+        results[i_item] = future.result()
+    return([results[i] for i in sorted(results)])
+
 ##################################################################################################
 # Prefect Flows
 ##################################################################################################
-@flow(task_runner = SequentialTaskRunner(), name = "rf_post_run_calibration")
-def rf_post_run_calibration(sequence_dir, demultiplexed_files, input_excel_file, tuneIons_file, msconvert_exe):
+@flow(task_runner = ConcurrentTaskRunner(), name = "rf_post_run_calibration")
+@traced(labels = "sequence_dir")
+def rf_post_run_calibration(sequence_dir, demultiplexed_files, experiment, tuneIons_file, msconvert_exe, max_workers = 1, task_timeout_seconds = None, cache = None):
     """For an experimental sequence, runs the CCS calibration for each injection in the sequence
             
     :param sequence_dir: Path to sequence output directory
     :type sequence_dir: str
     :param demultiplexed_files: List of demultiplexed filenames
     :type demultiplexed_files: list
-    :param input_excel_file: Path to experiment definition .xlsx file
-    :type input_excel_file: str
+    :param experiment: Experiment definition or path to experiment definition file
+    :type experiment: `autonoms.utils_experiment.Experiment` or str
     :param tuneIons_file: Path to .csv file containing standards' m/z values and CCS values
     :type tuneIons_file: str
     :param msconvert_exe: Path to msconvert executable
     :type msconvert_exe: str
+    :param max_workers: Maximum number of msconvert/calibration tasks run in parallel, defaults to 1
+    :type max_workers: int, optional
+    :param task_timeout_seconds: If provided, timeout in seconds for each individual msconvert/calibration task, defaults to None
+    :type task_timeout_seconds: float, optional
+    :param cache: If provided, artifact cache for msconvert and calibration outputs, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
     :return: List of tuples where each tuple matches an output calibrated injection filename to its nearest TUNE well
     :rtype: list
     """
     sequence_name = os.path.basename(sequence_dir)
     print(f"Running post run calibration on sequence {sequence_name}")
     print(demultiplexed_files)
-    df = pd.read_excel(input_excel_file)
-    df = pd.DataFrame(df[df['Sequence'] == sequence_name])
-    df_tune = df[df['Sample_Type'] == "TUNE"]
+    sequence_injections = load_experiment(experiment).sequence_injections(sequence_name)
     file_well = {x : os.path.basename(x).split('-')[-1].split('_')[0] for x in demultiplexed_files}
     well_file = {v : k for (k, v) in file_well.items()}
-    tune_injection_files = df_tune["Well"].apply(lambda x : well_file[x]).values
+    tune_injection_files = [well_file[x.well] for x in sequence_injections if x.sample_type == "TUNE"]
     print(f"converting {tune_injection_files}")
-    tune_mzmls = msconvert.map(tune_injection_files, msconvert_exe)
+    tune_mzmls = bounded_map(msconvert, tune_injection_files, msconvert_exe, max_workers = max_workers, timeout_seconds = task_timeout_seconds, cache = cache)
     print(f"tune_mzmls = {tune_mzmls}")
-    tune_override_strings = ccs_calibration.map(tune_mzmls, tune_injection_files, tuneIons_file, wait_for = [tune_mzmls])
-    copy_pairs = nearest_tune(df, well_file)
+    tune_override_strings = bounded_map(ccs_calibration, list(zip(tune_mzmls, tune_injection_files)), tuneIons_file, max_workers = max_workers, timeout_seconds = task_timeout_seconds, unpack_items = True, cache = cache)
+    copy_pairs = nearest_tune(sequence_injections, well_file)
     uncalibrated_files, calibrated_files = zip(*copy_pairs)
     print(f"got copy pairs {copy_pairs}")
     copy_ccs_calibration.map(uncalibrated_files, calibrated_files)
     return(copy_pairs)
 
 @flow(task_runner=SequentialTaskRunner(), name = "rfbat_prep")
-def rfbat_prep(input_excel_file, output_dir):
+@traced()
+def rfbat_prep(input_excel_file, output_dir, max_workers = 1):
     """Creates instrument files and sequence directories given an input experiment definition file.
 
-    :param input_excel_file: Path to experiment definition .xlsx file
-    :type input_excel_file: str
+    :param input_excel_file: Experiment definition or path to experiment definition .xlsx file
+    :type input_excel_file: `autonoms.utils_experiment.Experiment` or str
     :param output_dir: Desired top output directory
     :type output_dir: str
+    :param max_workers: Number of sequences whose instrument files are written in parallel, defaults to 1
+    :type max_workers: int, optional
     :return: A list of tuples where each tuple corresponds files for a sequence in the original input_excel_file
     :rtype: list
     """
-    sequence_files = create_rf_sequences.submit(input_excel_file, output_dir)
+    sequence_files = create_rf_sequences.submit(input_excel_file, output_dir, max_workers = max_workers)
     return(sequence_files)   
 
 @flow(task_runner = SequentialTaskRunner(), name = "rf_plate_run")
+@traced(lane = "instrument", labels = "rfbat_file")
 def rf_plate_run(rfbat_file, rfcfg_file, start_mh_rf_path, rapid_fire_data_dir, rf_ip, timeout_seconds, test = False, path_convert = {'D:\\' : "M:\\"}):
     """Runs a RapidFire-6560 run for given sequence given its instrument files
 
@@ -374,12 +542,45 @@ def rf_plate_run(rfbat_file, rfcfg_file, start_mh_rf_path, rapid_fire_data_dir,
         rfcfg_file_rf = rfcfg_file_rf.replace(old_s, new_s)
     result = start_rf_ms_connection.submit(start_mh_rf_path)
     result.wait()
-    result = rf_call.submit(rf_ip, rf_function, test = test, rfcfg_file = rfcfg_file_rf, rfbat_file = rfbat_file_rf, rf_base_data_dir = rapid_fire_data_dir, timeout_seconds = timeout_seconds)
+    result = rf_call.submit(rf_ip, rf_function, test = test, rfcfg_file = rfcfg_file_rf, rfbat_file = rfbat_file_rf, rf_base_data_dir = rapid_fire_data_dir, timeout_seconds = timeout_seconds, 
+                            event_callback = report_rf_event)
     result.wait()    
     return(result)
 
-@flow(task_runner = SequentialTaskRunner(), name = "rf_post_run_process")
-def rf_post_run_process(sequence_dir, rapid_fire_data_dir, mh_splitter_exe, pnnl_exe, rf_ip, timeout_seconds, path_convert = {'D:\\' : "M:\\"}):
+@flow(task_runner = SequentialTaskRunner(), name = "rf_remote_split")
+@traced(lane = "instrument", labels = "sequence_dir")
+def rf_remote_split(sequence_dir, rapid_fire_data_dir, rf_ip, timeout_seconds, path_convert = {'D:\\' : "M:\\"}, manifest = None):
+    """Runs the RapidFire UI file splitter on the latest RapidFire run directory of a sequence
+
+    :param sequence_dir: Path to sequence directory
+    :type sequence_dir: str
+    :param rapid_fire_data_dir: Path to top-level directory where RapidFire is configured to output data
+    :type rapid_fire_data_dir: str
+    :param rf_ip: RapidFire IP address on local network
+    :type rf_ip: str
+    :param timeout_seconds: Time (in seconds) to wait for instrument/run timeout
+    :type timeout_seconds: float
+    :param path_convert: A dictionary of file path replacements between the 6560 and RapidFire shared drive (e.g. {"D:" : "M:"} means D: on 6560 corresponds to M: on RapidFire), defaults to {'D:\\' : "M:\\"}
+    :type path_convert: dict, optional
+    :param manifest: If provided, run manifest in which to record the RapidFire run directory, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    :return: Path to the sequence's RapidFire run directory
+    :rtype: str
+    """
+    sequence_name = os.path.basename(sequence_dir)
+    latest_dir = rfu.find_latest_dir(rapid_fire_data_dir, sequence_name = sequence_name)
+    latest_dir_rf = latest_dir
+    for old_s, new_s in path_convert.items():
+        latest_dir_rf = latest_dir_rf.replace(old_s, new_s)
+    # latest_dir_rf = latest_dir.replace("D:\\", "M:\\")
+    remote_file_split_result = rf_call.submit(rf_ip, "remote_file_split", timeout_seconds = timeout_seconds, data_dir = latest_dir_rf).wait().result()
+    if manifest:
+        manifest.update(sequence_name, rf_data_dir = latest_dir, remote_split_done = True)
+    return(latest_dir)
+
+@flow(task_runner = ConcurrentTaskRunner(), name = "rf_post_run_process")
+@traced(labels = "sequence_dir")
+def rf_post_run_process(sequence_dir, rapid_fire_data_dir, mh_splitter_exe, pnnl_exe, rf_ip, timeout_seconds, path_convert = {'D:\\' : "M:\\"}, remote_split = True, max_workers = 1, task_timeout_seconds = None, cache = None, manifest = None, raw_data_placement = "auto", scratch_dir = None):
     """Runs post-acquisition file splitting and demultiplexing
 
     :param sequence_dir: Path to sequence directory
@@ -396,40 +597,187 @@ def rf_post_run_process(sequence_dir, rapid_fire_data_dir, mh_splitter_exe, pnnl
     :type timeout_seconds: float
     :param path_convert: A dictionary of file path replacements between the 6560 and RapidFire shared drive (e.g. {"D:" : "M:"} means D: on 6560 corresponds to M: on RapidFire), defaults to {'D:\\' : "M:\\"}
     :type path_convert: dict, optional
+    :param remote_split: Run the RapidFire UI file splitter first, set to False if rf_remote_split was already run for this sequence, defaults to True
+    :type remote_split: bool, optional
+    :param max_workers: Maximum number of splitting/demultiplexing tasks run in parallel, defaults to 1
+    :type max_workers: int, optional
+    :param task_timeout_seconds: If provided, timeout in seconds for each individual splitting/demultiplexing task, defaults to None
+    :type task_timeout_seconds: float, optional
+    :param cache: If provided, artifact cache for split and demultiplexed outputs, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
+    :param manifest: If provided, run manifest used to skip already completed stages and to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    :param raw_data_placement: How the sequence .d file is placed in the sequence directory (see autonoms.utils_transfer.place_tree), defaults to "auto"
+    :type raw_data_placement: str, optional
+    :param scratch_dir: If provided, directory in which demultiplexing output is written before it is published to the injections directory, defaults to None
+    :type scratch_dir: str, optional
     :return: File paths of output split demultiplexed files
     :rtype: list
     """
     sequence_name = os.path.basename(sequence_dir)
-    latest_dir = rfu.find_latest_dir(rapid_fire_data_dir, sequence_name = sequence_name)
-    latest_dir_rf = latest_dir
-    for old_s, new_s in path_convert.items():
-        latest_dir_rf = latest_dir_rf.replace(old_s, new_s)
-    # latest_dir_rf = latest_dir.replace("D:\\", "M:\\")
-    remote_file_split_result = rf_call.submit(rf_ip, "remote_file_split", timeout_seconds = timeout_seconds, data_dir = latest_dir_rf).wait().result()
-    splitter_file = os.path.join(latest_dir, "RFFileSplitter.log")
-    rfdb_file = os.path.join(latest_dir, "RFDatabase.xml")
-    sequence_file = os.path.join(latest_dir, "sequence1.d")
-    sequence_file_moved = os.path.join(sequence_dir, "sequence1.d")
-    for rf_file in ['batch.log', 'batch.rftime', 'platemap.tofmap.txt', 'RFDatabase.xml']:
-        original_file = os.path.join(latest_dir, rf_file)
-        shutil.copy2(original_file, sequence_dir)
-    if os.path.exists(sequence_file_moved):
-        shutil.rmtree(sequence_file_moved)
-    shutil.copytree(sequence_file, sequence_file_moved)
-    splits = get_splits(splitter_file, rfdb_file, sequence_file)
+    artifacts = manifest.artifacts(sequence_name) if manifest else {}
+    if manifest and manifest.completed(sequence_name, "demuxed"):
+        print(f"Sequence {sequence_name} was already demultiplexed, skipping post-run processing")
+        return(artifacts["demultiplexed_files"])
+    if remote_split and not artifacts.get("remote_split_done"):
+        latest_dir = rf_remote_split(sequence_dir, rapid_fire_data_dir, rf_ip, timeout_seconds, path_convert = path_convert, manifest = manifest)
+    else:
+        latest_dir = artifacts.get("rf_data_dir") or rfu.find_latest_dir(rapid_fire_data_dir, sequence_name = sequence_name)
+    resume_split = manifest and manifest.completed(sequence_name, "split") and all(os.path.exists(x) for x in artifacts.get("split_d_files", []))
+    if resume_split:
+        print(f"Sequence {sequence_name} was already split, resuming from demultiplexing")
+        split_d_files = artifacts["split_d_files"]
+    else:
+        splitter_file = os.path.join(latest_dir, "RFFileSplitter.log")
+        rfdb_file = os.path.join(latest_dir, "RFDatabase.xml")
+        # Plates run in the same multi-plate batch share a RapidFire run directory but each has its own sequence .d file
+        sequence_d_file = get_sequence_d_file(rfdb_file, sequence_name)
+        sequence_file = os.path.join(latest_dir, sequence_d_file)
+        sequence_file_moved = os.path.join(sequence_dir, sequence_d_file)
+        with get_tracer().span("copy_rf_output", sequence = sequence_name):
+            for rf_file in ['batch.log', 'batch.rftime', 'platemap.tofmap.txt', 'RFDatabase.xml']:
+                get_transfer_engine().transfer(os.path.join(latest_dir, rf_file), os.path.join(sequence_dir, rf_file))
+            place_tree(sequence_file, sequence_file_moved, strategy = raw_data_placement)
+        splits = get_splits(splitter_file, rfdb_file, sequence_file, barcode = sequence_name)
+        injections_dir = os.path.join(sequence_dir, 'injections')
+        os.makedirs(injections_dir, exist_ok = True)
+        split_d_files = bounded_map(split_d_file, splits, latest_dir, injections_dir, mh_splitter_exe, max_workers = max_workers, timeout_seconds = task_timeout_seconds, cache = cache)
+        if manifest:
+            manifest.update(sequence_name, "split", rf_data_dir = latest_dir, split_d_files = split_d_files)
+    demultiplexed_files = bounded_map(demultiplex, split_d_files, pnnl_exe, max_workers = max_workers, timeout_seconds = task_timeout_seconds, cache = cache, scratch_dir = scratch_dir)
+    if manifest:
+        manifest.update(sequence_name, "demuxed", demultiplexed_files = demultiplexed_files)
+    _ = bounded_map(rm_tree, split_d_files, max_workers = max_workers)
+    return(demultiplexed_files)
+
+
+@flow(task_runner = ConcurrentTaskRunner(), name = "rf_stream_process")
+@traced(labels = "sequence_dir")
+def rf_stream_process(sequence_dir, rapid_fire_data_dir, mh_splitter_exe, pnnl_exe, timeout_seconds, run_started = None, max_workers = 1, task_timeout_seconds = None, poll_seconds = 5, manifest = None, scratch_dir = None):
+    """Splits and demultiplexes the injections of a sequence while the sequence is still being acquired. The RapidFire batch.rftime is followed as the run 
+    progresses and each injection is split and demultiplexed as soon as its time window is known (see utils_rapidFire.stream_injection_windows). Returns once the batch has finished and all 
+    injections have been processed
+
+    :param sequence_dir: Path to sequence directory
+    :type sequence_dir: str
+    :param rapid_fire_data_dir: Path to top-level directory where RapidFire is configured to output data
+    :type rapid_fire_data_dir: str
+    :param mh_splitter_exe: Path to Agilent file splitter utility executable
+    :type mh_splitter_exe: str
+    :param pnnl_exe: Local path to PNNL Preprocessor executable
+    :type pnnl_exe: str
+    :param timeout_seconds: Time (in seconds) to wait for instrument/run timeout
+    :type timeout_seconds: float
+    :param run_started: Epoch time at which the plate run was started (older RapidFire run directories are ignored), defaults to the current time
+    :type run_started: float, optional
+    :param max_workers: Maximum number of injections processed in parallel, defaults to 1
+    :type max_workers: int, optional
+    :param task_timeout_seconds: If provided, timeout in seconds for each individual splitting/demultiplexing task, defaults to None
+    :type task_timeout_seconds: float, optional
+    :param poll_seconds: Seconds between checks of the RapidFire run output, defaults to 5
+    :type poll_seconds: float, optional
+    :param manifest: If provided, run manifest in which to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    :param scratch_dir: If provided, directory in which demultiplexing output is written before it is published to the injections directory, defaults to None
+    :type scratch_dir: str, optional
+    :return: File paths of output split demultiplexed files (empty if the RapidFire wrote no batch.rftime)
+    :rtype: list
+    """
+    sequence_name = os.path.basename(sequence_dir)
+    if run_started is None:
+        run_started = time.time()
+    print(f"Waiting for the RapidFire run directory of sequence {sequence_name}...")
+    def new_run_dir():
+        latest_dir = rfu.find_latest_dir(rapid_fire_data_dir, sequence_name = sequence_name)
+        if latest_dir and os.path.getmtime(latest_dir) >= run_started:
+            return(latest_dir)
+    data_dir = wait_or_exit(new_run_dir, max(timeout_seconds - (time.time() - run_started), 0), description = f"RapidFire run directory of sequence {sequence_name}", 
+                            initial_seconds = 0.5, max_interval_seconds = poll_seconds)
+    print(f"Streaming injections of sequence {sequence_name} from {data_dir}")
     injections_dir = os.path.join(sequence_dir, 'injections')
     os.makedirs(injections_dir, exist_ok = True)
-    split_d_files = split_d_file.map(splits, latest_dir, injections_dir, mh_splitter_exe)
-    demultiplexed_files = demultiplex.map(split_d_files, pnnl_exe, wait_for = [split_d_files])
-    _ = rm_tree.map(split_d_files, wait_for = [demultiplexed_files])
-    sequence_name = os.path.basename(sequence_dir)
+    split_task, demultiplex_task = split_d_file, demultiplex
+    if task_timeout_seconds:
+        split_task = split_d_file.with_options(timeout_seconds = task_timeout_seconds)
+        demultiplex_task = demultiplex.with_options(timeout_seconds = task_timeout_seconds)
+    max_workers = max(int(max_workers), 1)
+    in_flight = {}
+    results = {}
+    for i_window, split_tuple in enumerate(rfu.stream_injection_windows(data_dir, sequence_name, timeout_seconds, poll_seconds = poll_seconds)):
+        while len(in_flight) >= max_workers:
+            i_done = wait_first_completed(in_flight)
+            results[i_done] = in_flight.pop(i_done).result()
+        print(f"Injection window closed {split_tuple}, queueing for processing")
+        split_future = split_task.submit(split_tuple, data_dir, injections_dir, mh_splitter_exe)
+        demultiplex_future = demultiplex_task.submit(split_future, pnnl_exe, scratch_dir = scratch_dir)
+        rm_tree.submit(split_future, wait_for = [demultiplex_future])
+        in_flight[i_window] = demultiplex_future
+    for i_window, future in in_flight.items():
+        results[i_window] = future.result()
+    demultiplexed_files = [results[i] for i in sorted(results)]
+    for rf_file in ['batch.log', 'batch.rftime', 'platemap.tofmap.txt', 'RFDatabase.xml']:
+        original_file = os.path.join(data_dir, rf_file)
+        if os.path.exists(original_file):
+            get_transfer_engine().transfer(original_file, os.path.join(sequence_dir, rf_file))
+    if manifest and demultiplexed_files:
+        manifest.update(sequence_name, "demuxed", rf_data_dir = data_dir, demultiplexed_files = demultiplexed_files)
     return(demultiplexed_files)
 
+def partition_injections(injection_dir, n_shards):
+    """Splits the injection data files in a directory into contiguous groups for sharded Skyline analysis. Files belonging to the same 
+    injection (e.g. a .d file and its converted .mzML) are always placed in the same group
 
+    :param injection_dir: Path to directory containing injection data files
+    :type injection_dir: str
+    :param n_shards: Desired number of groups
+    :type n_shards: int
+    :return: List of groups, each a list of paths to injection data files
+    :rtype: list
+    """
+    injection_groups = {}
+    for fname in sorted(os.listdir(injection_dir)):
+        stem, ext = os.path.splitext(fname)
+        if ext.lower() not in [".d", ".mzml"]:
+            continue
+        injection_groups.setdefault(stem, []).append(os.path.join(injection_dir, fname))
+    stems = sorted(injection_groups.keys())
+    n_shards = max(min(int(n_shards), len(stems)), 1)
+    shard_size = -(-len(stems) // n_shards)
+    shards = []
+    for i_shard in range(n_shards):
+        shard_stems = stems[i_shard * shard_size : (i_shard + 1) * shard_size]
+        if shard_stems:
+            shards.append([x for stem in shard_stems for x in injection_groups[stem]])
+    return(shards)
+
+def merge_skyline_reports(report_files, output_report_file):
+    """Concatenates Skyline .tsv reports with identical columns into a single report
+
+    :param report_files: Paths to Skyline .tsv report files, in the desired output order
+    :type report_files: list
+    :param output_report_file: Path to merged output report file
+    :type output_report_file: str
+    """
+    header = None
+    with open(output_report_file, 'w') as out_f:
+        for report_file in report_files:
+            with open(report_file, 'r') as in_f:
+                report_header = in_f.readline()
+                if header is None:
+                    header = report_header
+                    out_f.write(header)
+                elif report_header != header:
+                    sys.exit(f"Error - Skyline report {report_file} has different columns than {report_files[0]}")
+                for line in in_f:
+                    if line.strip():
+                        out_f.write(line if line.endswith("\n") else line + "\n")
 
 @flow(task_runner = SequentialTaskRunner(), name = "skyline_analysis")
-def skyline(sequence_dir, skyline_exe, sky_imsdb_file, sky_document_file, transition_list_file, sky_report_file):
-    """Runs Skyline data analysis
+@traced(name = "skyline_analysis", labels = "sequence_dir")
+def skyline(sequence_dir, skyline_exe, sky_imsdb_file, sky_document_file, transition_list_file, sky_report_file, shards = 1, timeout_seconds = None):
+    """Runs Skyline data analysis. With shards > 1 the injections are split into groups which are analyzed by separate, concurrently running 
+    Skyline processes (each working on its own copy of the Skyline files) and the resulting reports are merged into a single report. Sharded runs
+    only yield the merged report, the analyzed documents stay in skyline_files/shard_<N> and no skyline_results.sky is written to the sequence directory
 
     :param sequence_dir: Path to sequence directory
     :type sequence_dir: str
@@ -443,66 +791,301 @@ def skyline(sequence_dir, skyline_exe, sky_imsdb_file, sky_document_file, transi
     :type transition_list_file: str
     :param sky_report_file: Path to Skyline report output template (.skyr) file
     :type sky_report_file: str
+    :param shards: Number of Skyline processes to split the injections between, defaults to 1
+    :type shards: int, optional
+    :param timeout_seconds: If provided, seconds after which a Skyline process is killed, defaults to None
+    :type timeout_seconds: float, optional
     """
     skyline_dir = os.path.join(sequence_dir, "skyline_files")
     os.makedirs(skyline_dir, exist_ok = True)
     injection_dir = os.path.join(sequence_dir, 'injections')
-
-    # Copy files and reassign variables
-    shutil.copy2(sky_imsdb_file, skyline_dir)
-    sky_imsdb_file = os.path.join(skyline_dir, os.path.basename(sky_imsdb_file))
-    shutil.copy2(sky_document_file, skyline_dir)
-    sky_document_file = os.path.join(skyline_dir, os.path.basename(sky_document_file))
-    shutil.copy2(transition_list_file, skyline_dir)
-    transition_list_file = os.path.join(skyline_dir, os.path.basename(transition_list_file))
-    shutil.copy2(sky_report_file, skyline_dir)
-    sky_report_file = os.path.join(skyline_dir, os.path.basename(sky_report_file))
     output_report_file = os.path.join(sequence_dir, "output_report.tsv")
     output_sky_file = os.path.join(sequence_dir, "skyline_results.sky")
+    log_dir = os.path.join(sequence_dir, "logs")
 
-    arg_list = [skyline_exe, f"--in={sky_document_file}", 
-                f"--import-transition-list={transition_list_file}",
-                f"--import-all-files={injection_dir}",
+    def copy_skyline_files(out_dir):
+        os.makedirs(out_dir, exist_ok = True)
+        copied_files = []
+        for fname in [sky_imsdb_file, sky_document_file, transition_list_file, sky_report_file]:
+            shutil.copy2(fname, out_dir)
+            copied_files.append(os.path.join(out_dir, os.path.basename(fname)))
+        return(copied_files)
+
+    def skyline_arg_list(sky_files, import_args, report_file, sky_file):
+        imsdb_file, document_file, transitions_file, report_template_file = sky_files
+        return([skyline_exe, f"--in={document_file}", 
+                f"--import-transition-list={transitions_file}"] + import_args + [
                 f"--report-conflict-resolution=overwrite",
-                f"--report-add={sky_report_file}",
+                f"--report-add={report_template_file}",
                 f"--report-name=MetaboliteReportShort",
                 f"--report-format=tsv",
-                f"--report-file={output_report_file}",
-                f"--out={output_sky_file}"
-                ]
-    cmd = " ".join(arg_list)
-    print(f"Running skyline command {cmd}")
-    subprocess.call(arg_list, shell = True)
-
-def get_args():
-    """Helper function for initializing arguments on command line invocation
-    :return: Parameter arguments
-    :rtype: Namespace
-    """
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input_excel_file', required = True)
-    parser.add_argument('-c', '--configs_toml', required = True)
-    parser.add_argument('-o', '--output_dir', required = True)
-    parser.add_argument('-n', '--no_checks', action = 'store_true')
-    parser.add_argument('-t', '--test', action = "store_true")
-    args = parser.parse_args()
-    args.input_excel_file = os.path.abspath(args.input_excel_file)
-    args.output_dir = os.path.abspath(args.output_dir)
-
-    # Get executable locations from toml config file and data analysis parameters from experiment file
-    execs_d = toml.load(args.configs_toml)
-    df_analysis = pd.read_excel(args.input_excel_file, sheet_name = "data_analysis")
-    analysis_d = df_analysis.set_index("Parameter")["Value"].to_dict()
-    for k, v in {**execs_d, **analysis_d}.items():
-        setattr(args, k, v)
-    
-    return(args)
+                f"--report-file={report_file}",
+                f"--out={sky_file}"
+                ])
+
+    # SkylineCmd is usually called through a .lnk shortcut, which needs the Windows shell
+    use_shell = os.name == "nt"
+    injection_shards = partition_injections(injection_dir, shards) if shards > 1 else []
+    if len(injection_shards) <= 1:
+        # Copy files and reassign variables
+        arg_list = skyline_arg_list(copy_skyline_files(skyline_dir), [f"--import-all-files={injection_dir}"], output_report_file, output_sky_file)
+        cmd = " ".join(arg_list)
+        print(f"Running skyline command {cmd}")
+        get_executor().run("skyline", arg_list, job_name = "skyline", log_dir = log_dir, timeout_seconds = timeout_seconds, shell = use_shell)
+        return
+
+    shard_jobs = []
+    shard_reports = []
+    with ThreadPoolExecutor(max_workers = len(injection_shards)) as shard_pool:
+        for i_shard, shard_files in enumerate(injection_shards):
+            shard_dir = os.path.join(skyline_dir, f"shard_{i_shard}")
+            shard_report_file = os.path.join(shard_dir, "output_report.tsv")
+            shard_sky_file = os.path.join(shard_dir, "skyline_results.sky")
+            arg_list = skyline_arg_list(copy_skyline_files(shard_dir), [f"--import-file={x}" for x in shard_files], shard_report_file, shard_sky_file)
+            cmd = " ".join(arg_list)
+            print(f"Running skyline command for shard {i_shard} ({len(shard_files)} files) {cmd}")
+            shard_jobs.append(shard_pool.submit(get_executor().run, "skyline", arg_list, job_name = f"skyline_shard_{i_shard}", log_dir = log_dir, 
+                                                timeout_seconds = timeout_seconds, shell = use_shell, labels = {**path_labels(sequence_dir), "shard" : i_shard},
+                                                check = False))
+            shard_reports.append(shard_report_file)
+        return_codes = [x.result().returncode for x in shard_jobs]
+    failed_shards = [i for i, (code, report) in enumerate(zip(return_codes, shard_reports)) if code != 0 or not os.path.exists(report)]
+    if failed_shards:
+        sys.exit(f"Error - Skyline analysis failed for shards {failed_shards} of sequence {sequence_dir}")
+    merge_skyline_reports(shard_reports, output_report_file)
+    print(f"Merged {len(shard_reports)} Skyline shard reports into {output_report_file}")
+
+@traced(labels = "sequence_dir")
+def process_sequence(sequence_dir, args, remote_split = True, cache = None, manifest = None):
+    """Runs post-acquisition processing, CCS calibration, and Skyline analysis for a single acquired sequence
+
+    :param sequence_dir: Path to sequence directory
+    :type sequence_dir: str
+    :param args: main flow arguments
+    :type args: Namespace
+    :param remote_split: Run the RapidFire UI file splitter as part of post-processing, defaults to True
+    :type remote_split: bool, optional
+    :param cache: If provided, artifact cache for post-processing outputs, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
+    :param manifest: If provided, run manifest used to skip already completed stages and to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    :return: List of tuples where each tuple matches an output calibrated injection filename to its nearest TUNE well
+    :rtype: list
+    """
+    sequence_name = os.path.basename(sequence_dir)
+    max_workers = getattr(args, "preprocessing_concurrent_tasks", 1)
+    task_timeout_seconds = getattr(args, "preprocessing_task_timeout_seconds", None)
+    demultiplexed_files = rf_post_run_process(sequence_dir, args.rapid_fire_data_dir, args.mh_splitter_exe, args.pnnl_path, args.rf_ip, args.instrument_timeout_seconds, remote_split = remote_split, max_workers = max_workers, task_timeout_seconds = task_timeout_seconds, cache = cache, manifest = manifest, 
+                                              raw_data_placement = getattr(args, "raw_data_placement", "auto"), scratch_dir = getattr(args, "scratch_dir", None))
+    if manifest and manifest.completed(sequence_name, "calibrated"):
+        print(f"Sequence {sequence_name} was already calibrated, skipping calibration")
+        copy_ccs_pairs = [tuple(x) for x in manifest.artifacts(sequence_name)["copy_ccs_pairs"]]
+    else:
+        copy_ccs_pairs = rf_post_run_calibration(sequence_dir, demultiplexed_files, args.experiment, args.tuneIons_file, args.msconvert_exe, max_workers = max_workers, task_timeout_seconds = task_timeout_seconds, cache = cache)
+        if manifest:
+            manifest.update(sequence_name, "calibrated", copy_ccs_pairs = [list(x) for x in copy_ccs_pairs])
+    if manifest and manifest.completed(sequence_name, "analyzed"):
+        print(f"Sequence {sequence_name} was already analyzed, skipping Skyline analysis")
+    else:
+        skyline_res = skyline(sequence_dir, args.skyline_exe, args.sky_imsdb_file, args.sky_document_file, args.transition_list_file, args.sky_report_file, shards = getattr(args, "skyline_shards", 1), 
+                              timeout_seconds = args.data_analysis_timeout_seconds)
+        if manifest:
+            manifest.update(sequence_name, "analyzed", output_report = os.path.join(sequence_dir, "output_report.tsv"))
+    get_tracer().write(os.path.join(sequence_dir, "trace.json"), sequence = sequence_name)
+    return(copy_ccs_pairs)
+
+def check_processing_results(processing_futures):
+    """Waits for background sequence processing to finish and errors if processing failed for any sequence
+
+    :param processing_futures: List of (sequence_dir, `concurrent.futures.Future`) tuples
+    :type processing_futures: list
+    """
+    failed_sequences = []
+    for sequence_dir, future in processing_futures:
+        exc = future.exception()
+        if exc is not None:
+            print(f"Error - processing sequence {sequence_dir} failed with {exc!r}")
+            failed_sequences.append(sequence_dir)
+    if failed_sequences:
+        sys.exit(f"Error - processing failed for sequences {failed_sequences}")
+
+def plate_batches(sequence_files, output_dir, plates_per_batch = 1):
+    """Groups sequences into RapidFire batches. Consecutive sequences sharing the same RF method (.rfcfg) are packed into multi-plate .rfbat 
+    files (written to output_dir/rf_batches) of up to plates_per_batch plates, which the RapidFire runs back-to-back without reloading the method 
+    and batch. With plates_per_batch = 1 every sequence is run from its own .rfbat file
+
+    :param sequence_files: A list of tuples where each tuple corresponds files for a sequence (as returned by rfbat_prep)
+    :type sequence_files: list
+    :param output_dir: Top output directory
+    :type output_dir: str
+    :param plates_per_batch: Maximum number of plates (sequences) per batch, defaults to 1
+    :type plates_per_batch: int, optional
+    :return: A list of tuples (batch .rfbat file, batch .rfcfg file, list of sequence file tuples in the batch), one for each batch in run order
+    :rtype: list
+    """
+    plates_per_batch = max(int(plates_per_batch), 1)
+    groups = []
+    for seq_files_tuple in sequence_files:
+        with open(seq_files_tuple[2], 'rb') as f:
+            rfcfg_content = f.read()
+        if groups and groups[-1][0] == rfcfg_content and len(groups[-1][1]) < plates_per_batch:
+            groups[-1][1].append(seq_files_tuple)
+        else:
+            groups.append((rfcfg_content, [seq_files_tuple]))
+    batches = []
+    for i_batch, (rfcfg_content, batch_sequence_files) in enumerate(groups):
+        rfbat_file, rfcfg_file = batch_sequence_files[0][1], batch_sequence_files[0][2]
+        if len(batch_sequence_files) > 1:
+            rfbat_file = os.path.join(output_dir, "rf_batches", f"batch{i_batch + 1}.rfbat")
+            pu.pack_rfbat_files([x[1] for x in batch_sequence_files], rfbat_file)
+            print(f"Packed sequences {[os.path.basename(x[0]) for x in batch_sequence_files]} into {rfbat_file}")
+        batches.append((rfbat_file, rfcfg_file, batch_sequence_files))
+    return(batches)
+
+def acquire_batch(batch, args, manifest = None):
+    """Runs the plates of a RapidFire batch which were not acquired yet. If some plates of the batch were already acquired (e.g. by an 
+    earlier run with fewer plates per batch), only the remaining plates are run, from their own .rfbat file or from a batch file of 
+    the remaining plates written next to the batch file
+
+    :param batch: Tuple of (batch .rfbat file, batch .rfcfg file, list of sequence file tuples in the batch) (as returned by plate_batches)
+    :type batch: tuple
+    :param args: main flow arguments
+    :type args: Namespace
+    :param manifest: If provided, run manifest used to skip already acquired plates and to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    """
+    rfbat_file, rfcfg_file, batch_sequence_files = batch
+    pending_sequence_files = [x for x in batch_sequence_files if not (manifest and manifest.completed(os.path.basename(x[0]), "acquired"))]
+    sequence_names = [os.path.basename(x[0]) for x in pending_sequence_files]
+    if not pending_sequence_files:
+        print(f"Sequences {[os.path.basename(x[0]) for x in batch_sequence_files]} were already acquired, skipping plate run")
+        return
+    if len(pending_sequence_files) < len(batch_sequence_files):
+        acquired_names = [os.path.basename(x[0]) for x in batch_sequence_files if x not in pending_sequence_files]
+        print(f"Sequences {acquired_names} were already acquired, running only {sequence_names}")
+        if len(pending_sequence_files) == 1:
+            rfbat_file = pending_sequence_files[0][1]
+        else:
+            rfbat_file = pu.pack_rfbat_files([x[1] for x in pending_sequence_files], f"{os.path.splitext(rfbat_file)[0]}_remaining.rfbat")
+    rf_plate_run(rfbat_file, rfcfg_file, args.start_mh_rf_path, args.rapid_fire_data_dir, args.rf_ip, timeout_seconds = args.instrument_timeout_seconds, test = args.test)
+    if manifest:
+        for sequence_name in sequence_names:
+            manifest.update(sequence_name, "acquired")
+
+def remote_split_batch(batch, args, manifest = None):
+    """Runs the RapidFire UI file splitter once on the run directory of a batch, which splits the data of all plates in the batch
+
+    :param batch: Tuple of (batch .rfbat file, batch .rfcfg file, list of sequence file tuples in the batch) (as returned by plate_batches)
+    :type batch: tuple
+    :param args: main flow arguments
+    :type args: Namespace
+    :param manifest: If provided, run manifest used to skip already split sequences and to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    """
+    pending_dirs = [x[0] for x in batch[2]]
+    if manifest:
+        pending_dirs = [x for x in pending_dirs if not (manifest.artifacts(os.path.basename(x)).get("remote_split_done") or manifest.completed(os.path.basename(x), "demuxed"))]
+    if not pending_dirs:
+        return
+    latest_dir = rf_remote_split(pending_dirs[0], args.rapid_fire_data_dir, args.rf_ip, args.instrument_timeout_seconds, manifest = manifest)
+    if manifest:
+        for sequence_dir in pending_dirs[1 : ]:
+            manifest.update(os.path.basename(sequence_dir), rf_data_dir = latest_dir, remote_split_done = True)
+
+def run_sequential(batches, args, cache = None, manifest = None):
+    """Runs sequences without overlap, all sequences are acquired before any data processing begins
+
+    :param batches: A list of tuples where each tuple corresponds to a RapidFire batch of one or more sequences (as returned by plate_batches)
+    :type batches: list
+    :param args: main flow arguments
+    :type args: Namespace
+    :param cache: If provided, artifact cache for post-processing outputs, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
+    :param manifest: If provided, run manifest in which to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    """
+    for batch in batches:
+        acquire_batch(batch, args, manifest = manifest)
+    for batch in batches:
+        remote_split_batch(batch, args, manifest = manifest)
+        for sequence_dir, rfbat_file, rfcfg_file, rfmap_file in batch[2]:
+            copy_ccs_pairs = process_sequence(sequence_dir, args, remote_split = False, cache = cache, manifest = manifest)
+
+def run_pipelined(batches, args, cache = None, manifest = None):
+    """Runs sequences with acquisition and data processing overlapped. After a batch finishes acquiring, the RapidFire UI file splitter
+    is run on it and the remaining processing (splitting, demultiplexing, calibration, Skyline) of its sequences is handed to a background worker while the 
+    next batch acquires. Background processing runs one sequence at a time in acquisition order.
+
+    :param batches: A list of tuples where each tuple corresponds to a RapidFire batch of one or more sequences (as returned by plate_batches)
+    :type batches: list
+    :param args: main flow arguments
+    :type args: Namespace
+    :param cache: If provided, artifact cache for post-processing outputs, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
+    :param manifest: If provided, run manifest used to skip already completed stages and to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    """
+    processing_futures = []
+    with ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "sequence_processing") as executor:
+        for batch in batches:
+            acquire_batch(batch, args, manifest = manifest)
+            # The file splitter drives the RapidFire UI so it has to finish before the next batch is started
+            remote_split_batch(batch, args, manifest = manifest)
+            for sequence_dir, rfbat_file, rfcfg_file, rfmap_file in batch[2]:
+                print(f"Queueing {os.path.basename(sequence_dir)} for background processing")
+                processing_futures.append((sequence_dir, executor.submit(process_sequence, sequence_dir, args, remote_split = False, cache = cache, manifest = manifest)))
+        print("All sequences acquired, waiting for background processing to finish...")
+    check_processing_results(processing_futures)
+
+def run_streaming(sequence_files, args, cache = None, manifest = None):
+    """Runs sequences with injections split and demultiplexed while their plate is still acquiring. CCS calibration and Skyline analysis of 
+    a sequence are run in the background while the next sequence acquires. Sequences for which no injections could be streamed from the batch.rftime 
+    fall back to the standard post-acquisition processing.
+
+    :param sequence_files: A list of tuples where each tuple corresponds files for a sequence (as returned by rfbat_prep)
+    :type sequence_files: list
+    :param args: main flow arguments
+    :type args: Namespace
+    :param cache: If provided, artifact cache for post-processing outputs, defaults to None
+    :type cache: `autonoms.utils_cache.ArtifactCache`, optional
+    :param manifest: If provided, run manifest used to skip already completed stages and to record progress, defaults to None
+    :type manifest: `autonoms.utils_manifest.RunManifest`, optional
+    """
+    max_workers = getattr(args, "preprocessing_concurrent_tasks", 1)
+    task_timeout_seconds = getattr(args, "preprocessing_task_timeout_seconds", None)
+    processing_futures = []
+    with ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "plate_run") as plate_executor, \
+         ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "sequence_processing") as executor:
+        for sequence_dir, rfbat_file, rfcfg_file, rfmap_file in sequence_files:
+            sequence_name = os.path.basename(sequence_dir)
+            demultiplexed_files = []
+            if manifest and manifest.completed(sequence_name, "acquired"):
+                print(f"Sequence {sequence_name} was already acquired, skipping plate run")
+            else:
+                run_started = time.time()
+                plate_future = plate_executor.submit(rf_plate_run, rfbat_file, rfcfg_file, args.start_mh_rf_path, args.rapid_fire_data_dir, args.rf_ip, 
+                                                     timeout_seconds = args.instrument_timeout_seconds, test = args.test)
+                demultiplexed_files = rf_stream_process(sequence_dir, args.rapid_fire_data_dir, args.mh_splitter_exe, args.pnnl_path, args.instrument_timeout_seconds, 
+                                                        run_started = run_started, max_workers = max_workers, task_timeout_seconds = task_timeout_seconds, manifest = manifest, 
+                                                        scratch_dir = getattr(args, "scratch_dir", None))
+                plate_future.result()
+                if manifest:
+                    manifest.update(sequence_name, "acquired")
+            already_demuxed = demultiplexed_files or (manifest and manifest.completed(sequence_name, "demuxed"))
+            if not already_demuxed and not (manifest and manifest.artifacts(sequence_name).get("remote_split_done")):
+                print(f"No streamed injections for sequence {sequence_name}, falling back to post-acquisition processing")
+                rf_remote_split(sequence_dir, args.rapid_fire_data_dir, args.rf_ip, args.instrument_timeout_seconds, manifest = manifest)
+            print(f"Queueing {sequence_name} for background processing")
+            processing_futures.append((sequence_dir, executor.submit(process_sequence, sequence_dir, args, remote_split = False, cache = cache, manifest = manifest)))
+        print("All sequences acquired, waiting for background processing to finish...")
+    check_processing_results(processing_futures)
 
 @flow(task_runner = SequentialTaskRunner())
 def main_flow(args):
     """The main workflow, calling the various sub-flows for running preparing files, running experiments, processing data, then performing analysis.
-    Sequences are run experimentally in the order in which they appear in the input experiment definition file. Data from all sequences is collected before
-    any data processing. 
+    Sequences are run experimentally in the order in which they appear in the input experiment definition file. By default, data from all sequences is collected before
+    any data processing. In pipeline mode (args.pipeline) each sequence is processed in the background while the following sequence acquires. In streaming
+    mode (args.stream) injections are additionally split and demultiplexed while their plate is still running.
 
     :param args: main flow arguments
     :type args: Namespace
@@ -515,34 +1098,73 @@ def main_flow(args):
     
     Press Enter when ready...
     '''
-    if not args.test and not args.no_checks:
+    simulate = getattr(args, "simulate", False)
+    if not args.test and not args.no_checks and not simulate:
         input(check_string)
 
     client = get_client()
     client.create_concurrency_limit(tag = "instrument_run", concurrency_limit = args.instrument_run_concurrent_tasks)
-    # client.create_concurrency_limit(tag = "preprocessing", concurrency_limit = args.preprocessing_concurrent_tasks)
-    client.create_concurrency_limit(tag = "preprocessing", concurrency_limit = 1)
+    client.create_concurrency_limit(tag = "postprocessing", concurrency_limit = args.preprocessing_concurrent_tasks)
     client.create_concurrency_limit(tag = "data_analysis", concurrency_limit = args.data_analysis_concurrent_tasks)
     rfbat_prep.timeout_seconds = args.prep_timeout_seconds
     rf_plate_run.timeout_seconds = args.instrument_timeout_seconds
     run_6560_calibrant.timeout_seconds = args.instrument_timeout_seconds
     skyline.timeout_seconds = args.data_analysis_timeout_seconds
 
-    sequence_files = rfbat_prep(args.input_excel_file, args.output_dir).result()
-    rf_data_dirs = []
-    for sequence_dir, rfbat_file, rfcfg_file, rfmap_file in sequence_files:
-        sequence_rf_data_dir = rf_plate_run(rfbat_file, rfcfg_file, args.start_mh_rf_path, args.rapid_fire_data_dir, args.rf_ip, timeout_seconds = args.instrument_timeout_seconds, test = args.test).result()
-        rf_data_dirs.append(sequence_rf_data_dir)
-    for i_seq, (sequence_dir, rfbat_file, rfcfg_file, rfmap_file) in enumerate(sequence_files):
-        demultiplexed_files = rf_post_run_process(sequence_dir, args.rapid_fire_data_dir, args.mh_splitter_exe, args.pnnl_path, args.rf_ip, args.instrument_timeout_seconds)
-        copy_ccs_pairs = rf_post_run_calibration(sequence_dir, demultiplexed_files, args.input_excel_file, args.tuneIons_file, args.msconvert_exe)
-        skyline_res = skyline(sequence_dir, args.skyline_exe, args.sky_imsdb_file, args.sky_document_file, args.transition_list_file, args.sky_report_file)
+    executor = configure_executor(cores = getattr(args, "executor_cores", None), ram_gb = getattr(args, "executor_ram_gb", None), 
+                                  io_slots = getattr(args, "executor_io_slots", 2), tool_resources = getattr(args, "tool_resources", None), 
+                                  timeout_seconds = getattr(args, "preprocessing_task_timeout_seconds", None))
+    transfer_engine = configure_transfer_engine(max_workers = getattr(args, "transfer_workers", 4), 
+                                                chunk_bytes = int(getattr(args, "transfer_chunk_mb", 64) * 1024 ** 2), 
+                                                verify = getattr(args, "transfer_verify", True))
+    connection_pool = configure_connection_pool(keepalive_seconds = getattr(args, "rf_keepalive_seconds", 60), 
+                                                health_check_seconds = getattr(args, "rf_health_check_seconds", 10), 
+                                                connect_retries = getattr(args, "rf_connect_retries", 3))
+    simulation = None
+    if simulate:
+        simulation = configure_simulation(speedup = getattr(args, "simulation_speedup", 60), 
+                                          injection_overhead_seconds = getattr(args, "simulation_injection_overhead_seconds", 5), 
+                                          plate_load_seconds = getattr(args, "simulation_plate_load_seconds", 30), 
+                                          split_seconds_per_injection = getattr(args, "simulation_split_seconds_per_injection", 0.5), 
+                                          scan_mb_per_injection = getattr(args, "simulation_scan_mb_per_injection", 0))
+        simulation.start_server()
+        args.rf_ip = "localhost"
+
+    cache = None
+    if getattr(args, "cache_dir", None):
+        cache = ArtifactCache(args.cache_dir, max_bytes = int(getattr(args, "cache_max_gb", 100) * 1024 ** 3))
+
+    manifest = RunManifest(os.path.join(args.output_dir, "run_manifest.json"), resume = getattr(args, "resume", False))
+    prepared_files = [manifest.artifacts(x).get("sequence_files") for x in manifest.sequences()]
+    if prepared_files and all(prepared_files) and all(os.path.exists(x[1]) for x in prepared_files):
+        print("Instrument files were already prepared, skipping rfbat_prep")
+        sequence_files = [tuple(x) for x in prepared_files]
+    else:
+        sequence_files = rfbat_prep(args.experiment, args.output_dir, max_workers = getattr(args, "rf_prep_workers", 1)).result()
+        for seq_files_tuple in sequence_files:
+            manifest.update(os.path.basename(seq_files_tuple[0]), "prepared", sequence_files = list(seq_files_tuple))
+    plates_per_batch = getattr(args, "rf_plates_per_batch", 1)
+    if getattr(args, "stream", False):
+        if plates_per_batch > 1:
+            print("Multi-plate batches are not supported in streaming mode, running one plate per batch")
+        run_streaming(sequence_files, args, cache = cache, manifest = manifest)
+    elif getattr(args, "pipeline", False):
+        run_pipelined(plate_batches(sequence_files, args.output_dir, plates_per_batch = plates_per_batch), args, cache = cache, manifest = manifest)
+    else:
+        run_sequential(plate_batches(sequence_files, args.output_dir, plates_per_batch = plates_per_batch), args, cache = cache, manifest = manifest)
+    executor.write_stats(os.path.join(args.output_dir, "executor_stats.json"))
+    transfer_engine.write_stats(os.path.join(args.output_dir, "transfer_stats.json"))
+    get_wait_stats().write(os.path.join(args.output_dir, "wait_stats.json"))
+    connection_pool.close()
+    if simulation is not None:
+        simulation.close()
+    get_tracer().write(os.path.join(args.output_dir, "trace.json"))
 
 def main():
-    """Runs the main autono-ms workflow from the command-line
+    """Runs the main autono-ms workflow from the command-line (see autonoms.cli)
     """
-    args = get_args()
-    main_flow(args)
+    from autonoms.cli import main as cli_main
+    cli_main()
 
 if __name__ == "__main__":
     main()